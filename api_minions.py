@@ -1,17 +1,53 @@
 """ handles the bulk of the tweepy api operations """
 
+import copy
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import tweepy
 
+import cache_minions
+import ids_minions
+import metrics_minions
+import rate_minions
+
+# maximum number of user ids per /users/lookup request
+LOOKUP_USERS_CHUNK_SIZE = 100
+
 class APIMinions(object):
     """ minions tweepy api helper class. """
 
     def __init__(self, app_consumer_key, app_consumer_secret, app_access_key, \
-                 app_access_secret):
+                 app_access_secret, lookup_workers=4, rate_limits=None, metrics=None, \
+                 cache=None):
         """ create the object with empty properties. """
         self.api = None
         self.user = None
 
-        self._follower_ids = []
+        # rate limit budgets, can be shared by objects using the same or other tokens
+        self.rate_limits = rate_limits or rate_minions.RateLimits()
+        self.token = app_access_key
+
+        # tokens requests can be made with, the first is token. each request uses the one
+        # that can call its endpoint soonest, the api objects of the others are kept in
+        # _token_apis
+        self.tokens = [app_access_key]
+        self._token_apis = {}
+
+        # timings and counts of requests and rate limit waits
+        self.metrics = metrics or metrics_minions.RunMetrics()
+
+        # cache of api responses shared by reruns, or replaying a recorded run
+        self.cache = cache
+
+        self._follower_ids = ids_minions.FollowerIds()
+        self.follower_ids_next_cursor = -1
+
+        # concurrent /users/lookup requests and ids not returned by the last lookup
+        self.lookup_workers = lookup_workers
+        self.missing_user_ids = []
+
+        # per thread copies of the tweepy api of each token made by _thread_api
+        self._thread_apis = threading.local()
 
         # instantiate the tweepy api with provided auth tokens
         self._init_api(app_consumer_key, app_consumer_secret, app_access_key, \
@@ -25,7 +61,7 @@ class APIMinions(object):
     @follower_ids.setter
     def follower_ids(self, ids):
         """ set follower ids by appending ids to list """
-        self._follower_ids += ids
+        self._follower_ids.extend(ids)
 
     @property
     def follower_ids_count(self):
@@ -35,22 +71,150 @@ class APIMinions(object):
     def _init_api(self, app_consumer_key, app_consumer_secret, app_access_key, \
                   app_access_secret):
         """ instantiates a tweepy api object. """
+        self.api = self._make_api(app_consumer_key, app_consumer_secret, app_access_key, \
+                                  app_access_secret)
+
+    def _make_api(self, app_consumer_key, app_consumer_secret, app_access_key, \
+                  app_access_secret):
+        """ returns a tweepy api object for app credentials or none. """
         try:
             auth = tweepy.OAuthHandler(app_consumer_key, app_consumer_secret)
             auth.set_access_token(app_access_key, app_access_secret)
 
-            self.api = tweepy.API(auth, wait_on_rate_limit=True, wait_on_rate_limit_notify=True, \
-                compression=True)
+            # rate limits are waited on per endpoint by rate_limits rather than by tweepy
+            return tweepy.API(auth, wait_on_rate_limit=False, compression=True)
         except tweepy.TweepError as err:
             print("get_api error: {0}".format(err))
 
+        return None
+
+    def add_credentials(self, app_consumer_key, app_consumer_secret, app_access_key, \
+                        app_access_secret):
+        """ adds another set of app credentials whose budgets requests can be made with.
+            returns false if its api object could not be made. """
+        if app_access_key in self.tokens:
+            return True
+
+        api = self._make_api(app_consumer_key, app_consumer_secret, app_access_key, \
+                             app_access_secret)
+        if not api:
+            return False
+
+        self._token_apis[app_access_key] = api
+        self.tokens.append(app_access_key)
+        return True
+
+    def _token_api(self, token):
+        """ returns the tweepy api object of a token """
+        return self._token_apis.get(token, self.api)
+
+    def _thread_api(self, token):
+        """ returns a copy of the tweepy api of a token for the calling thread, sharing its
+            auth and settings, so the last response it holds is from the threads own
+            request """
+        thread_apis = getattr(self._thread_apis, 'apis', None)
+        if thread_apis is None:
+            thread_apis = self._thread_apis.apis = {}
+
+        source = self._token_api(token)
+        source_api, api = thread_apis.get(token, (None, None))
+        if source_api is not source:
+            api = copy.copy(source)
+            thread_apis[token] = (source, api)
+
+        return api
+
+    def _call_token(self, endpoint):
+        """ returns the token to make a request to the endpoint with, the one of tokens
+            that can call it soonest """
+        if len(self.tokens) == 1:
+            return self.token
+
+        return self.rate_limits.best_token(self.tokens, endpoint)
+
+    def _update_rate_limits(self, token, endpoint, response):
+        """ updates the endpoint budget of the token from the headers of an api response """
+        if response is not None:
+            self.rate_limits.update_from_headers(token, endpoint, response.headers)
+
+    def call(self, endpoint, method_name, *args, **kwargs):
+        """ calls the tweepy api method named method_name once its endpoint has budget,
+            with the token that can call it soonest, waiting for the reset and retrying if
+            the request is rate limited. with a cache, a cached response is returned
+            without a request and new responses are stored. """
+        cache_key = None
+        if self.cache:
+            cache_key = cache_minions.cache_key(endpoint, args, kwargs)
+            result = self.cache.get(cache_key, self.api)
+            if result is not None:
+                self.metrics.count("api_cache_hits", endpoint=endpoint)
+                return result
+
+        while True:
+            token = self._call_token(endpoint)
+            waited = self.rate_limits.acquire(token, endpoint)
+            if waited:
+                self.metrics.count("rate_limit_wait_seconds", waited, endpoint=endpoint)
+
+            # the calling threads copy of the api holds the response of this call rather
+            # than of a call made by another thread
+            api = self._thread_api(token)
+
+            self.metrics.count("api_requests", endpoint=endpoint)
+            start = self.metrics.clock()
+            try:
+                result = getattr(api, method_name)(*args, **kwargs)
+            except tweepy.RateLimitError as err:
+                self.metrics.count("api_rate_limited", endpoint=endpoint)
+                self._update_rate_limits(token, endpoint, getattr(err, 'response', None))
+                self.rate_limits.exhaust(token, endpoint)
+                continue
+            finally:
+                self.metrics.count("api_request_seconds", self.metrics.clock() - start, \
+                                   endpoint=endpoint)
+
+            self._update_rate_limits(token, endpoint, getattr(api, 'last_response', None))
+            if cache_key:
+                self.cache.put(cache_key, endpoint, result)
+            return result
+
+    def rate_limited(self, endpoint, method_name):
+        """ returns a wrapper for the tweepy api method named method_name that calls it
+            through call, keeping its pagination mode so it can be used with tweepy.Cursor. """
+        def rate_limited_method(*args, **kwargs):
+            return self.call(endpoint, method_name, *args, **kwargs)
+
+        method = getattr(self.api, method_name)
+        if hasattr(method, 'pagination_mode'):
+            rate_limited_method.pagination_mode = method.pagination_mode
+
+        return rate_limited_method
+
+    def refresh_rate_limits(self):
+        """ sets the endpoint budgets for each token from an api rate_limit_status request.
+            a replayed run makes no requests and is not rate limited. """
+        if self.cache and self.cache.replay:
+            return
+
+        for token in self.tokens:
+            try:
+                status = self._token_api(token).rate_limit_status()
+                self.rate_limits.update_from_status(token, status)
+            except tweepy.TweepError as err:
+                print("refresh_rate_limits error: {0}".format(err))
+
+    def get_follower_pages(self, cursor=-1):
+        """ returns a page iterator of user objects from api /followers/list requests """
+        return tweepy.Cursor(self.rate_limited(rate_minions.FOLLOWERS_LIST, "followers"), \
+                             user_id=self.user.id, cursor=cursor, count=200).pages()
+
     def get_users(self, user_ids):
         """ gets tweepy user objects for a list of user ids. """
 
         users = []
         for uid in user_ids:
             try:
-                user = self.api.get_user(uid)
+                user = self.call(rate_minions.USERS_SHOW, "get_user", uid)
                 users.append(user)
             except tweepy.TweepError as err:
                 print("get_users error: {0}".format(err))
@@ -58,13 +222,58 @@ class APIMinions(object):
 
         return users
 
-    def get_follower_ids(self):
-        """ gets the follower ids for the users followers from api.followers_ids request. """
+    def _lookup_users_chunk(self, user_ids):
+        """ gets tweepy user objects for up to 100 user ids with a single /users/lookup request.
+            returns an empty list if none of the ids could be found. """
+        try:
+            return self.call(rate_minions.USERS_LOOKUP, "lookup_users", user_ids=user_ids)
+        except tweepy.TweepError as err:
+            # the api responds with an error if no ids in the request match a user
+            print("lookup_users error: {0}".format(err))
+            return []
+
+    def lookup_users(self, user_ids):
+        """ gets tweepy user objects for a list of user ids using /users/lookup requests of
+            100 ids each, made concurrently. users are returned in the order of user_ids, ids
+            that were not returned (suspended, deactivated or failed) are set in
+            missing_user_ids. """
+
+        user_ids = list(user_ids)
+        chunks = [user_ids[i:i + LOOKUP_USERS_CHUNK_SIZE]
+                  for i in range(0, len(user_ids), LOOKUP_USERS_CHUNK_SIZE)]
+
+        users_by_id = {}
+        if chunks:
+            workers = max(1, min(self.lookup_workers, len(chunks)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for chunk_users in executor.map(self._lookup_users_chunk, chunks):
+                    for user in chunk_users:
+                        users_by_id[user.id] = user
+
+        self.missing_user_ids = [uid for uid in user_ids if uid not in users_by_id]
 
-        self.follower_ids = []
-        follower_ids = []
-        follower_id_pages = tweepy.Cursor(self.api.followers_ids, user_id=self.user.id,
-                                          cursor=-1, count=5000).pages()
+        return [users_by_id[uid] for uid in user_ids if uid in users_by_id]
+
+    def get_follower_ids(self, cursor=-1, follower_ids=None, on_page=None, stop=None, \
+                         keep_ids=True):
+        """ gets the follower ids for the users followers from api.followers_ids request.
+            paging starts from cursor after any follower_ids already collected, and on_page
+            is called with each page of ids and the next cursor so progress can be saved.
+            paging ends early if stop returns true for the ids collected so far, the cursor
+            to continue from is kept in follower_ids_next_cursor. if keep_ids is false the
+            pages are only passed to on_page and follower_ids is left empty. """
+
+        follower_ids = ids_minions.FollowerIds(follower_ids)
+        self._follower_ids = follower_ids
+        self.follower_ids_next_cursor = cursor
+
+        # a saved next cursor of 0 means the listing was already completely collected
+        if cursor == 0:
+            return
+
+        follower_id_pages = tweepy.Cursor(self.rate_limited(rate_minions.FOLLOWERS_IDS, \
+                                                            "followers_ids"),
+                                          user_id=self.user.id, cursor=cursor, count=5000).pages()
         while True:
             try:
                 follower_id_page = next(follower_id_pages)
@@ -74,6 +283,12 @@ class APIMinions(object):
             except StopIteration:
                 break
 
-            follower_ids.extend(follower_id_page)
+            if keep_ids:
+                follower_ids.extend(follower_id_page)
+
+            self.follower_ids_next_cursor = follower_id_pages.next_cursor
+            if on_page:
+                on_page(follower_id_page, follower_id_pages.next_cursor)
 
-        self.follower_ids = follower_ids
+            if stop and stop(follower_ids):
+                break
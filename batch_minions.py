@@ -0,0 +1,178 @@
+""" runs follower processing for many twitter users concurrently """
+
+import os
+import sys
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# keys of a set of app credentials in a json batch file
+CREDENTIAL_KEYS = ("consumer_key", "consumer_secret", "access_key", "access_secret")
+
+# concurrent accounts per set of app credentials, accounts waiting on a rate limit leave
+# the other accounts sharing their credentials free to make requests
+ACCOUNTS_PER_CREDENTIALS = 4
+
+class BatchAccount(object):
+    """ a twitter user to process, the app credentials to process it with and the other
+        credentials whose budgets its requests can also use. """
+
+    def __init__(self, user, credentials, shared_credentials=None):
+        self.user = user
+        self.credentials = credentials
+        self.shared_credentials = shared_credentials or []
+
+        # captured output, whether processing completed and the structured run result
+        self.output = ""
+        self.success = False
+        self.result = None
+
+        # why the batch file entry cannot be processed, accounts with an error are not run
+        self.error = None
+
+class ThreadOutput(object):
+    """ stdout replacement that captures writes from registered threads, so the output of
+        concurrently processed accounts is not interleaved. """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._buffers = {}
+        self._lock = threading.Lock()
+
+    def capture(self):
+        """ starts capturing output written by the calling thread """
+        with self._lock:
+            self._buffers[threading.get_ident()] = []
+
+    def release(self):
+        """ stops capturing output for the calling thread and returns the captured writes """
+        with self._lock:
+            return self._buffers.pop(threading.get_ident(), [])
+
+    def replay(self, writes):
+        """ writes captured writes to the underlying stream as one uninterrupted block, one
+            write at a time so wrapping streams such as colorama still reset per write """
+        with self._lock:
+            for text in writes:
+                self.stream.write(text)
+
+    def write(self, text):
+        """ writes to the calling threads capture buffer or the underlying stream """
+        buffer = self._buffers.get(threading.get_ident())
+        if buffer is not None:
+            buffer.append(text)
+            return len(text)
+
+        with self._lock:
+            return self.stream.write(text)
+
+    def flush(self):
+        """ flushes the underlying stream """
+        self.stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+def get_env_credentials():
+    """ returns app credentials from the TWITTER_* environment variables """
+    return {"consumer_key": os.environ.get('TWITTER_CONSUMER_KEY', 'None'),
+            "consumer_secret": os.environ.get('TWITTER_CONSUMER_SECRET', 'None'),
+            "access_key": os.environ.get('TWITTER_ACCESS_KEY', 'None'),
+            "access_secret": os.environ.get('TWITTER_ACCESS_SECRET', 'None')}
+
+def load_batch_config(path):
+    """ reads users and credentials from a batch file. a json file has a "users" list of
+        @names or ids, or objects with a "user" and the index of their "credentials", and
+        a "credentials" list of objects with consumer_key, consumer_secret, access_key and
+        access_secret. any other file is read as one user per line with '#' comments and
+        the environment credentials. users without a credentials index are spread across
+        the credentials and share the others, each of their requests is made with the
+        credentials that can make it soonest. users with an index only use those. returns
+        a list of BatchAccount objects, with an error set for entries without a user or
+        with credentials that are not in the list, or none if the file cannot be read. """
+
+    try:
+        with open(path) as batch_file:
+            content = batch_file.read()
+    except OSError as err:
+        print("load_batch_config error: {0}".format(err))
+        return None
+
+    try:
+        config = json.loads(content)
+    except ValueError:
+        config = None
+
+    if not isinstance(config, dict):
+        users = [line.split("#")[0].strip() for line in content.splitlines()]
+        config = {"users": [user for user in users if user]}
+
+    credentials = config.get("credentials") or [get_env_credentials()]
+    valid_credentials = [entry for entry in credentials if isinstance(entry, dict) and \
+                         all(key in entry for key in CREDENTIAL_KEYS)]
+
+    accounts = []
+    for index, user in enumerate(config.get("users", [])):
+        # spread accounts across credentials unless one is given for the user
+        credentials_index = index % len(credentials)
+        shared = True
+        if isinstance(user, dict):
+            shared = "credentials" not in user
+            credentials_index = user.get("credentials", credentials_index)
+            user = user.get("user", "")
+
+        account = BatchAccount(str(user), None)
+        if not isinstance(credentials_index, int) or \
+           not 0 <= credentials_index < len(credentials):
+            account.error = "no credentials {0} in the batch file".format(credentials_index)
+        elif not isinstance(credentials[credentials_index], dict) or \
+             not all(key in credentials[credentials_index] for key in CREDENTIAL_KEYS):
+            account.error = "credentials {0} need {1}".format(credentials_index, \
+                                                              ", ".join(CREDENTIAL_KEYS))
+        else:
+            account.credentials = credentials[credentials_index]
+            if shared:
+                account.shared_credentials = [entry for entry in valid_credentials
+                                              if entry is not account.credentials]
+        accounts.append(account)
+
+    return accounts
+
+def run_accounts(accounts, run_account, workers=None):
+    """ calls run_account for each BatchAccount on a thread pool, capturing the output
+        of each account and printing it as a block when the account finishes. run_account
+        returns true if processing completed. returns the list of accounts. """
+
+    if not accounts:
+        return accounts
+
+    if not workers:
+        credential_sets = len({json.dumps(account.credentials, sort_keys=True)
+                               for account in accounts})
+        workers = min(len(accounts), credential_sets * ACCOUNTS_PER_CREDENTIALS)
+
+    stdout = sys.stdout
+    thread_output = ThreadOutput(stdout)
+    sys.stdout = thread_output
+
+    def run_captured(account):
+        """ runs an account with its output captured. """
+        thread_output.capture()
+        try:
+            account.success = bool(run_account(account))
+        except Exception as err:
+            print("* batch error for {0}: {1}".format(account.user, err))
+        finally:
+            writes = thread_output.release()
+
+        account.output = "".join(writes)
+        thread_output.replay(writes)
+        return account
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            list(executor.map(run_captured, accounts))
+    finally:
+        sys.stdout = stdout
+
+    return accounts
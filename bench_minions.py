@@ -0,0 +1,184 @@
+""" benchmarks twitter-minions runs against the offline fake api at synthetic scales """
+
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import argparse
+import resource
+import tempfile
+import contextlib
+import multiprocessing
+
+import prettytable
+
+import api_minions
+import fake_minions
+import rate_minions
+import twitter_minions
+
+# follower counts benchmarked by default
+BENCH_SIZES = [10000, 100000, 1000000]
+
+# runs made in order against one database per size. each run after the first applies a
+# step of churn to the followers first, the fast run has no unfollows so it can end early.
+BENCH_SCENARIOS = [
+    {"name": "update", "update": True, "fast": False, "new": 0, "lost": 0, "changed": 0},
+    {"name": "ids", "update": False, "fast": False, "new": 50, "lost": 20, "changed": 0},
+    {"name": "fast", "update": False, "fast": True, "new": 50, "lost": 0, "changed": 0},
+    {"name": "refresh", "update": False, "fast": True, "new": 10, "lost": 0, "changed": 100,
+     "refresh": 10},
+    {"name": "stream", "update": False, "fast": False, "new": 50, "lost": 20, "changed": 0,
+     "stream": True},
+]
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="benchmarks twitter-minions runs against an " \
+                                                 "offline fake api with synthetic followers.")
+
+    parser.add_argument("-s", "--sizes", type=int, nargs="+", default=BENCH_SIZES, \
+                        metavar="N", help="follower counts to benchmark")
+    parser.add_argument("--scenarios", nargs="+", default=None, metavar="NAME", \
+                        choices=[scenario['name'] for scenario in BENCH_SCENARIOS], \
+                        help="runs to benchmark, in order (default all)")
+    parser.add_argument("--seed", type=int, default=1, help="synthetic followers seed")
+    parser.add_argument("--json", dest="json_path", metavar="FILE", default=None, \
+                        help="also write the results to a json file")
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark databases")
+
+    return parser.parse_args()
+
+def make_fake_api_minions(graph, clock):
+    """ returns an APIMinions object whose tweepy api is a fake api serving the graph, with
+        rate limit waits taken in virtual time. """
+    rate_limits = rate_minions.RateLimits(clock=clock.time, sleep=clock.sleep, notify=False)
+    apim = api_minions.APIMinions("bench", "bench", "bench", "bench", rate_limits=rate_limits)
+    apim.api = fake_minions.FakeTwitterAPI(graph, clock)
+
+    return apim
+
+def run_scenario(size, seed, steps, scenario, database_dir):
+    """ runs process_user for a scenario after applying the churn of the runs before it.
+        returns a result dictionary. """
+
+    graph = fake_minions.FakeFollowerGraph(size, seed)
+    for step in steps:
+        graph.advance(new=step['new'], lost=step['lost'], changed=step['changed'])
+
+    clock = fake_minions.FakeClock()
+    apim = make_fake_api_minions(graph, clock)
+
+    apim.refresh_rate_limits()
+    apim.api.requests.clear()
+
+    virtual_start = clock.time()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+
+    # run output is discarded, its colours and tables are not part of the measurement
+    with contextlib.redirect_stdout(io.StringIO()):
+        success = twitter_minions.process_user(apim, graph.owner_id, \
+                                               update=scenario['update'], interactive=False, \
+                                               refresh=scenario.get('refresh', 0), \
+                                               fast=scenario['fast'], database_dir=database_dir, \
+                                               stream=scenario.get('stream', False))
+
+    database_path = twitter_minions.get_user_database_path(graph.owner_id, database_dir)
+
+    return {"size": size, "scenario": scenario['name'], "success": success,
+            "requests": sum(apim.api.requests.values()),
+            "requests_by_endpoint": dict(apim.api.requests),
+            "spans": apim.metrics.report()['spans'],
+            "wall_time": round(time.perf_counter() - wall_start, 3),
+            "cpu_time": round(time.process_time() - cpu_start, 3),
+            "api_time": round(clock.time() - virtual_start, 1),
+            "peak_memory_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "database_mib": round(os.path.getsize(database_path) / 1048576, 1)}
+
+def _scenario_process(connection, *args):
+    """ runs a scenario in a child process and sends back its result """
+    try:
+        connection.send(run_scenario(*args))
+    except Exception as err:
+        connection.send({"error": repr(err)})
+    finally:
+        connection.close()
+
+def run_benchmark(sizes, scenarios, seed=1, keep=False):
+    """ runs the scenarios in order for each size. every run is made in its own process so
+        its peak memory is measured separately. returns a list of result dictionaries. """
+
+    results = []
+    for size in sizes:
+        database_dir = tempfile.mkdtemp(prefix="minions-bench-{0}-".format(size))
+
+        for index, scenario in enumerate(scenarios):
+            parent_connection, child_connection = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_scenario_process, \
+                                              args=(child_connection, size, seed, \
+                                                    scenarios[:index + 1], scenario, \
+                                                    database_dir))
+            process.start()
+            child_connection.close()
+            result = parent_connection.recv()
+            process.join()
+
+            if "error" in result:
+                result.update({"size": size, "scenario": scenario['name'], "success": False})
+            results.append(result)
+            print_result(result)
+
+        if keep:
+            print("* databases kept in: {0}".format(database_dir))
+        else:
+            shutil.rmtree(database_dir, ignore_errors=True)
+
+    return results
+
+def print_result(result):
+    """ prints a one line progress note for a result """
+    if "error" in result:
+        print("{0:>8} {1:<8} error: {2}".format(result['size'], result['scenario'], \
+                                                result['error']))
+    else:
+        print("{0:>8} {1:<8} {2:.2f}s".format(result['size'], result['scenario'], \
+                                               result['wall_time']))
+
+def print_results(results):
+    """ prints a table of benchmark results """
+    table = prettytable.PrettyTable(["followers", "run", "requests", "wall s", "cpu s", \
+                                     "api s", "peak MiB", "db MiB"])
+    table.align = "r"
+    for result in results:
+        if "error" in result:
+            continue
+        table.add_row([result['size'], result['scenario'], result['requests'], \
+                       result['wall_time'], result['cpu_time'], result['api_time'], \
+                       result['peak_memory_mib'], result['database_mib']])
+
+    print(table)
+    print("api s is the simulated time including rate limit waits.")
+
+def main():
+    """ runs the benchmark and prints the results. """
+    user_args = get_arguments()
+
+    scenarios = BENCH_SCENARIOS
+    if user_args.scenarios:
+        scenarios = [scenario for scenario in BENCH_SCENARIOS
+                     if scenario['name'] in user_args.scenarios]
+
+    results = run_benchmark(user_args.sizes, scenarios, user_args.seed, user_args.keep)
+    print_results(results)
+
+    if user_args.json_path:
+        with open(user_args.json_path, "w") as json_file:
+            json.dump(results, json_file, indent=2)
+
+    if not all(result['success'] for result in results):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+""" an on-disk cache of api responses for reruns and for replaying recorded runs offline """
+
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+
+import tweepy
+
+# seconds a cached response is served for before it is requested again
+CACHE_TTL = 15 * 60
+
+# total size of the stored responses before the least recently used are evicted
+CACHE_MAX_MIB = 512
+
+# zlib compression level for stored responses
+CACHE_COMPRESSION_LEVEL = 6
+
+# seconds to wait for another process writing to the cache
+CACHE_LOCK_TIMEOUT = 60
+
+class CacheMissError(Exception):
+    """ raised in replay mode for a request whose response is not in the cache """
+
+def encode_result(result):
+    """ returns json text for the result of a tweepy api method: user models as their api
+        json, lists of them and the (items, cursors) tuples of cursor paged methods """
+    def encode(value):
+        if isinstance(value, tweepy.models.User):
+            return {"user": value._json}
+        if isinstance(value, tuple):
+            return {"tuple": [encode(item) for item in value]}
+        if isinstance(value, list):
+            return [encode(item) for item in value]
+        return value
+
+    return json.dumps(encode(result), separators=(',', ':'))
+
+def decode_result(json_text, api):
+    """ returns the tweepy api method result from json text made by encode_result, parsing
+        users into models bound to api """
+    def decode(value):
+        if isinstance(value, dict):
+            if "user" in value:
+                return tweepy.models.User.parse(api, value["user"])
+            return tuple(decode(item) for item in value["tuple"])
+        if isinstance(value, list):
+            return [decode(item) for item in value]
+        return value
+
+    return decode(json.loads(json_text))
+
+def cache_key(endpoint, args, kwargs):
+    """ returns the cache key of a request from its endpoint and parameters """
+    params = json.dumps([endpoint, list(args), kwargs], sort_keys=True, default=str)
+    return hashlib.blake2b(params.encode('utf-8'), digest_size=16).hexdigest()
+
+class PageCache(object):
+    """ api responses stored in an sqlite file, keyed by endpoint and request parameters
+        such as the user and cursor. a response is served until it is ttl seconds old and
+        the least recently used responses are evicted once the total size is over max_mib.
+        in replay mode responses are served whatever their age and a request that is not
+        cached raises CacheMissError, so a recorded run can be repeated without the api.
+        safe to share between threads. """
+
+    def __init__(self, path, ttl=CACHE_TTL, max_mib=CACHE_MAX_MIB, replay=False, \
+                 clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = int(max_mib * 1048576)
+        self.replay = replay
+        self.clock = clock
+
+        self.connection = None
+        self.size = 0
+        self._lock = threading.Lock()
+
+        sql_create_pages_table = "CREATE TABLE IF NOT EXISTS 'api_pages' (" \
+            "'page_key' VARCHAR PRIMARY KEY  NOT NULL," \
+            "'endpoint' VARCHAR," \
+            "'response' BLOB," \
+            "'size' INTEGER," \
+            "'time_stored' REAL," \
+            "'time_used' REAL);"
+
+        sql_create_pages_index = "CREATE INDEX IF NOT EXISTS 'api_pages_time_used' " \
+            "ON 'api_pages' ('time_used');"
+
+        try:
+            self.connection = sqlite3.connect(path, timeout=CACHE_LOCK_TIMEOUT, \
+                                              check_same_thread=False)
+            self.cursor = self.connection.cursor()
+            self.cursor.execute("PRAGMA journal_mode=WAL;")
+            self.cursor.execute("PRAGMA synchronous=NORMAL;")
+            self.cursor.execute(sql_create_pages_table)
+            self.cursor.execute(sql_create_pages_index)
+            self.connection.commit()
+
+            self.cursor.execute("SELECT COALESCE(SUM(size), 0) FROM api_pages;")
+            self.size = self.cursor.fetchone()[0]
+
+        except sqlite3.Error as err:
+            print("page_cache error: {0}".format(err))
+            self.connection = None
+
+    def close_connection(self):
+        """ closes the cache connection """
+        with self._lock:
+            if self.connection:
+                self.connection.close()
+                self.connection = None
+
+    def get(self, key, api):
+        """ returns the cached result for a key, or none if it is not cached or has expired.
+            raises CacheMissError in replay mode if it is not cached. """
+        with self._lock:
+            row = None
+            try:
+                if self.connection:
+                    self.cursor.execute("SELECT response, time_stored FROM api_pages " \
+                                        "WHERE page_key=?;", (key,))
+                    row = self.cursor.fetchone()
+
+                    if row and (self.replay or self.clock() - row[1] < self.ttl):
+                        self.cursor.execute("UPDATE api_pages SET time_used=? " \
+                                            "WHERE page_key=?;", (self.clock(), key))
+                        self.connection.commit()
+                    else:
+                        row = None
+
+            except sqlite3.Error as err:
+                print("page_cache get error: {0}".format(err))
+                row = None
+
+        if row:
+            return decode_result(zlib.decompress(row[0]).decode('utf-8'), api)
+
+        if self.replay:
+            raise CacheMissError("response not in the api cache: {0}".format(self.path))
+
+        return None
+
+    def put(self, key, endpoint, result):
+        """ stores the result for a key, evicting the least recently used results if the
+            cache is over its size """
+        response = zlib.compress(encode_result(result).encode('utf-8'), \
+                                 CACHE_COMPRESSION_LEVEL)
+        now = self.clock()
+
+        with self._lock:
+            if not self.connection:
+                return
+
+            try:
+                self.cursor.execute("SELECT size FROM api_pages WHERE page_key=?;", (key,))
+                row = self.cursor.fetchone()
+                self.size -= row[0] if row else 0
+
+                self.cursor.execute("INSERT OR REPLACE INTO api_pages (page_key, endpoint, " \
+                                    "response, size, time_stored, time_used) " \
+                                    "VALUES (?, ?, ?, ?, ?, ?);", \
+                                    (key, endpoint, response, len(response), now, now))
+                self.size += len(response)
+
+                while self.size > self.max_bytes:
+                    self.cursor.execute("SELECT page_key, size FROM api_pages " \
+                                        "ORDER BY time_used LIMIT 100;")
+                    evicted = self.cursor.fetchall()
+                    if not evicted:
+                        break
+                    for page_key, size in evicted:
+                        if self.size <= self.max_bytes:
+                            break
+                        self.cursor.execute("DELETE FROM api_pages WHERE page_key=?;", \
+                                            (page_key,))
+                        self.size -= size
+
+                self.connection.commit()
+
+            except sqlite3.Error as err:
+                print("page_cache put error: {0}".format(err))
+                self._rollback()
+
+    def _rollback(self):
+        """ rolls back a failed write and recounts the size of the stored responses """
+        try:
+            self.connection.rollback()
+            self.cursor.execute("SELECT COALESCE(SUM(size), 0) FROM api_pages;")
+            self.size = self.cursor.fetchone()[0]
+
+        except sqlite3.Error as err:
+            print("page_cache rollback error: {0}".format(err))
@@ -3,19 +3,112 @@
 import os
 import json
 import sqlite3
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+
+import diff_minions
+import ids_minions
+import metrics_minions
+import profile_minions
+import snapshot_minions
+
+# default number of buffered follower rows written per transaction
+DB_BATCH_SIZE = 1000
+
+# number of follower ids read per fetchmany call
+DB_ID_FETCH_SIZE = 10000
+
+# sqlite page cache size in KiB used for each connection
+DB_CACHE_SIZE_KIB = 65536
+
+# number of stored profiles sampled to train a compression dictionary
+PROFILE_DICT_SAMPLES = 2000
+
+# number of newest follower ids kept from each listing to align the next fast listing
+HEAD_IDS_SIZE = 200
+
+# stale followers considered per follower picked by the priority refresh order
+REFRESH_PRIORITY_CANDIDATES = 4
+
+# events table event types
+EVENT_FOLLOW = "follow"
+EVENT_UNFOLLOW = "unfollow"
+
+# stats table names of the running totals kept by the follower write paths
+STAT_FOLLOWERS = "followers"
+STAT_REACH = "reach"
+STAT_FOLLOWS = "follows"
+STAT_UNFOLLOWS = "unfollows"
+STAT_TENURE_DAYS = "unfollow_tenure_days"
+
+# lower bounds in days of the tenure_stats buckets that unfollows are counted in
+TENURE_BUCKET_DAYS = (0, 1, 7, 30, 90, 365, 1095)
+
+# number of most recent days of daily_stats in a stats report
+REPORT_DAYS = 30
+
+# default number of ranked profile search results
+SEARCH_LIMIT = 20
+
+# bm25 weights of the name, screen_name, description and location search columns
+SEARCH_WEIGHTS = (10.0, 10.0, 2.0, 1.0)
+
+# sync_state names for resumable api paging
+SYNC_FOLLOWER_IDS = "followers_ids"
+SYNC_FOLLOWERS_LIST = "followers_list"
+
+# index of the followers count in the profile columns of a FollowerRow
+_FOLLOWERS_COUNT_INDEX = [column for column, column_type, key
+                          in profile_minions.PROFILE_COLUMNS].index("user_followers_count")
+
+class FollowerRow(namedtuple("FollowerRow", ("user_id", "name", "screen_name", "profile_hash",
+                                             "profile_data", "dict_id", "description",
+                                             "location", "profile_columns"))):
+    """ a followers table row built from a user object. profile_data is the compressed
+        profile json stored under profile_hash, compressed with the dictionary dict_id,
+        the description and location are for the search index and profile_columns are the
+        values of the PROFILE_COLUMNS. """
+    __slots__ = ()
+
+    @property
+    def followers_count(self):
+        """ returns the followers count of the follower or none """
+        return self.profile_columns[_FOLLOWERS_COUNT_INDEX]
 
 class DBMinions(object):
     """ minions sqlite3 database helper class. """
 
-    def __init__(self, path):
+    def __init__(self, path, batch_size=DB_BATCH_SIZE, create=None, metrics=None, stream=False):
         self._path = ""
+
+        # streamed reconciliation keeps its temporary tables on disk rather than in memory
+        self.stream = stream
+
+        # timings of database work and counts of rows and profile bytes written
+        self.metrics = metrics or metrics_minions.RunMetrics()
+
+        # create a missing database without asking if true, or never if false
+        self.create = create
         self._connection = None
         self._cursor = None
 
+        # id of the current run in the runs table
+        self.run_id = None
+
+        # latest profile compression dictionary and dictionaries loaded by id
+        self.profile_dict_id = None
+        self._profile_dicts = {}
+
+        # buffered follower rows waiting to be written in a single transaction
+        self.batch_size = batch_size
+        self._insert_rows = []
+        self._update_rows = []
+
         self.path = path
 
         # list of followers ids from db
-        self._follower_ids = []
+        self._follower_ids = ids_minions.FollowerIds()
 
         self.unfollower_ids = []
         self.unfollowers = []
@@ -25,6 +118,7 @@ class DBMinions(object):
         # processing counters
         self.inserted_followers = 0
         self.updated_followers = 0
+        self.unchanged_followers = 0
         self.removed_followers = 0
         self.inserted_unfollowers = 0
 
@@ -40,13 +134,18 @@ class DBMinions(object):
 
         if not os.path.isfile(self.path):
             print("* database '{0}' does not exist.".format(self.path))
-            create_db = input("  do you wish to create it? (y/n): ")
+            create_db = "y" if self.create else "n"
+            if self.create is None:
+                create_db = input("  do you wish to create it? (y/n): ")
 
             if create_db.lower().strip() == "y":
                 self._create_database()
         else:
             self._create_connection()
 
+        if self.connection:
+            self._upgrade_database()
+
     @property
     def connection(self):
         """ returns database connection """
@@ -75,13 +174,27 @@ class DBMinions(object):
     @follower_ids.setter
     def follower_ids(self, ids):
         """ set follower ids by appending ids to list """
-        self._follower_ids += ids
+        self._follower_ids.extend(ids)
 
     @property
     def follower_ids_count(self):
         """ returns number of follower ids """
         return len(self._follower_ids)
 
+    def reset_counters(self):
+        """ clears the processing counters and unfollowers of the previous run, for runs
+            made on a connection that is kept open """
+        self.run_id = None
+        self.unfollower_ids = []
+        self.unfollowers = []
+        self.new_follower_ids = []
+
+        self.inserted_followers = 0
+        self.updated_followers = 0
+        self.unchanged_followers = 0
+        self.removed_followers = 0
+        self.inserted_unfollowers = 0
+
     @property
     def unfollower_ids_count(self):
         """ returns number of unfollower ids """
@@ -122,6 +235,315 @@ class DBMinions(object):
         except sqlite3.Error as err:
             print("create_database error: {0}".format(err))
 
+    def _upgrade_database(self):
+        """ creates tables added after the original followers and unfollowers schema if they
+            do not exist, so older databases are migrated when they are opened """
+
+        sql_create_sync_state_table = "CREATE TABLE IF NOT EXISTS 'sync_state' (" \
+            "'sync_name' VARCHAR PRIMARY KEY  NOT NULL," \
+            "'next_cursor' INTEGER," \
+            "'pages' INTEGER DEFAULT (0)," \
+            "'items' INTEGER DEFAULT (0)," \
+            "'time_started' DATETIME DEFAULT (CURRENT_TIMESTAMP)," \
+            "'time_updated' DATETIME DEFAULT (CURRENT_TIMESTAMP));"
+
+        sql_create_sync_follower_ids_table = "CREATE TABLE IF NOT EXISTS 'sync_follower_ids' (" \
+            "'position' INTEGER PRIMARY KEY  NOT NULL," \
+            "'user_id' INTEGER NOT NULL);"
+
+        sql_create_runs_table = "CREATE TABLE IF NOT EXISTS 'runs' (" \
+            "'run_id' INTEGER PRIMARY KEY  NOT NULL," \
+            "'run_mode' VARCHAR," \
+            "'time_started' DATETIME DEFAULT (CURRENT_TIMESTAMP)," \
+            "'time_finished' DATETIME DEFAULT (null)," \
+            "'follower_ids_count' INTEGER DEFAULT (null));"
+
+        sql_create_follower_snapshots_table = "CREATE TABLE IF NOT EXISTS 'follower_snapshots' (" \
+            "'run_id' INTEGER PRIMARY KEY  NOT NULL," \
+            "'snapshot_type' VARCHAR NOT NULL," \
+            "'key_run_id' INTEGER NOT NULL," \
+            "'ids_count' INTEGER," \
+            "'snapshot_data' BLOB," \
+            "'added_data' BLOB," \
+            "'removed_data' BLOB," \
+            "'time_taken' DATETIME DEFAULT (CURRENT_TIMESTAMP));"
+
+        sql_create_follower_snapshots_index = "CREATE INDEX IF NOT EXISTS " \
+            "'follower_snapshots_time_taken' ON 'follower_snapshots' ('time_taken', 'run_id');"
+
+        sql_create_events_table = "CREATE TABLE IF NOT EXISTS 'events' (" \
+            "'event_id' INTEGER PRIMARY KEY  NOT NULL," \
+            "'user_id' INTEGER NOT NULL," \
+            "'event_type' VARCHAR NOT NULL," \
+            "'run_id' INTEGER DEFAULT (null)," \
+            "'event_time' DATETIME DEFAULT (CURRENT_TIMESTAMP));"
+
+        # covering indexes for churn by time and per user follow history
+        sql_create_events_time_index = "CREATE INDEX IF NOT EXISTS 'events_time' " \
+            "ON 'events' ('event_time', 'event_type');"
+        sql_create_events_user_index = "CREATE INDEX IF NOT EXISTS 'events_type_user' " \
+            "ON 'events' ('event_type', 'user_id', 'event_time');"
+        sql_create_events_run_index = "CREATE INDEX IF NOT EXISTS 'events_run' " \
+            "ON 'events' ('run_id', 'event_type');"
+
+        # existing follower records are the history of databases without an events table
+        sql_backfill_events = "INSERT INTO events (user_id, event_type, event_time) " \
+            "SELECT user_id, 'follow', user_time_found FROM unfollowers " \
+            "UNION ALL SELECT user_id, 'unfollow', user_time_lost FROM unfollowers " \
+            "UNION ALL SELECT user_id, 'follow', user_time_found FROM followers " \
+            "ORDER BY 3;"
+
+        sql_create_profiles_table = "CREATE TABLE IF NOT EXISTS 'profiles' (" \
+            "'profile_hash' VARCHAR PRIMARY KEY  NOT NULL," \
+            "'dict_id' INTEGER DEFAULT (null)," \
+            "'profile_data' BLOB);"
+
+        sql_create_profile_dicts_table = "CREATE TABLE IF NOT EXISTS 'profile_dicts' (" \
+            "'dict_id' INTEGER PRIMARY KEY  NOT NULL," \
+            "'dict_data' BLOB," \
+            "'time_created' DATETIME DEFAULT (CURRENT_TIMESTAMP));"
+
+        sql_create_profile_versions_table = "CREATE TABLE IF NOT EXISTS 'profile_versions' (" \
+            "'version_id' INTEGER PRIMARY KEY  NOT NULL," \
+            "'user_id' INTEGER NOT NULL," \
+            "'profile_hash' VARCHAR NOT NULL," \
+            "'time_seen' DATETIME DEFAULT (CURRENT_TIMESTAMP));"
+
+        sql_create_profile_versions_index = "CREATE INDEX IF NOT EXISTS " \
+            "'profile_versions_user' ON 'profile_versions' ('user_id', 'time_seen');"
+
+        # aggregates kept up to date in the same transactions as the follower changes
+        sql_create_stats_table = "CREATE TABLE IF NOT EXISTS 'stats' (" \
+            "'stat_name' VARCHAR PRIMARY KEY  NOT NULL," \
+            "'stat_value' NUMERIC DEFAULT (0));"
+
+        sql_create_daily_stats_table = "CREATE TABLE IF NOT EXISTS 'daily_stats' (" \
+            "'day' DATE PRIMARY KEY  NOT NULL," \
+            "'follows' INTEGER DEFAULT (0)," \
+            "'unfollows' INTEGER DEFAULT (0));"
+
+        sql_create_tenure_stats_table = "CREATE TABLE IF NOT EXISTS 'tenure_stats' (" \
+            "'min_days' INTEGER PRIMARY KEY  NOT NULL," \
+            "'unfollows' INTEGER DEFAULT (0));"
+
+        # the newest row exported from each table, for incremental exports
+        sql_create_export_state_table = "CREATE TABLE IF NOT EXISTS 'export_state' (" \
+            "'table_name' VARCHAR PRIMARY KEY  NOT NULL," \
+            "'watermark' DEFAULT (null)," \
+            "'rows' INTEGER DEFAULT (0)," \
+            "'time_exported' DATETIME DEFAULT (CURRENT_TIMESTAMP));"
+
+        # profile column indexes for threshold and range queries. the flags are mostly 0 so
+        # only the 1 values are indexed, by followers count
+        sql_create_profile_indexes = [
+            "CREATE INDEX IF NOT EXISTS 'followers_followers_count' " \
+            "ON 'followers' ('user_followers_count');",
+            "CREATE INDEX IF NOT EXISTS 'followers_created_at' " \
+            "ON 'followers' ('user_created_at');",
+            "CREATE INDEX IF NOT EXISTS 'followers_lang' " \
+            "ON 'followers' ('user_lang', 'user_followers_count');",
+            "CREATE INDEX IF NOT EXISTS 'followers_verified' " \
+            "ON 'followers' ('user_followers_count') WHERE user_verified=1;",
+            "CREATE INDEX IF NOT EXISTS 'followers_protected' " \
+            "ON 'followers' ('user_followers_count') WHERE user_protected=1;"]
+
+        # full text index of profiles. the rowid of a follower is their user_id and of an
+        # unfollower record the negated unfollowers id, so both are ranked together
+        sql_create_profile_search_table = "CREATE VIRTUAL TABLE IF NOT EXISTS " \
+            "'profile_search' USING fts5(name, screen_name, description, location);"
+
+        try:
+            self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND " \
+                                "name='events';")
+            backfill_events = self.cursor.fetchone() is None
+
+            self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND " \
+                                "name='stats';")
+            backfill_stats = self.cursor.fetchone() is None
+
+            self.cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND " \
+                                "name='profile_search';")
+            backfill_search = self.cursor.fetchone() is None
+
+            # runs keep the newest follower ids of their listing for fast id runs
+            self.cursor.execute(sql_create_runs_table)
+            self.cursor.execute("PRAGMA table_info(runs);")
+            if 'head_ids' not in [row['name'] for row in self.cursor.fetchall()]:
+                self.cursor.execute("ALTER TABLE runs ADD COLUMN 'head_ids' BLOB DEFAULT (null);")
+
+            # followers reference their current profile by content hash
+            self.cursor.execute("PRAGMA table_info(followers);")
+            if 'user_profile_hash' not in [row['name'] for row in self.cursor.fetchall()]:
+                self.cursor.execute("ALTER TABLE followers ADD COLUMN 'user_profile_hash' " \
+                                    "VARCHAR DEFAULT (null);")
+
+            # typed profile fields for indexed queries and the reach aggregate
+            self.cursor.execute("PRAGMA table_info(followers);")
+            follower_columns = [row['name'] for row in self.cursor.fetchall()]
+            backfill_profile_columns = False
+            for column, column_type, key in profile_minions.PROFILE_COLUMNS:
+                if column not in follower_columns:
+                    self.cursor.execute("ALTER TABLE followers ADD COLUMN '{0}' {1} " \
+                                        "DEFAULT (null);".format(column, column_type))
+                    backfill_profile_columns = True
+
+            self.cursor.execute(sql_create_sync_state_table)
+            self.cursor.execute(sql_create_sync_follower_ids_table)
+            self.cursor.execute(sql_create_runs_table)
+            self.cursor.execute(sql_create_follower_snapshots_table)
+            self.cursor.execute(sql_create_follower_snapshots_index)
+            self.cursor.execute(sql_create_events_table)
+            self.cursor.execute(sql_create_events_time_index)
+            self.cursor.execute(sql_create_events_user_index)
+            self.cursor.execute(sql_create_events_run_index)
+            self.cursor.execute(sql_create_profiles_table)
+            self.cursor.execute(sql_create_profile_dicts_table)
+            self.cursor.execute(sql_create_profile_versions_table)
+            self.cursor.execute(sql_create_profile_versions_index)
+            self.cursor.execute(sql_create_stats_table)
+            self.cursor.execute(sql_create_daily_stats_table)
+            self.cursor.execute(sql_create_tenure_stats_table)
+            self.cursor.execute(sql_create_profile_search_table)
+            self.cursor.execute(sql_create_export_state_table)
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS 'followers_time_updated' " \
+                                "ON 'followers' ('user_time_updated');")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS 'followers_profile_hash' " \
+                                "ON 'followers' ('user_profile_hash');")
+            self.cursor.execute("CREATE INDEX IF NOT EXISTS 'sync_follower_ids_user' " \
+                                "ON 'sync_follower_ids' ('user_id');")
+            for sql_create_index in sql_create_profile_indexes:
+                self.cursor.execute(sql_create_index)
+
+            if backfill_events:
+                self.cursor.execute(sql_backfill_events)
+
+            self.connection.commit()
+
+            if backfill_profile_columns:
+                self._backfill_profile_columns()
+            if backfill_stats:
+                self._backfill_stats()
+            if backfill_search:
+                self._backfill_search()
+
+            self.cursor.execute("SELECT dict_id FROM profile_dicts ORDER BY dict_id DESC LIMIT 1;")
+            row = self.cursor.fetchone()
+            if row:
+                self.profile_dict_id = row['dict_id']
+                self._get_profile_dict(self.profile_dict_id)
+
+        except sqlite3.Error as err:
+            print("upgrade_database error: {0}".format(err))
+
+    def _backfill_profile_columns(self):
+        """ sets the profile columns from the stored profiles of followers written before
+            the columns were added """
+        sql_profiles = "SELECT f.user_id, f.user_json, p.dict_id, p.profile_data " \
+            "FROM followers f LEFT JOIN profiles p ON p.profile_hash=f.user_profile_hash;"
+        sql_update = "UPDATE followers SET {0} WHERE user_id=?;".format( \
+            ", ".join("{0}=?".format(column) for column, column_type, key
+                      in profile_minions.PROFILE_COLUMNS))
+
+        try:
+            profiles_cursor = self.connection.execute(sql_profiles)
+            while True:
+                rows = profiles_cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+
+                update_rows = []
+                for row in rows:
+                    profile = self.decode_profile(row)
+                    if profile:
+                        update_rows.append(profile_minions.profile_columns(profile) + \
+                                           (row['user_id'],))
+                self.cursor.executemany(sql_update, update_rows)
+
+            self.cursor.execute("ANALYZE followers;")
+            self.connection.commit()
+
+        except (sqlite3.Error, ValueError) as err:
+            self.connection.rollback()
+            print("backfill_profile_columns error: {0}".format(err))
+
+    def _backfill_stats(self):
+        """ fills the aggregate tables from existing followers, unfollowers and events """
+        tenure_days = "julianday(user_time_lost) - julianday(user_time_found)"
+        tenure_bucket = "CASE {0} ELSE 0 END".format(" ".join( \
+            "WHEN {0} >= {1} THEN {1}".format(tenure_days, min_days)
+            for min_days in reversed(TENURE_BUCKET_DAYS[1:])))
+
+        sql_backfill_stats = "INSERT INTO stats (stat_name, stat_value) " \
+            "SELECT ?, COUNT(*) FROM followers " \
+            "UNION ALL SELECT ?, TOTAL(user_followers_count) FROM followers " \
+            "UNION ALL SELECT ?, COUNT(*) FROM events WHERE event_type=? " \
+            "UNION ALL SELECT ?, COUNT(*) FROM events WHERE event_type=? " \
+            "UNION ALL SELECT ?, TOTAL({0}) FROM unfollowers " \
+            "WHERE user_time_found IS NOT NULL;".format(tenure_days)
+
+        sql_backfill_daily = "INSERT INTO daily_stats (day, follows, unfollows) " \
+            "SELECT date(event_time) AS day, SUM(event_type=?), SUM(event_type=?) " \
+            "FROM events WHERE event_time IS NOT NULL GROUP BY day;"
+
+        sql_backfill_tenure = "INSERT OR REPLACE INTO tenure_stats (min_days, unfollows) " \
+            "SELECT {0} AS min_days, COUNT(*) FROM unfollowers " \
+            "WHERE user_time_found IS NOT NULL GROUP BY min_days;".format(tenure_bucket)
+
+        try:
+            self.cursor.execute(sql_backfill_stats, (STAT_FOLLOWERS, STAT_REACH, \
+                                                     STAT_FOLLOWS, EVENT_FOLLOW, \
+                                                     STAT_UNFOLLOWS, EVENT_UNFOLLOW, \
+                                                     STAT_TENURE_DAYS))
+            self.cursor.execute(sql_backfill_daily, (EVENT_FOLLOW, EVENT_UNFOLLOW))
+            self.cursor.executemany("INSERT INTO tenure_stats (min_days) VALUES (?);", \
+                                    [(min_days,) for min_days in TENURE_BUCKET_DAYS])
+            self.cursor.execute(sql_backfill_tenure)
+            self.connection.commit()
+
+        except sqlite3.Error as err:
+            self.connection.rollback()
+            print("backfill_stats error: {0}".format(err))
+
+    def _backfill_search(self):
+        """ fills the profile search index from existing followers and unfollowers. the
+            unfollowers of older databases only have their names indexed. """
+        sql_profiles = "SELECT f.user_id, f.user_name, f.user_screen_name, f.user_json, " \
+            "p.dict_id, p.profile_data FROM followers f " \
+            "LEFT JOIN profiles p ON p.profile_hash=f.user_profile_hash;"
+
+        sql_insert = "INSERT INTO profile_search (rowid, name, screen_name, description, " \
+            "location) VALUES (?, ?, ?, ?, ?);"
+
+        sql_insert_unfollowers = "INSERT INTO profile_search (rowid, name, screen_name) " \
+            "SELECT -id, user_name, user_screen_name FROM unfollowers ORDER BY id DESC;"
+
+        try:
+            profiles_cursor = self.connection.execute(sql_profiles)
+            while True:
+                rows = profiles_cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+
+                search_rows = []
+                for row in rows:
+                    profile = self.decode_profile(row) or {}
+                    search_rows.append((row['user_id'], row['user_name'], \
+                                        row['user_screen_name'], profile.get('description'), \
+                                        profile.get('location')))
+                self.cursor.executemany(sql_insert, search_rows)
+
+            self.cursor.execute(sql_insert_unfollowers)
+            self.connection.commit()
+
+        except (sqlite3.Error, ValueError) as err:
+            self.connection.rollback()
+            print("backfill_search error: {0}".format(err))
+
+    def _add_stats(self, **deltas):
+        """ adds deltas to the running totals in the stats table without committing """
+        self.cursor.executemany("UPDATE stats SET stat_value=stat_value+? WHERE stat_name=?;", \
+                                [(value, name) for name, value in deltas.items() if value])
+
     def _create_connection(self):
         """ creates new sqlite3 database connection to path """
         try:
@@ -129,113 +551,1279 @@ class DBMinions(object):
             self.connection.row_factory = sqlite3.Row
             self.cursor = self.connection.cursor()
 
+            # write ahead log with normal syncing commits without an fsync of the main db
+            self.cursor.execute("PRAGMA journal_mode=WAL;")
+            self.cursor.execute("PRAGMA synchronous=NORMAL;")
+            self.cursor.execute("PRAGMA cache_size=-{0};".format(DB_CACHE_SIZE_KIB))
+            self.cursor.execute("PRAGMA temp_store={0};".format("FILE" if self.stream \
+                                                                  else "MEMORY"))
+
         except sqlite3.Error as err:
             print("create_connection error: {0}".format(err))
 
     def close_connection(self):
-        """ closes database connection """
+        """ closes database connection, writing any buffered follower rows first. the query
+            planner statistics are refreshed if sqlite finds them out of date, so range
+            queries on the profile columns pick the most selective index. """
+        self.flush_followers()
+        try:
+            self.cursor.execute("PRAGMA optimize;")
+        except sqlite3.Error as err:
+            print("close_connection error: {0}".format(err))
         self._connection.close()
 
     def get_follower_ids(self):
-        """ retrieves list follower ids from followers table """
-        sql_followers = "SELECT user_id FROM followers"
+        """ retrieves list follower ids from followers table, in user id order so they are
+            their own sorted copy """
+        sql_followers = "SELECT user_id FROM followers ORDER BY user_id;"
 
-        self.follower_ids = []
+        self._follower_ids = ids_minions.FollowerIds()
         try:
-            self.cursor.execute(sql_followers)
-            all_rows = self.cursor.fetchall()
-
-            for row in all_rows:
-                self.follower_ids = [row['user_id']]
+            with self.metrics.span("db_load_ids"):
+                self.cursor.execute(sql_followers)
+                while True:
+                    rows = self.cursor.fetchmany(DB_ID_FETCH_SIZE)
+                    if not rows:
+                        break
+                    self._follower_ids.extend(row[0] for row in rows)
 
         except sqlite3.Error as err:
             print("dbm, error: {0}".format(err))
 
-    def insert_followers(self, followers_list):
-        """ inserts follower records into the database from a list of user objects """
+    def _get_profile_dict(self, dict_id):
+        """ returns the compression dictionary for dict_id, loading it on first use """
+        if dict_id is None:
+            return None
+
+        if dict_id not in self._profile_dicts:
+            self.cursor.execute("SELECT dict_data FROM profile_dicts WHERE dict_id=?;", (dict_id,))
+            row = self.cursor.fetchone()
+            self._profile_dicts[dict_id] = row['dict_data'] if row else None
+
+        return self._profile_dicts[dict_id]
+
+    def follower_insert_row(self, user):
+        """ returns a FollowerRow for a user object """
+        json_text = profile_minions.profile_json(user._json)
+        zdict = self._profile_dicts.get(self.profile_dict_id)
+        self.metrics.count("profile_json_bytes", len(json_text))
+
+        return FollowerRow(user.id, user.name, user.screen_name, \
+                           profile_minions.profile_hash(json_text), \
+                           profile_minions.compress_profile(json_text, zdict), \
+                           self.profile_dict_id if zdict else None, \
+                           user._json.get('description'), user._json.get('location'), \
+                           profile_minions.profile_columns(user._json))
+
+    def follower_update_row(self, user):
+        """ returns a FollowerRow for a user object, see follower_insert_row """
+        return self.follower_insert_row(user)
+
+    def _get_stored_profiles(self, user_ids):
+        """ returns a dictionary of the stored profile hash and followers count for each
+            user id """
+        stored_profiles = {}
+        for i in range(0, len(user_ids), self.batch_size):
+            batch_ids = user_ids[i:i + self.batch_size]
+            placeholders = ', '.join(['?']*len(batch_ids))
+            self.cursor.execute("SELECT user_id, user_profile_hash, user_followers_count " \
+                                "FROM followers WHERE user_id IN ({0});".format(placeholders), \
+                                batch_ids)
+            for row in self.cursor.fetchall():
+                stored_profiles[row['user_id']] = (row['user_profile_hash'], \
+                                                   row['user_followers_count'])
+
+        return stored_profiles
+
+    def _write_follower_rows(self, insert_rows, update_rows, commit=True):
+        """ inserts and updates FollowerRows with executemany in a single transaction, the
+            transaction is left open for the caller if commit is false. profiles are stored
+            once per content hash, updates whose profile hash has not changed only set the
+            updated time and the profile columns, and new or changed profiles are added to
+            profile_versions. stored profiles no follower refers to any more are deleted,
+            profile_versions keeps their hash and the time they were seen. the
+            followers and reach totals in stats and the search index are updated in the same
+            transaction. rows are deduplicated by user id, keeping the last, and inserts of
+            followers that are already stored are written as updates. returns true if the
+            rows were written, false if the transaction was rolled back. """
+
+        sql_insert_profile = "INSERT OR IGNORE INTO profiles (profile_hash, dict_id, " \
+            "profile_data) VALUES (?, ?, ?);"
+
+        sql_insert_version = "INSERT INTO profile_versions (user_id, profile_hash, time_seen) " \
+            "VALUES (?, ?, datetime('now'));"
+
+        profile_columns = [column for column, column_type, key
+                           in profile_minions.PROFILE_COLUMNS]
 
         sql_insert = "INSERT INTO followers (user_id, user_name, user_screen_name, " \
-            "user_time_found, user_json) VALUES (?, ?, ?, datetime('now'), ?);"
+            "user_time_found, user_profile_hash, {0}) " \
+            "VALUES (?, ?, ?, datetime('now'), ?, {1});".format(", ".join(profile_columns), \
+                                                               ", ".join(["?"] * \
+                                                                         len(profile_columns)))
 
-        inserted_followers = 0
+        sql_update = "UPDATE followers SET user_name=?, user_screen_name=?, " \
+            "user_time_updated=datetime('now'), user_profile_hash=?, user_json=null, " \
+            "{0} WHERE user_id=?;".format(", ".join("{0}=?".format(column)
+                                                    for column in profile_columns))
+
+        sql_touch = "UPDATE followers SET user_time_updated=datetime('now'), {0} " \
+            "WHERE user_id=?;".format(", ".join("{0}=?".format(column)
+                                                for column in profile_columns))
+
+        sql_delete_search = "DELETE FROM profile_search WHERE rowid=?;"
+        sql_insert_search = "INSERT INTO profile_search (rowid, name, screen_name, " \
+            "description, location) VALUES (?, ?, ?, ?, ?);"
+
+        # a follower can come back on a later page when the listing shifts during a sweep
+        insert_rows = list({row.user_id: row for row in insert_rows}.values())
+        insert_ids = {row.user_id for row in insert_rows}
+        update_rows = [row for row in {row.user_id: row for row in update_rows}.values()
+                       if row.user_id not in insert_ids]
+
+        write_start = self.metrics.clock()
         try:
-            for user in followers_list:
-                self.cursor.execute(sql_insert, (user.id, user.name, user.screen_name,
-                                                 json.dumps(user._json)))
-                inserted_followers += 1
+            changed_rows = []
+            reindexed_rows = []
+            unchanged_rows = []
+            superseded_hashes = []
+            stored_profiles = self._get_stored_profiles([row.user_id for row in insert_rows] + \
+                                                        [row.user_id for row in update_rows])
+            update_rows += [row for row in insert_rows if row.user_id in stored_profiles]
+            insert_rows = [row for row in insert_rows if row.user_id not in stored_profiles]
+            reach = sum(row.followers_count or 0 for row in insert_rows)
+            if update_rows:
+                for row in update_rows:
+                    stored_hash, stored_followers_count = stored_profiles.get(row.user_id, \
+                                                                              (None, None))
+                    if row.user_id in stored_profiles:
+                        reach += (row.followers_count or 0) - (stored_followers_count or 0)
+                    if stored_hash == row.profile_hash:
+                        unchanged_rows.append(row)
+                    else:
+                        changed_rows.append(row)
+                        if row.user_id in stored_profiles:
+                            reindexed_rows.append(row)
+                            if stored_hash:
+                                superseded_hashes.append(stored_hash)
 
-            self.connection.commit()
+            profile_rows = insert_rows + changed_rows
+            self.cursor.executemany(sql_insert_profile, [(row.profile_hash, row.dict_id, \
+                                                          row.profile_data)
+                                                         for row in profile_rows])
+            inserted_profiles = max(0, self.cursor.rowcount)
+            self.cursor.executemany(sql_insert_version, [(row.user_id, row.profile_hash)
+                                                         for row in profile_rows])
+
+            if insert_rows:
+                self.cursor.executemany(sql_insert, [(row.user_id, row.name, row.screen_name, \
+                                                      row.profile_hash) + row.profile_columns
+                                                     for row in insert_rows])
+                self._insert_events(EVENT_FOLLOW, [row.user_id for row in insert_rows])
+            if changed_rows:
+                self.cursor.executemany(sql_update, [(row.name, row.screen_name, \
+                                                      row.profile_hash) + row.profile_columns + \
+                                                     (row.user_id,) for row in changed_rows])
+            if unchanged_rows:
+                self.cursor.executemany(sql_touch, [row.profile_columns + (row.user_id,)
+                                                    for row in unchanged_rows])
+            pruned_profiles = self._prune_profiles(superseded_hashes)
+
+            # the search index writes a new segment whenever a rowid is lower than the last
+            self.cursor.executemany(sql_delete_search, sorted((row.user_id,)
+                                                              for row in reindexed_rows))
+            self.cursor.executemany(sql_insert_search, sorted((row.user_id, row.name, \
+                                                               row.screen_name, \
+                                                               row.description, row.location)
+                                                              for row in insert_rows + \
+                                                              reindexed_rows))
+
+            self._add_stats(**{STAT_FOLLOWERS: len(insert_rows), STAT_REACH: reach})
+
+            if commit:
+                self.connection.commit()
 
         except sqlite3.Error as err:
-            print("* database insert error - {0} {1}".format(user.id, user.screen_name))
+            self.connection.rollback()
+            print("* database write error - {0} inserts, {1} updates".format(len(insert_rows), \
+                                                                             len(update_rows)))
             print(err)
+            return False
+        finally:
+            self.metrics.add_span("db_write", self.metrics.clock() - write_start)
+
+        self.inserted_followers += len(insert_rows)
+        self.updated_followers += len(changed_rows)
+        self.unchanged_followers += len(unchanged_rows)
+
+        self.metrics.count("db_rows_written", len(insert_rows), table="followers", op="insert")
+        self.metrics.count("db_rows_written", len(changed_rows), table="followers", op="update")
+        self.metrics.count("db_rows_written", len(unchanged_rows), table="followers", op="touch")
+        self.metrics.count("db_rows_written", len(profile_rows), table="profile_versions", \
+                           op="insert")
+        self.metrics.count("db_rows_written", inserted_profiles, table="profiles", op="insert")
+        self.metrics.count("db_rows_written", pruned_profiles, table="profiles", op="delete")
+        self.metrics.count("profile_stored_bytes", sum(len(row.profile_data)
+                                                       for row in profile_rows))
+
+        return True
+
+    def _prune_profiles(self, profile_hashes):
+        """ deletes the stored profiles of the hashes that no follower refers to any more,
+            without committing. returns the number deleted """
+        sql_prune = "DELETE FROM profiles WHERE profile_hash=? AND NOT EXISTS " \
+            "(SELECT 1 FROM followers WHERE user_profile_hash=?);"
+
+        pruned = 0
+        for profile_hash in set(profile_hashes):
+            self.cursor.execute(sql_prune, (profile_hash, profile_hash))
+            pruned += max(0, self.cursor.rowcount)
+
+        return pruned
+
+    def _insert_events(self, event_type, user_ids):
+        """ appends events of event_type for the current run and adds them to the follows
+            or unfollows totals and the days counts, without committing """
+        sql_insert = "INSERT INTO events (user_id, event_type, run_id, event_time) " \
+            "VALUES (?, ?, ?, datetime('now'));"
+
+        sql_insert_day = "INSERT OR IGNORE INTO daily_stats (day) VALUES (date('now'));"
+        sql_update_day = "UPDATE daily_stats SET follows=follows+?, unfollows=unfollows+? " \
+            "WHERE day=date('now');"
+
+        self.cursor.executemany(sql_insert, [(uid, event_type, self.run_id) for uid in user_ids])
+
+        if user_ids:
+            follows = len(user_ids) if event_type == EVENT_FOLLOW else 0
+            unfollows = len(user_ids) if event_type == EVENT_UNFOLLOW else 0
+            self.cursor.execute(sql_insert_day)
+            self.cursor.execute(sql_update_day, (follows, unfollows))
+            self._add_stats(**{STAT_FOLLOWS: follows, STAT_UNFOLLOWS: unfollows})
 
-        self.inserted_followers += inserted_followers
+    def insert_followers(self, followers_list):
+        """ inserts follower records into the database from a list of user objects, returns
+            false if they could not be written """
+        return self._write_follower_rows([self.follower_insert_row(user)
+                                          for user in followers_list], [])
 
     def update_followers(self, followers_list):
-        """ updates follower records in the database from a list of user objects """
+        """ updates follower records in the database from a list of user objects, returns
+            false if they could not be written """
+        return self._write_follower_rows([], [self.follower_update_row(user)
+                                              for user in followers_list])
 
-        sql_update = "UPDATE followers SET user_name=?, user_screen_name=?, " \
-            "user_time_updated=datetime('now'), user_json=? WHERE user_id=?;"
+    def buffer_insert_followers(self, followers_list):
+        """ buffers follower inserts from a list of user objects, writing them once the
+            buffer reaches batch_size rows. returns false if a write failed. """
+        self._insert_rows.extend(self.follower_insert_row(user) for user in followers_list)
+        return self._flush_full_buffers()
+
+    def buffer_update_followers(self, followers_list):
+        """ buffers follower updates from a list of user objects, writing them once the
+            buffer reaches batch_size rows. returns false if a write failed. """
+        self._update_rows.extend(self.follower_update_row(user) for user in followers_list)
+        return self._flush_full_buffers()
+
+    def buffer_follower_rows(self, insert_rows, update_rows):
+        """ buffers follower rows already built with follower_insert_row and
+            follower_update_row, writing them once the buffer reaches batch_size rows.
+            returns false if a write failed. """
+        self._insert_rows.extend(insert_rows)
+        self._update_rows.extend(update_rows)
+        return self._flush_full_buffers()
+
+    def _flush_full_buffers(self):
+        """ writes buffered follower rows if there are at least batch_size of them """
+        if len(self._insert_rows) + len(self._update_rows) >= self.batch_size:
+            return self.flush_followers()
+
+        return True
+
+    def flush_followers(self, commit=True):
+        """ writes all buffered follower inserts and updates in one transaction, returns
+            false if they could not be written """
+        if not self._insert_rows and not self._update_rows:
+            return True
+
+        insert_rows, update_rows = self._insert_rows, self._update_rows
+        self._insert_rows, self._update_rows = [], []
+
+        return self._write_follower_rows(insert_rows, update_rows, commit)
+
+    def get_sync_state(self, sync_name):
+        """ returns the saved paging state row for sync_name or none """
+        sql_sync_state = "SELECT * FROM sync_state WHERE sync_name=?;"
+
+        try:
+            self.cursor.execute(sql_sync_state, (sync_name,))
+            return self.cursor.fetchone()
+
+        except sqlite3.Error as err:
+            print("get_sync_state error: {0}".format(err))
+
+        return None
+
+    def _save_sync_state(self, sync_name, next_cursor, items):
+        """ upserts the paging state for sync_name without committing """
+        sql_save = "INSERT INTO sync_state (sync_name, next_cursor, pages, items, time_started, " \
+            "time_updated) VALUES (?, ?, 1, ?, datetime('now'), datetime('now')) " \
+            "ON CONFLICT(sync_name) DO UPDATE SET next_cursor=excluded.next_cursor, " \
+            "pages=pages+1, items=excluded.items, time_updated=excluded.time_updated;"
+
+        self.cursor.execute(sql_save, (sync_name, next_cursor, items))
+
+    def checkpoint_sync_state(self, sync_name, next_cursor, items):
+        """ writes buffered follower rows and the paging state for sync_name in one
+            transaction, so a resumed run continues from the last committed page. the paging
+            state is not saved if the rows could not be written. returns true on success. """
+        if not self.flush_followers(commit=False):
+            return False
 
-        updated_followers = 0
         try:
-            for user in followers_list:
-                self.cursor.execute(sql_update, (user.name, user.screen_name, \
-                                                 json.dumps(user._json), user.id))
-                updated_followers += 1
+            self._save_sync_state(sync_name, next_cursor, items)
+            self.connection.commit()
+            return True
+
+        except sqlite3.Error as err:
+            self.connection.rollback()
+            print("checkpoint_sync_state error: {0}".format(err))
+
+        return False
+
+    def clear_sync_state(self, sync_name):
+        """ removes the paging state for sync_name, and any saved ids for follower ids """
+        try:
+            self.cursor.execute("DELETE FROM sync_state WHERE sync_name=?;", (sync_name,))
+            if sync_name == SYNC_FOLLOWER_IDS:
+                self.cursor.execute("DELETE FROM sync_follower_ids;")
 
             self.connection.commit()
 
         except sqlite3.Error as err:
-            print("* database update error - {0} {1}".format(user.id, user.screen_name))
-            print(err)
+            print("clear_sync_state error: {0}".format(err))
 
-        self.updated_followers += updated_followers
+    def clear_finished_sync_state(self, max_age):
+        """ removes the paging states of listings that finished more than max_age seconds
+            ago but were left behind by a run that exited before reconciling them """
+        sql_finished = "SELECT sync_name FROM sync_state WHERE next_cursor=0 " \
+            "AND time_updated < datetime('now', ?);"
+
+        try:
+            self.cursor.execute(sql_finished, ("-{0} seconds".format(int(max_age)),))
+            sync_names = [row['sync_name'] for row in self.cursor.fetchall()]
+
+        except sqlite3.Error as err:
+            print("clear_finished_sync_state error: {0}".format(err))
+            return
+
+        for sync_name in sync_names:
+            self.clear_sync_state(sync_name)
+
+    def append_sync_follower_ids(self, ids, next_cursor):
+        """ saves a page of /followers/ids results and the paging state in one transaction """
+        sql_insert = "INSERT INTO sync_follower_ids (user_id) VALUES (?);"
+
+        try:
+            with self.metrics.span("db_write"):
+                self.cursor.executemany(sql_insert, ((uid,) for uid in ids))
+                self.cursor.execute("SELECT COALESCE(MAX(position), 0) FROM sync_follower_ids;")
+                items = self.cursor.fetchone()[0]
+
+                self._save_sync_state(SYNC_FOLLOWER_IDS, next_cursor, items)
+                self.connection.commit()
+
+            self.metrics.count("db_rows_written", len(ids), table="sync_follower_ids", \
+                               op="insert")
+
+        except sqlite3.Error as err:
+            self.connection.rollback()
+            print("append_sync_follower_ids error: {0}".format(err))
+
+    def get_sync_follower_ids(self):
+        """ returns saved /followers/ids results in the order they were received """
+        sql_ids = "SELECT user_id FROM sync_follower_ids ORDER BY position;"
+
+        try:
+            self.cursor.execute(sql_ids)
+            return [row['user_id'] for row in self.cursor.fetchall()]
+
+        except sqlite3.Error as err:
+            print("get_sync_follower_ids error: {0}".format(err))
+
+        return []
+
+    def count_followers(self):
+        """ returns the number of follower records """
+        try:
+            self.cursor.execute("SELECT COUNT(*) FROM followers;")
+            return self.cursor.fetchone()[0]
+
+        except sqlite3.Error as err:
+            print("count_followers error: {0}".format(err))
+
+        return 0
+
+    def count_sync_follower_ids(self):
+        """ returns the number of distinct saved /followers/ids results """
+        try:
+            self.cursor.execute("SELECT COUNT(DISTINCT user_id) FROM sync_follower_ids;")
+            return self.cursor.fetchone()[0]
+
+        except sqlite3.Error as err:
+            print("count_sync_follower_ids error: {0}".format(err))
+
+        return 0
+
+    def get_sync_head_ids(self):
+        """ returns the first HEAD_IDS_SIZE saved /followers/ids results, newest first """
+        sql_ids = "SELECT user_id FROM sync_follower_ids ORDER BY position LIMIT ?;"
+
+        try:
+            self.cursor.execute(sql_ids, (HEAD_IDS_SIZE,))
+            return [row['user_id'] for row in self.cursor.fetchall()]
+
+        except sqlite3.Error as err:
+            print("get_sync_head_ids error: {0}".format(err))
+
+        return []
+
+    def _iter_id_batches(self, sql, params=()):
+        """ yields lists of up to batch_size values of the first column of a query, read with
+            fetchmany on a cursor of its own so writes can be made between batches """
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+                yield [row[0] for row in rows]
+        finally:
+            cursor.close()
+
+    def iter_follower_id_batches(self):
+        """ yields batches of the follower ids in the followers table in id order """
+        return self._iter_id_batches("SELECT user_id FROM followers ORDER BY user_id;")
+
+    def iter_event_batches(self, after_event_id=0):
+        """ yields batches of event_id, user_id and event_type rows of the events after an
+            event id, in the order they were recorded """
+        return self.iter_row_batches("SELECT event_id, user_id, event_type FROM events " \
+                                     "WHERE event_id>? ORDER BY event_id;", (after_event_id,))
+
+    def get_last_event_id(self):
+        """ returns the id of the newest event or 0 """
+        try:
+            self.cursor.execute("SELECT MAX(event_id) FROM events;")
+            return self.cursor.fetchone()[0] or 0
+
+        except sqlite3.Error as err:
+            print("get_last_event_id error: {0}".format(err))
+
+        return 0
+
+    def iter_row_batches(self, sql, params=(), size=None):
+        """ yields lists of up to size rows of a query, batch_size by default, read with
+            fetchmany on a cursor of its own so memory use does not grow with the rows """
+        cursor = self.connection.cursor()
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(size or self.batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cursor.close()
+
+    def get_export_watermark(self, table_name):
+        """ returns the watermark saved by the last export of a table or none """
+        try:
+            self.cursor.execute("SELECT watermark FROM export_state WHERE table_name=?;", \
+                                (table_name,))
+            row = self.cursor.fetchone()
+            return row['watermark'] if row else None
+
+        except sqlite3.Error as err:
+            print("get_export_watermark error: {0}".format(err))
+
+        return None
+
+    def save_export_watermark(self, table_name, watermark, rows):
+        """ saves the watermark of the newest row exported from a table """
+        sql_save = "INSERT OR REPLACE INTO export_state (table_name, watermark, rows, " \
+            "time_exported) VALUES (?, ?, ?, datetime('now'));"
+
+        try:
+            self.cursor.execute(sql_save, (table_name, watermark, rows))
+            self.connection.commit()
+
+        except sqlite3.Error as err:
+            print("save_export_watermark error: {0}".format(err))
+
+    def reconcile_sync_follower_ids(self):
+        """ compares the saved /followers/ids results with the followers table using
+            anti-joins, storing listed ids without a follower record in the temporary
+            reconcile_added table and follower records that were not listed in
+            reconcile_removed. returns the number of added and removed ids. """
+
+        sql_added = "INSERT INTO temp.reconcile_added (position, user_id) " \
+            "SELECT MIN(s.position), s.user_id FROM sync_follower_ids s " \
+            "WHERE NOT EXISTS (SELECT 1 FROM followers f WHERE f.user_id=s.user_id) " \
+            "GROUP BY s.user_id;"
+
+        sql_removed = "INSERT INTO temp.reconcile_removed (user_id) " \
+            "SELECT f.user_id FROM followers f " \
+            "WHERE NOT EXISTS (SELECT 1 FROM sync_follower_ids s WHERE s.user_id=f.user_id);"
+
+        try:
+            with self.metrics.span("diff"):
+                self.cursor.execute("DROP TABLE IF EXISTS temp.reconcile_added;")
+                self.cursor.execute("DROP TABLE IF EXISTS temp.reconcile_removed;")
+                self.cursor.execute("CREATE TEMP TABLE reconcile_added (" \
+                                    "position INTEGER PRIMARY KEY, user_id INTEGER NOT NULL);")
+                self.cursor.execute("CREATE TEMP TABLE reconcile_removed (" \
+                                    "user_id INTEGER PRIMARY KEY);")
+                self.cursor.execute(sql_added)
+                self.cursor.execute(sql_removed)
+                self.connection.commit()
+
+                self.cursor.execute("SELECT (SELECT COUNT(*) FROM temp.reconcile_added), " \
+                                    "(SELECT COUNT(*) FROM temp.reconcile_removed);")
+                return tuple(self.cursor.fetchone())
+
+        except sqlite3.Error as err:
+            self.connection.rollback()
+            print("reconcile_sync_follower_ids error: {0}".format(err))
+
+        return 0, 0
+
+    def iter_new_follower_ids(self):
+        """ yields batches of the ids in reconcile_added in listing order, newest first """
+        return self._iter_id_batches("SELECT user_id FROM temp.reconcile_added " \
+                                     "ORDER BY position;")
+
+    def iter_unfollower_ids(self):
+        """ yields batches of the ids in reconcile_removed """
+        return self._iter_id_batches("SELECT user_id FROM temp.reconcile_removed " \
+                                     "ORDER BY user_id;")
+
+    def get_follower_ids_since(self, since):
+        """ returns ids of followers inserted or updated at or after the since timestamp """
+        sql_ids = "SELECT user_id FROM followers WHERE user_time_found >= ? " \
+            "OR user_time_updated >= ?;"
+
+        try:
+            self.cursor.execute(sql_ids, (since, since))
+            return [row['user_id'] for row in self.cursor.fetchall()]
+
+        except sqlite3.Error as err:
+            print("get_follower_ids_since error: {0}".format(err))
+
+        return []
+
+    def get_run_new_followers(self, limit):
+        """ returns dictionaries of up to limit followers found in the current run """
+        sql_new_followers = "SELECT f.user_id, f.user_screen_name, f.user_name, " \
+            "f.user_time_found FROM events e JOIN followers f ON f.user_id=e.user_id " \
+            "WHERE e.run_id=? AND e.event_type=? ORDER BY e.event_id LIMIT ?;"
+
+        try:
+            self.cursor.execute(sql_new_followers, (self.run_id, EVENT_FOLLOW, limit))
+            return [dict(row) for row in self.cursor.fetchall()]
+
+        except sqlite3.Error as err:
+            print("get_run_new_followers error: {0}".format(err))
+
+        return []
 
     def remove_followers(self, followers_id_list):
-        """ removes follower records from the database for a list of user ids """
+        """ removes follower records, their search index rows and their stored profiles from
+            the database for a list of user ids. returns false if they could not be removed. """
 
-        placeholders = ', '.join(['?']*len(followers_id_list))
-        sql_remove = "DELETE FROM followers WHERE user_id IN ({0});".format(placeholders)
+        sql_remove = "DELETE FROM followers WHERE user_id=?;"
+        sql_remove_search = "DELETE FROM profile_search WHERE rowid=?;"
 
         removed_followers = 0
         try:
-            self.cursor.execute(sql_remove, followers_id_list)
-            self.connection.commit()
+            with self.metrics.span("db_write"):
+                # totals of the records removed, in batches under the host parameter limit
+                removed_count, removed_reach = 0, 0
+                removed_hashes = []
+                for i in range(0, len(followers_id_list), self.batch_size):
+                    batch_ids = followers_id_list[i:i + self.batch_size]
+                    placeholders = ', '.join(['?']*len(batch_ids))
+                    self.cursor.execute("SELECT user_profile_hash, user_followers_count FROM " \
+                                        "followers WHERE user_id IN ({0});".format(placeholders), \
+                                        batch_ids)
+                    for row in self.cursor.fetchall():
+                        removed_count += 1
+                        removed_reach += row['user_followers_count'] or 0
+                        if row['user_profile_hash']:
+                            removed_hashes.append(row['user_profile_hash'])
+
+                self.cursor.executemany(sql_remove, [(uid,) for uid in followers_id_list])
+                self.cursor.executemany(sql_remove_search, sorted((uid,) for uid in \
+                                                                  followers_id_list))
+                pruned_profiles = self._prune_profiles(removed_hashes)
+                self._add_stats(**{STAT_FOLLOWERS: -removed_count, STAT_REACH: -removed_reach})
+                self.connection.commit()
 
             removed_followers = len(followers_id_list)
 
         except sqlite3.Error as err:
+            self.connection.rollback()
             print("remove_followers error: {0}".format(err))
+            return False
 
         self.removed_followers += removed_followers
+        self.metrics.count("db_rows_written", removed_followers, table="followers", op="delete")
+        self.metrics.count("db_rows_written", pruned_profiles, table="profiles", op="delete")
+
+        return True
 
     def insert_unfollowers(self, followers_id_list):
-        """ insert follower records into unfollowers table for a list of unfollower ids """
-        placeholders = ', '.join(['?']*len(followers_id_list))
-        sql_unfollowers = "SELECT * FROM followers WHERE user_id IN ({0});".format(placeholders)
+        """ insert follower records into unfollowers table for a list of unfollower ids. the
+            tenure of each unfollower is added to the tenure aggregates and their indexed
+            profile text is copied to the unfollowers search index. """
+
+        sql_insert = "INSERT INTO unfollowers (user_id, user_name, user_screen_name, " \
+            "user_time_found, user_time_lost) VALUES (?, ?, ?, ?, datetime('now'));"
+
+        sql_update_tenure = "UPDATE tenure_stats SET unfollows=unfollows+? WHERE min_days=?;"
+
+        sql_insert_search = "INSERT INTO profile_search (rowid, name, screen_name, " \
+            "description, location) SELECT -u.id, s.name, s.screen_name, s.description, " \
+            "s.location FROM unfollowers u JOIN profile_search s ON s.rowid=u.user_id " \
+            "WHERE u.id > ? ORDER BY u.id DESC;"
 
         inserted_unfollowers = 0
+        unfollowers = []
+        write_start = self.metrics.clock()
         try:
-            self.cursor.execute(sql_unfollowers, followers_id_list)
-            all_rows = self.cursor.fetchall()
+            self.cursor.execute("SELECT COALESCE(MAX(id), 0) FROM unfollowers;")
+            last_unfollower_id = self.cursor.fetchone()[0]
 
-            for row in all_rows:
-                sql_insert = "INSERT INTO unfollowers (user_id, user_name, user_screen_name, " \
-                    "user_time_found, user_time_lost) VALUES (?, ?, ?, ?, datetime('now'));"
+            # select in batches to stay under the sqlite host parameter limit
+            for i in range(0, len(followers_id_list), self.batch_size):
+                batch_ids = followers_id_list[i:i + self.batch_size]
+                placeholders = ', '.join(['?']*len(batch_ids))
+                sql_unfollowers = "SELECT *, julianday('now') - julianday(user_time_found) " \
+                    "AS tenure_days FROM followers WHERE user_id IN ({0});".format(placeholders)
 
-                self.cursor.execute(sql_insert, [row['user_id'], row['user_name'],
-                                                 row['user_screen_name'], row['user_time_found']])
+                self.cursor.execute(sql_unfollowers, batch_ids)
+                all_rows = self.cursor.fetchall()
 
-                inserted_unfollowers += 1
-                self.unfollowers.append({"i": inserted_unfollowers, "user_id": row['user_id'], \
-                    "user_screen_name": row['user_screen_name'], "user_name": row['user_name'], \
-                    "user_time_found": row['user_time_found']})
+                self.cursor.executemany(sql_insert, [(row['user_id'], row['user_name'],
+                                                      row['user_screen_name'],
+                                                      row['user_time_found'])
+                                                     for row in all_rows])
+                self._insert_events(EVENT_UNFOLLOW, [row['user_id'] for row in all_rows])
 
+                tenure_days = [row['tenure_days'] for row in all_rows
+                               if row['tenure_days'] is not None]
+                tenure_buckets = {}
+                for days in tenure_days:
+                    min_days = TENURE_BUCKET_DAYS[max(0, bisect_right(TENURE_BUCKET_DAYS, \
+                                                                      days) - 1)]
+                    tenure_buckets[min_days] = tenure_buckets.get(min_days, 0) + 1
+                self.cursor.executemany(sql_update_tenure, [(count, min_days) for min_days, count
+                                                            in tenure_buckets.items()])
+                self._add_stats(**{STAT_TENURE_DAYS: sum(tenure_days)})
+
+                for row in all_rows:
+                    inserted_unfollowers += 1
+                    unfollowers.append({"i": inserted_unfollowers, "user_id": row['user_id'], \
+                        "user_screen_name": row['user_screen_name'], \
+                        "user_name": row['user_name'], "user_time_found": row['user_time_found']})
+
+            self.cursor.execute(sql_insert_search, (last_unfollower_id,))
             self.connection.commit()
 
         except sqlite3.Error as err:
+            self.connection.rollback()
             print("insert_unfollowers error: {0}".format(err))
+            return
+        finally:
+            self.metrics.add_span("db_write", self.metrics.clock() - write_start)
 
+        self.unfollowers.extend(unfollowers)
         self.inserted_unfollowers += inserted_unfollowers
+        self.metrics.count("db_rows_written", inserted_unfollowers, table="unfollowers", \
+                           op="insert")
+
+    def start_run(self, run_mode):
+        """ inserts a row for this run into the runs table and sets run_id """
+        try:
+            self.cursor.execute("INSERT INTO runs (run_mode) VALUES (?);", (run_mode,))
+            self.connection.commit()
+
+            self.run_id = self.cursor.lastrowid
+
+        except sqlite3.Error as err:
+            print("start_run error: {0}".format(err))
+
+    def finish_run(self, follower_ids_count):
+        """ sets the finish time and follower ids count of the current run """
+        sql_finish = "UPDATE runs SET time_finished=datetime('now'), follower_ids_count=? " \
+            "WHERE run_id=?;"
+
+        try:
+            self.cursor.execute(sql_finish, (follower_ids_count, self.run_id))
+            self.connection.commit()
+
+        except sqlite3.Error as err:
+            print("finish_run error: {0}".format(err))
+
+    def _get_snapshot_ids(self, run_id):
+        """ rebuilds the id set of the snapshot for run_id from its keyframe and the deltas
+            that follow it """
+        sql_snapshot = "SELECT key_run_id FROM follower_snapshots WHERE run_id=?;"
+        sql_chain = "SELECT * FROM follower_snapshots WHERE key_run_id=? AND run_id<=? " \
+            "ORDER BY run_id;"
+
+        self.cursor.execute(sql_snapshot, (run_id,))
+        row = self.cursor.fetchone()
+        if not row:
+            return None
+
+        ids = set()
+        self.cursor.execute(sql_chain, (row['key_run_id'], run_id))
+        for snapshot in self.cursor.fetchall():
+            if snapshot['snapshot_type'] == 'key':
+                ids = set(snapshot_minions.decode_ids(snapshot['snapshot_data']))
+            else:
+                ids = snapshot_minions.apply_delta(ids, snapshot['added_data'], \
+                                                   snapshot['removed_data'])
+
+        return ids
+
+    def save_follower_snapshot(self, follower_ids, \
+                               keyframe_interval=snapshot_minions.SNAPSHOT_KEYFRAME_INTERVAL):
+        """ stores the follower ids of the current run as a snapshot. a full keyframe is
+            stored every keyframe_interval snapshots, the others store only the ids added
+            and removed since the previous snapshot. """
+
+        # a snapshot without a run would take an unrelated run id
+        if self.run_id is None:
+            print("save_follower_snapshot error: no current run")
+            return
+
+        sql_insert = "INSERT INTO follower_snapshots (run_id, snapshot_type, key_run_id, " \
+            "ids_count, snapshot_data, added_data, removed_data) VALUES (?, ?, ?, ?, ?, ?, ?);"
+
+        try:
+            self.cursor.execute("SELECT * FROM follower_snapshots ORDER BY run_id DESC LIMIT 1;")
+            previous = self.cursor.fetchone()
+
+            follower_ids = ids_minions.as_follower_ids(follower_ids)
+
+            deltas = 0
+            if previous:
+                self.cursor.execute("SELECT COUNT(*) - 1 FROM follower_snapshots WHERE " \
+                                    "key_run_id=?;", (previous['key_run_id'],))
+                deltas = self.cursor.fetchone()[0]
+
+            if not previous or deltas >= keyframe_interval:
+                row = (self.run_id, 'key', self.run_id, follower_ids.unique_count, \
+                       snapshot_minions.encode_sorted_id_chunks([follower_ids.sorted_ids()]), \
+                       None, None)
+            else:
+                previous_ids = self._get_snapshot_ids(previous['run_id'])
+                follower_diff = diff_minions.diff_follower_ids(follower_ids, previous_ids)
+                row = (self.run_id, 'delta', previous['key_run_id'], \
+                       follower_ids.unique_count, None, \
+                       snapshot_minions.encode_ids(follower_diff.added), \
+                       snapshot_minions.encode_ids(follower_diff.removed))
+
+            self.cursor.execute(sql_insert, row)
+            self.connection.commit()
+
+        except sqlite3.Error as err:
+            self.connection.rollback()
+            print("save_follower_snapshot error: {0}".format(err))
+
+    def save_follower_snapshot_delta(self, added_ids, removed_ids, follower_ids, \
+                                     keyframe_interval=snapshot_minions.SNAPSHOT_KEYFRAME_INTERVAL):
+        """ stores the current run snapshot from the ids added and removed since the previous
+            snapshot, so its cost depends on the changes rather than the follower count.
+            follower_ids are only read when there is no previous snapshot or a keyframe is
+            due. """
+
+        if self.run_id is None:
+            print("save_follower_snapshot_delta error: no current run")
+            return
+
+        sql_insert = "INSERT INTO follower_snapshots (run_id, snapshot_type, key_run_id, " \
+            "ids_count, snapshot_data, added_data, removed_data) VALUES (?, ?, ?, ?, ?, ?, ?);"
+
+        try:
+            self.cursor.execute("SELECT * FROM follower_snapshots ORDER BY run_id DESC LIMIT 1;")
+            previous = self.cursor.fetchone()
+
+            deltas = 0
+            if previous:
+                self.cursor.execute("SELECT COUNT(*) - 1 FROM follower_snapshots WHERE " \
+                                    "key_run_id=?;", (previous['key_run_id'],))
+                deltas = self.cursor.fetchone()[0]
+
+            if not previous or deltas >= keyframe_interval:
+                self.save_follower_snapshot(follower_ids, keyframe_interval)
+                return
+
+            row = (self.run_id, 'delta', previous['key_run_id'], len(follower_ids), None, \
+                   snapshot_minions.encode_ids(added_ids), \
+                   snapshot_minions.encode_ids(removed_ids))
+
+            self.cursor.execute(sql_insert, row)
+            self.connection.commit()
+
+        except sqlite3.Error as err:
+            self.connection.rollback()
+            print("save_follower_snapshot_delta error: {0}".format(err))
+
+    def _load_snapshot_table(self, run_id):
+        """ fills the temporary snapshot_ids table with the ids of the snapshot for run_id by
+            applying its keyframe and deltas in the database, decoding a chunk at a time """
+
+        sql_insert = "INSERT OR IGNORE INTO temp.snapshot_ids (user_id) VALUES (?);"
+        sql_delete = "DELETE FROM temp.snapshot_ids WHERE user_id=?;"
+
+        self.cursor.execute("DROP TABLE IF EXISTS temp.snapshot_ids;")
+        self.cursor.execute("CREATE TEMP TABLE snapshot_ids (user_id INTEGER PRIMARY KEY);")
+
+        self.cursor.execute("SELECT key_run_id FROM follower_snapshots WHERE run_id=?;", \
+                            (run_id,))
+        key_run_id = self.cursor.fetchone()['key_run_id']
+        self.cursor.execute("SELECT run_id FROM follower_snapshots WHERE key_run_id=? AND " \
+                            "run_id<=? ORDER BY run_id;", (key_run_id, run_id))
+
+        for chain_run_id in [row['run_id'] for row in self.cursor.fetchall()]:
+            self.cursor.execute("SELECT * FROM follower_snapshots WHERE run_id=?;", \
+                                (chain_run_id,))
+            snapshot = self.cursor.fetchone()
+            if snapshot['snapshot_type'] == 'key':
+                for ids in snapshot_minions.iter_decoded_id_chunks(snapshot['snapshot_data']):
+                    self.cursor.executemany(sql_insert, ((uid,) for uid in ids))
+            else:
+                for ids in snapshot_minions.iter_decoded_id_chunks(snapshot['removed_data']):
+                    self.cursor.executemany(sql_delete, ((uid,) for uid in ids))
+                for ids in snapshot_minions.iter_decoded_id_chunks(snapshot['added_data']):
+                    self.cursor.executemany(sql_insert, ((uid,) for uid in ids))
+
+    def save_follower_snapshot_from_sync(self, \
+                                         keyframe_interval=snapshot_minions.SNAPSHOT_KEYFRAME_INTERVAL):
+        """ stores the saved /followers/ids results of the current run as a snapshot like
+            save_follower_snapshot, but the ids are sorted, compared with the previous
+            snapshot and encoded in the database a batch at a time. """
+
+        if self.run_id is None:
+            print("save_follower_snapshot_from_sync error: no current run")
+            return
+
+        sql_insert = "INSERT INTO follower_snapshots (run_id, snapshot_type, key_run_id, " \
+            "ids_count, snapshot_data, added_data, removed_data) VALUES (?, ?, ?, ?, ?, ?, ?);"
+
+        sql_sorted_ids = "SELECT DISTINCT user_id FROM sync_follower_ids ORDER BY user_id;"
+
+        sql_added = "SELECT DISTINCT s.user_id FROM sync_follower_ids s WHERE NOT EXISTS " \
+            "(SELECT 1 FROM temp.snapshot_ids p WHERE p.user_id=s.user_id) ORDER BY s.user_id;"
+
+        sql_removed = "SELECT p.user_id FROM temp.snapshot_ids p WHERE NOT EXISTS " \
+            "(SELECT 1 FROM sync_follower_ids s WHERE s.user_id=p.user_id) ORDER BY p.user_id;"
+
+        try:
+            self.cursor.execute("SELECT * FROM follower_snapshots ORDER BY run_id DESC LIMIT 1;")
+            previous = self.cursor.fetchone()
+
+            deltas = 0
+            if previous:
+                self.cursor.execute("SELECT COUNT(*) - 1 FROM follower_snapshots WHERE " \
+                                    "key_run_id=?;", (previous['key_run_id'],))
+                deltas = self.cursor.fetchone()[0]
+
+            ids_count = self.count_sync_follower_ids()
+            if not previous or deltas >= keyframe_interval:
+                row = (self.run_id, 'key', self.run_id, ids_count, \
+                       snapshot_minions.encode_sorted_id_chunks( \
+                           self._iter_id_batches(sql_sorted_ids)), None, None)
+            else:
+                self._load_snapshot_table(previous['run_id'])
+                row = (self.run_id, 'delta', previous['key_run_id'], ids_count, None, \
+                       snapshot_minions.encode_sorted_id_chunks( \
+                           self._iter_id_batches(sql_added)), \
+                       snapshot_minions.encode_sorted_id_chunks( \
+                           self._iter_id_batches(sql_removed)))
+                self.cursor.execute("DROP TABLE temp.snapshot_ids;")
+
+            self.cursor.execute(sql_insert, row)
+            self.connection.commit()
+
+        except sqlite3.Error as err:
+            self.connection.rollback()
+            print("save_follower_snapshot_from_sync error: {0}".format(err))
+
+    def get_follower_snapshot(self, at=None, run_id=None):
+        """ returns the set of follower ids from the snapshot for run_id, or the latest
+            snapshot taken at or before the 'YYYY-MM-DD HH:MM:SS' utc time at. returns none
+            if there is no such snapshot. """
+
+        try:
+            if run_id is None:
+                sql_latest = "SELECT run_id FROM follower_snapshots WHERE time_taken<=? " \
+                    "ORDER BY time_taken DESC, run_id DESC LIMIT 1;"
+                self.cursor.execute(sql_latest, (at or "9999-12-31 23:59:59",))
+                row = self.cursor.fetchone()
+                if not row:
+                    return None
+                run_id = row['run_id']
+
+            return self._get_snapshot_ids(run_id)
+
+        except sqlite3.Error as err:
+            print("get_follower_snapshot error: {0}".format(err))
+
+        return None
+
+    def diff_follower_snapshots(self, from_run_id, to_run_id):
+        """ returns a FollowerDiff of the follower ids added and removed between the
+            snapshots of two runs, or none if either snapshot does not exist """
+        from_ids = self.get_follower_snapshot(run_id=from_run_id)
+        to_ids = self.get_follower_snapshot(run_id=to_run_id)
+
+        if from_ids is None or to_ids is None:
+            return None
+
+        return diff_minions.diff_follower_ids(sorted(to_ids), sorted(from_ids))
+
+    def get_churn_per_day(self, since=None, until=None):
+        """ returns rows of day, follows and unfollows from the events table between the
+            since and until 'YYYY-MM-DD HH:MM:SS' utc times """
+        sql_churn = "SELECT date(event_time) AS day, " \
+            "SUM(event_type='follow') AS follows, SUM(event_type='unfollow') AS unfollows " \
+            "FROM events WHERE event_time >= ? AND event_time < ? " \
+            "GROUP BY day ORDER BY day;"
+
+        try:
+            self.cursor.execute(sql_churn, (since or "0000-00-00", until or "9999-12-31"))
+            return self.cursor.fetchall()
+
+        except sqlite3.Error as err:
+            print("get_churn_per_day error: {0}".format(err))
+
+        return []
+
+    def get_refollow_counts(self, min_follows=2):
+        """ returns rows of user_id and follows for users who followed at least min_follows
+            times, most follows first """
+        sql_refollows = "SELECT user_id, COUNT(*) AS follows FROM events " \
+            "WHERE event_type='follow' GROUP BY user_id HAVING follows >= ? " \
+            "ORDER BY follows DESC, user_id;"
+
+        try:
+            self.cursor.execute(sql_refollows, (min_follows,))
+            return self.cursor.fetchall()
+
+        except sqlite3.Error as err:
+            print("get_refollow_counts error: {0}".format(err))
+
+        return []
+
+    def get_follower_tenure(self, since=None):
+        """ returns rows of user_id, time_followed, time_unfollowed and tenure_days for each
+            unfollow since the 'YYYY-MM-DD HH:MM:SS' utc time, pairing it with the follow
+            that preceded it """
+        sql_tenure = "SELECT user_id, time_followed, time_unfollowed, " \
+            "julianday(time_unfollowed) - julianday(time_followed) AS tenure_days FROM (" \
+            "SELECT u.user_id, u.event_time AS time_unfollowed, " \
+            "(SELECT MAX(f.event_time) FROM events f WHERE f.event_type='follow' " \
+            "AND f.user_id=u.user_id AND f.event_time <= u.event_time) AS time_followed " \
+            "FROM events u WHERE u.event_type='unfollow' AND u.event_time >= ?) " \
+            "ORDER BY time_unfollowed;"
+
+        try:
+            self.cursor.execute(sql_tenure, (since or "0000-00-00",))
+            return self.cursor.fetchall()
+
+        except sqlite3.Error as err:
+            print("get_follower_tenure error: {0}".format(err))
+
+        return []
+
+    def get_stats_report(self, days=REPORT_DAYS):
+        """ returns a dictionary of the follower aggregates: the followers, reach, follows
+            and unfollows totals, the follows and unfollows of the most recent days, the
+            churn over those days and the unfollows per tenure bucket. reads a fixed number
+            of rows whatever the size of the database. """
+        sql_daily = "SELECT day, follows, unfollows FROM daily_stats ORDER BY day DESC LIMIT ?;"
+
+        try:
+            self.cursor.execute("SELECT stat_name, stat_value FROM stats;")
+            stats = {row['stat_name']: row['stat_value'] for row in self.cursor.fetchall()}
+
+            self.cursor.execute(sql_daily, (days,))
+            daily = [dict(row) for row in reversed(self.cursor.fetchall())]
+
+            self.cursor.execute("SELECT min_days, unfollows FROM tenure_stats ORDER BY min_days;")
+            tenure = [dict(row) for row in self.cursor.fetchall()]
+
+        except sqlite3.Error as err:
+            print("get_stats_report error: {0}".format(err))
+            return None
+
+        followers = stats.get(STAT_FOLLOWERS, 0)
+        tenure_unfollows = sum(bucket['unfollows'] for bucket in tenure)
+        recent_unfollows = sum(day['unfollows'] for day in daily)
+
+        return {"followers": followers, "reach": stats.get(STAT_REACH, 0),
+                "follows": stats.get(STAT_FOLLOWS, 0),
+                "unfollows": stats.get(STAT_UNFOLLOWS, 0),
+                "days": len(daily),
+                "recent_follows": sum(day['follows'] for day in daily),
+                "recent_unfollows": recent_unfollows,
+                "churn_rate": round(recent_unfollows / float(followers + recent_unfollows), 6) \
+                    if followers + recent_unfollows else 0.0,
+                "mean_tenure_days": round(stats.get(STAT_TENURE_DAYS, 0) / tenure_unfollows, 2) \
+                    if tenure_unfollows else None,
+                "daily": daily, "tenure": tenure}
+
+    def search_profiles(self, query, limit=SEARCH_LIMIT, unfollowers=True):
+        """ returns rows of user_id, status, name, screen_name, description, location and
+            rank of the followers, and unfollowers if set, whose indexed profile text has
+            every word of the query as a word prefix. best matches have the lowest rank,
+            name and screen name matches rank above description and location matches. """
+        match = " ".join('"{0}"*'.format(word.replace('"', '""')) for word in query.split())
+        if not match:
+            return []
+
+        sql_search = "SELECT COALESCE(u.user_id, s.rowid) AS user_id, " \
+            "CASE WHEN s.rowid < 0 THEN 'unfollower' ELSE 'follower' END AS status, " \
+            "s.name, s.screen_name, s.description, s.location, " \
+            "bm25(profile_search, {0}) AS rank FROM profile_search s " \
+            "LEFT JOIN unfollowers u ON u.id=-s.rowid " \
+            "WHERE profile_search MATCH ? {1}ORDER BY rank LIMIT ?;".format( \
+                ", ".join(str(weight) for weight in SEARCH_WEIGHTS), \
+                "" if unfollowers else "AND s.rowid > 0 ")
+
+        try:
+            self.cursor.execute(sql_search, (match, limit))
+            return [dict(row) for row in self.cursor.fetchall()]
+
+        except sqlite3.Error as err:
+            print("search_profiles error: {0}".format(err))
+
+        return []
+
+    def get_profile(self, user_id):
+        """ returns the stored user json dictionary for a follower or none """
+        sql_profile = "SELECT f.*, p.dict_id, p.profile_data FROM followers f " \
+            "LEFT JOIN profiles p ON p.profile_hash=f.user_profile_hash WHERE f.user_id=?;"
+
+        try:
+            self.cursor.execute(sql_profile, (user_id,))
+            row = self.cursor.fetchone()
+            if not row:
+                return None
+
+            return self.decode_profile(row)
+
+        except sqlite3.Error as err:
+            print("get_profile error: {0}".format(err))
+
+        return None
+
+    def decode_profile(self, row):
+        """ returns the user json dictionary from a row with profile_data and dict_id columns
+            or, for records written before profiles were compressed, a user_json column. the
+            counts kept out of the stored profile are set from the profile columns of the row
+            if it has them """
+        if row['profile_data'] is not None:
+            zdict = self._get_profile_dict(row['dict_id'])
+            profile = json.loads(profile_minions.decompress_profile(row['profile_data'], zdict))
+        elif row['user_json']:
+            profile = json.loads(row['user_json'])
+        else:
+            return None
+
+        row_columns = row.keys()
+        for column, column_type, key in profile_minions.PROFILE_COLUMNS:
+            if key in profile_minions.VOLATILE_KEYS and column in row_columns and \
+               row[column] is not None:
+                profile[key] = row[column]
+
+        return profile
+
+    def _sample_profile_json(self, samples):
+        """ returns up to samples canonical profile json texts from the database """
+        sql_sample = "SELECT f.user_json, p.dict_id, p.profile_data FROM followers f " \
+            "LEFT JOIN profiles p ON p.profile_hash=f.user_profile_hash " \
+            "ORDER BY random() LIMIT ?;"
+
+        json_texts = []
+        for row in self.connection.execute(sql_sample, (samples,)).fetchall():
+            user_json = self.decode_profile(row)
+            if user_json:
+                json_texts.append(profile_minions.profile_json(user_json))
+
+        return json_texts
+
+    def train_profile_dict(self, samples=PROFILE_DICT_SAMPLES):
+        """ trains a compression dictionary from a sample of stored profiles and uses it to
+            compress profiles written from now on. returns the new dictionary id or none """
+        json_texts = self._sample_profile_json(samples)
+        if not json_texts:
+            return None
+
+        zdict = profile_minions.train_dictionary(json_texts)
+
+        try:
+            self.cursor.execute("INSERT INTO profile_dicts (dict_data) VALUES (?);", (zdict,))
+            self.connection.commit()
+
+            self.profile_dict_id = self.cursor.lastrowid
+            self._profile_dicts[self.profile_dict_id] = zdict
+
+        except sqlite3.Error as err:
+            print("train_profile_dict error: {0}".format(err))
+            return None
+
+        return self.profile_dict_id
+
+    def compact_profiles(self):
+        """ moves user_json text written before profiles were compressed into the profiles
+            table, training a compression dictionary first if there is none. returns the
+            number of followers migrated """
+
+        sql_legacy = "SELECT user_id, user_json, " \
+            "COALESCE(user_time_updated, user_time_found) AS time_seen FROM followers " \
+            "WHERE user_profile_hash IS NULL AND user_json IS NOT NULL;"
+
+        sql_insert_profile = "INSERT OR IGNORE INTO profiles (profile_hash, dict_id, " \
+            "profile_data) VALUES (?, ?, ?);"
+        sql_insert_version = "INSERT INTO profile_versions (user_id, profile_hash, time_seen) " \
+            "VALUES (?, ?, ?);"
+        sql_update = "UPDATE followers SET user_profile_hash=?, user_json=null WHERE user_id=?;"
+
+        self.flush_followers()
+
+        if self.profile_dict_id is None:
+            self.train_profile_dict()
+
+        zdict = self._get_profile_dict(self.profile_dict_id)
+        dict_id = self.profile_dict_id if zdict else None
+
+        migrated = 0
+        try:
+            legacy_cursor = self.connection.execute(sql_legacy)
+            while True:
+                rows = legacy_cursor.fetchmany(self.batch_size)
+                if not rows:
+                    break
+
+                profile_rows, version_rows, update_rows = [], [], []
+                for row in rows:
+                    json_text = profile_minions.profile_json(json.loads(row['user_json']))
+                    hash_value = profile_minions.profile_hash(json_text)
+
+                    profile_rows.append((hash_value, dict_id, \
+                                         profile_minions.compress_profile(json_text, zdict)))
+                    version_rows.append((row['user_id'], hash_value, row['time_seen']))
+                    update_rows.append((hash_value, row['user_id']))
+
+                self.cursor.executemany(sql_insert_profile, profile_rows)
+                self.cursor.executemany(sql_insert_version, version_rows)
+                self.cursor.executemany(sql_update, update_rows)
+                migrated += len(rows)
+
+            self.connection.commit()
+
+        except sqlite3.Error as err:
+            self.connection.rollback()
+            print("compact_profiles error: {0}".format(err))
+            return 0
+
+        return migrated
+
+    def get_stale_follower_ids(self, limit, order="stale"):
+        """ returns up to limit follower ids to refresh. the 'stale' order picks the followers
+            with the oldest user_time_updated. the 'priority' order picks from the oldest
+            REFRESH_PRIORITY_CANDIDATES times limit followers those with the highest score of
+            days since updated multiplied by the number of profile versions seen, so profiles
+            that change often are refreshed sooner """
+
+        sql_stale = "SELECT user_id, " \
+            "julianday('now') - julianday(COALESCE(user_time_updated, user_time_found)) " \
+            "AS stale_days FROM followers ORDER BY user_time_updated LIMIT ?;"
+
+        try:
+            if order != "priority":
+                self.cursor.execute(sql_stale, (limit,))
+                return [row['user_id'] for row in self.cursor.fetchall()]
+
+            self.cursor.execute(sql_stale, (limit * REFRESH_PRIORITY_CANDIDATES,))
+            candidates = self.cursor.fetchall()
+
+            versions = {}
+            candidate_ids = [row['user_id'] for row in candidates]
+            for i in range(0, len(candidate_ids), self.batch_size):
+                batch_ids = candidate_ids[i:i + self.batch_size]
+                placeholders = ', '.join(['?']*len(batch_ids))
+                self.cursor.execute("SELECT user_id, COUNT(*) AS versions FROM profile_versions " \
+                                    "WHERE user_id IN ({0}) GROUP BY user_id;".format(placeholders),
+                                    batch_ids)
+                for row in self.cursor.fetchall():
+                    versions[row['user_id']] = row['versions']
+
+            candidates = sorted(candidates, key=lambda row: (row['stale_days'] or 0) * \
+                                (1 + versions.get(row['user_id'], 0)), reverse=True)
+
+            return [row['user_id'] for row in candidates[:limit]]
+
+        except sqlite3.Error as err:
+            print("get_stale_follower_ids error: {0}".format(err))
+
+        return []
+
+    def touch_followers(self, followers_id_list):
+        """ sets the updated time of followers without changing their data, so followers
+            that could not be refreshed are not picked first by every refresh """
+        sql_touch = "UPDATE followers SET user_time_updated=datetime('now') WHERE user_id=?;"
+
+        try:
+            self.cursor.executemany(sql_touch, [(uid,) for uid in followers_id_list])
+            self.connection.commit()
+
+        except sqlite3.Error as err:
+            self.connection.rollback()
+            print("touch_followers error: {0}".format(err))
+
+    def save_head_ids(self, follower_ids):
+        """ stores the first HEAD_IDS_SIZE of the newest-first follower ids for the current run """
+        head_ids = array('q', follower_ids[:HEAD_IDS_SIZE])
+
+        try:
+            self.cursor.execute("UPDATE runs SET head_ids=? WHERE run_id=?;", \
+                                (head_ids.tobytes(), self.run_id))
+            self.connection.commit()
+
+        except sqlite3.Error as err:
+            print("save_head_ids error: {0}".format(err))
+
+    def get_previous_head_ids(self):
+        """ returns the newest-first head follower ids of the latest finished run or an empty
+            list """
+        sql_head = "SELECT head_ids FROM runs WHERE head_ids IS NOT NULL AND " \
+            "time_finished IS NOT NULL ORDER BY run_id DESC LIMIT 1;"
+
+        try:
+            self.cursor.execute(sql_head)
+            row = self.cursor.fetchone()
+            if row:
+                head_ids = array('q')
+                head_ids.frombytes(row['head_ids'])
+                return list(head_ids)
+
+        except sqlite3.Error as err:
+            print("get_previous_head_ids error: {0}".format(err))
+
+        return []
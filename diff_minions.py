@@ -0,0 +1,86 @@
+""" reconciles follower id collections """
+
+import ids_minions
+
+class FollowerDiff(object):
+    """ result of comparing a current collection of follower ids with a previous one. """
+
+    def __init__(self, added, removed, unchanged):
+        # ids in current but not previous, in current order (newest first for api ids)
+        self.added = added
+
+        # ids in previous but not current, in previous order
+        self.removed = removed
+
+        # ids in both collections, in current order. may be a function returning them that
+        # is called on first use
+        self._unchanged = unchanged
+
+    @property
+    def unchanged(self):
+        """ returns ids in both collections, in current order """
+        if callable(self._unchanged):
+            self._unchanged = self._unchanged()
+        return self._unchanged
+
+    @property
+    def added_count(self):
+        """ returns number of added ids """
+        return len(self.added)
+
+    @property
+    def removed_count(self):
+        """ returns number of removed ids """
+        return len(self.removed)
+
+    @property
+    def unchanged_count(self):
+        """ returns number of unchanged ids """
+        return len(self.unchanged)
+
+def _ordered_unique(ids):
+    """ returns ids with duplicates removed, keeping the first occurrence. """
+    seen = set()
+    unique_ids = []
+    for uid in ids:
+        if uid not in seen:
+            seen.add(uid)
+            unique_ids.append(uid)
+
+    return unique_ids
+
+def diff_follower_ids(current_ids, previous_ids):
+    """ compares current follower ids (e.g. from /followers/ids) with previous follower ids
+        (e.g. from the followers table) by merging their sorted int64 arrays, so the cost is
+        linear in the size of both collections and only the changed ids are held as python
+        ints. removed ids of previous ids in ascending order come out of the merge in order.
+        unchanged ids are listed when first used. returns a FollowerDiff. """
+
+    current_ids = ids_minions.as_follower_ids(current_ids)
+    previous_ids = ids_minions.as_follower_ids(previous_ids)
+
+    added_set = set(current_ids.difference(previous_ids))
+    added = _ordered_unique(filter(added_set.__contains__, current_ids))
+
+    removed_ids = previous_ids.difference(current_ids)
+    if previous_ids.is_sorted:
+        removed = removed_ids.tolist()
+    else:
+        removed_set = set(removed_ids)
+        removed = _ordered_unique(filter(removed_set.__contains__, previous_ids))
+
+    def list_unchanged():
+        """ returns current ids that are not added, in current order """
+        return _ordered_unique(uid for uid in current_ids if uid not in added_set)
+
+    return FollowerDiff(added, removed, list_unchanged)
+
+def find_head_index(current_ids, previous_head_ids):
+    """ returns the index of the first of the newest-first current ids that is in the set of
+        ids at the head of the previous listing, the ids before it are the followers that
+        arrived since. returns none if no previous head id is in current ids. """
+    for index, uid in enumerate(current_ids):
+        if uid in previous_head_ids:
+            return index
+
+    return None
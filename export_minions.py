@@ -0,0 +1,244 @@
+""" exports the tables of a users database to csv, ndjson or parquet files """
+
+import os
+import re
+import csv
+import json
+import time
+import zlib
+import sqlite3
+import importlib.util
+
+import profile_minions
+
+EXPORT_FORMATS = ("csv", "ndjson", "parquet")
+
+# rows read per fetchmany and written per parquet row group
+EXPORT_BATCH_SIZE = 10000
+
+# exported tables with their columns and value types, and the column whose largest
+# exported value is saved as the watermark that incremental exports continue from. rows
+# are only ever added to the history tables, so their ids are the watermark. followers are
+# updated in place and use the time they were last written.
+FOLLOWER_COLUMNS = (("user_id", "int"), ("user_name", "str"), ("user_screen_name", "str"),
+                    ("user_time_found", "str"), ("user_time_updated", "str")) + \
+    tuple((column, "int" if column_type == "INTEGER" else "str")
+          for column, column_type, key in profile_minions.PROFILE_COLUMNS)
+
+EXPORT_TABLES = {
+    "followers": {"columns": FOLLOWER_COLUMNS, "watermark": "user_time_updated"},
+    "unfollowers": {"columns": (("id", "int"), ("user_id", "int"), ("user_name", "str"),
+                                ("user_screen_name", "str"), ("user_time_found", "str"),
+                                ("user_time_lost", "str")),
+                    "watermark": "id"},
+    "events": {"columns": (("event_id", "int"), ("user_id", "int"), ("event_type", "str"),
+                           ("run_id", "int"), ("event_time", "str")),
+               "watermark": "event_id"},
+    "runs": {"columns": (("run_id", "int"), ("run_mode", "str"), ("time_started", "str"),
+                         ("time_finished", "str"), ("follower_ids_count", "int")),
+             "watermark": "run_id"},
+    "profile_versions": {"columns": (("version_id", "int"), ("user_id", "int"),
+                                     ("profile_hash", "str"), ("time_seen", "str")),
+                         "watermark": "version_id"},
+}
+
+# the decoded profile json column added to followers exports with profiles
+PROFILE_JSON_COLUMN = ("user_json", "str")
+
+def parquet_available():
+    """ returns true if pyarrow, which parquet exports need, can be imported """
+    return importlib.util.find_spec("pyarrow") is not None
+
+def _export_errors(export_format):
+    """ returns the exception types that an export in the format fails with. pyarrow
+        errors are only included for parquet, so pyarrow is not imported otherwise """
+    errors = (sqlite3.Error, OSError, ValueError, zlib.error)
+    if export_format == "parquet" and parquet_available():
+        import pyarrow
+        errors += (pyarrow.ArrowException,)
+
+    return errors
+
+class CSVExportWriter(object):
+    """ writes rows to a csv file with a header line """
+
+    def __init__(self, path, columns):
+        self.file = open(path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow([name for name, value_type in columns])
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+class NDJSONExportWriter(object):
+    """ writes rows to a file as one json object per line """
+
+    def __init__(self, path, columns):
+        self.file = open(path, "w", encoding="utf-8")
+        self.names = [name for name, value_type in columns]
+
+    def write_rows(self, rows):
+        self.file.writelines(json.dumps(dict(zip(self.names, row)), ensure_ascii=False) + "\n"
+                             for row in rows)
+
+    def close(self):
+        self.file.close()
+
+class ParquetExportWriter(object):
+    """ writes each batch of rows to a parquet file as a row group of typed columns """
+
+    def __init__(self, path, columns):
+        import pyarrow
+        import pyarrow.parquet
+
+        self.pyarrow = pyarrow
+        types = {"int": pyarrow.int64(), "str": pyarrow.string()}
+        self.schema = pyarrow.schema([(name, types[value_type]) for name, value_type in columns])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write_rows(self, rows):
+        arrays = [self.pyarrow.array([row[index] for row in rows], type=field.type)
+                  for index, field in enumerate(self.schema)]
+        self.writer.write_table(self.pyarrow.Table.from_arrays(arrays, schema=self.schema), \
+                                row_group_size=len(rows))
+
+    def close(self):
+        self.writer.close()
+
+EXPORT_WRITERS = {"csv": CSVExportWriter, "ndjson": NDJSONExportWriter,
+                  "parquet": ParquetExportWriter}
+
+def _table_query(table_name, columns, watermark_column, watermark, profiles, incremental):
+    """ returns the sql and parameters selecting the rows of a table after the watermark,
+        in watermark order. an incremental export of followers leaves the rows updated in
+        the current second for the next one """
+    select = ", ".join("t.{0}".format(name) for name, value_type in columns)
+    sql_from = "FROM {0} t".format(table_name)
+    if profiles:
+        select += ", t.user_json, p.dict_id, p.profile_data"
+        sql_from += " LEFT JOIN profiles p ON p.profile_hash=t.user_profile_hash"
+
+    conditions, params = [], []
+    if watermark is not None:
+        conditions.append("t.{0} > ?".format(watermark_column))
+        params.append(watermark)
+    if incremental and watermark_column == "user_time_updated":
+        # rows written later in the current second would fall behind the watermark
+        conditions.append("t.{0} < datetime('now')".format(watermark_column))
+
+    sql_where = " WHERE " + " AND ".join(conditions) if conditions else ""
+
+    return "SELECT {0} {1}{2} ORDER BY t.{3};".format(select, sql_from, sql_where, \
+                                                      watermark_column), params
+
+def export_table(dbm, table_name, directory, export_format="csv", incremental=False, \
+                 profiles=False, batch_size=EXPORT_BATCH_SIZE):
+    """ streams a table of the database to a file in the directory, batch_size rows at a
+        time. an incremental export only writes the rows added or changed since the last
+        export of the table and names the file by time and watermark, nothing is written if
+        there are none. the file is written under a temporary name and the watermark is saved only
+        once it is complete. returns a dictionary of the table, path, rows and watermark. """
+
+    table = EXPORT_TABLES[table_name]
+    columns = table['columns']
+    watermark_column = table['watermark']
+    profiles = profiles and table_name == "followers"
+
+    previous_watermark = dbm.get_export_watermark(table_name) if incremental else None
+    sql, params = _table_query(table_name, columns, watermark_column, previous_watermark, \
+                               profiles, incremental)
+
+    path = os.path.join(directory, "{0}.{1}".format(table_name, export_format))
+    temp_path = path + ".tmp"
+
+    if profiles:
+        columns = columns + (PROFILE_JSON_COLUMN,)
+    watermark_index = [name for name, value_type in columns].index(watermark_column)
+
+    # a full export writes every row, but its watermark stays behind the current second
+    # so rows written later in it are not behind the watermark of the next incremental
+    watermark_limit = None
+    if not incremental and watermark_column == "user_time_updated":
+        watermark_limit = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime())
+
+    errors = _export_errors(export_format)
+    writer = None
+    rows_count = 0
+    watermark = previous_watermark
+    try:
+        for rows in dbm.iter_row_batches(sql, params, batch_size):
+            if profiles:
+                rows = [tuple(row)[:len(columns) - 1] + (_profile_text(dbm, row),)
+                        for row in rows]
+            if writer is None:
+                writer = EXPORT_WRITERS[export_format](temp_path, columns)
+            writer.write_rows(rows)
+            rows_count += len(rows)
+            if watermark_limit is None:
+                watermark = rows[-1][watermark_index]
+            else:
+                watermark = max([row[watermark_index] for row in rows
+                                 if row[watermark_index] is not None and \
+                                 row[watermark_index] < watermark_limit] or [watermark])
+
+        if writer is None and not incremental:
+            writer = EXPORT_WRITERS[export_format](temp_path, columns)
+
+    except errors as err:
+        print("export_table error: {0}".format(err))
+        if writer:
+            try:
+                writer.close()
+            except errors:
+                pass
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return None
+
+    if writer is None:
+        return {"table": table_name, "path": None, "rows": 0, "watermark": watermark}
+
+    # the watermark keeps the names of incremental exports made in the same second apart
+    if incremental:
+        path = os.path.join(directory, "{0}-{1}-{2}.{3}".format( \
+            table_name, time.strftime("%Y%m%d%H%M%S"), re.sub(r"\W", "", str(watermark)), \
+            export_format))
+
+    writer.close()
+    os.replace(temp_path, path)
+
+    if rows_count:
+        dbm.save_export_watermark(table_name, watermark, rows_count)
+
+    return {"table": table_name, "path": path, "rows": rows_count, "watermark": watermark}
+
+def _profile_text(dbm, row):
+    """ returns the stored profile json text of a follower row or none """
+    user_json = dbm.decode_profile(row)
+    if user_json is None:
+        return None
+
+    return json.dumps(user_json, ensure_ascii=False)
+
+def export_tables(dbm, directory, export_format="csv", incremental=False, profiles=False, \
+                  tables=None):
+    """ exports the tables, all by default, to files in the directory. returns a list of
+        the table result dictionaries, or none if an export failed. """
+
+    try:
+        os.makedirs(directory, exist_ok=True)
+    except OSError as err:
+        print("export_tables error: {0}".format(err))
+        return None
+
+    results = []
+    for table_name in tables or EXPORT_TABLES:
+        result = export_table(dbm, table_name, directory, export_format, incremental, profiles)
+        if result is None:
+            return None
+        results.append(result)
+
+    return results
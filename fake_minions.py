@@ -0,0 +1,226 @@
+""" offline stand-in for the twitter api endpoints used, with synthetic followers """
+
+import random
+import threading
+
+import tweepy
+
+import rate_minions
+
+# requests per 15 minute window for user authentication
+FAKE_RATE_LIMITS = {rate_minions.FOLLOWERS_IDS: 15,
+                    rate_minions.FOLLOWERS_LIST: 15,
+                    rate_minions.USERS_SHOW: 900,
+                    rate_minions.USERS_LOOKUP: 900,
+                    "/application/rate_limit_status": 180}
+
+# first synthetic follower id and the gap between ids
+FAKE_ID_BASE = 1000000000
+FAKE_ID_STEP = 7
+
+class FakeClock(object):
+    """ virtual time so rate limit waits take no real time. """
+
+    def __init__(self, start=1500000000.0):
+        self.now = start
+        self._lock = threading.Lock()
+
+    def time(self):
+        """ returns the virtual epoch time """
+        return self.now
+
+    def sleep(self, seconds):
+        """ advances the virtual time """
+        with self._lock:
+            self.now += max(0, seconds)
+
+class FakeResponse(object):
+    """ the parts of a requests response read after an api call. """
+
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+class FakeFollowerGraph(object):
+    """ deterministic synthetic followers of one user, listed newest first. advance applies
+        a step of churn: followers anywhere in the list leave and new followers arrive at
+        the head. the same seed, size and steps always produce the same followers. """
+
+    def __init__(self, followers_count, seed=1, owner_id=1):
+        self.seed = seed
+        self.owner_id = owner_id
+        self.follower_ids = [FAKE_ID_BASE + uid * FAKE_ID_STEP
+                             for uid in range(followers_count, 0, -1)]
+        self.follower_id_set = set(self.follower_ids)
+        self._next_id = followers_count + 1
+
+        # bumped for followers whose profile changed, so their json changes
+        self.profile_versions = {}
+
+    def advance(self, new=10, lost=5, changed=0, steps=1):
+        """ applies steps of churn, each with new followers, lost followers and changed
+            profiles """
+        for step in range(steps):
+            rng = random.Random("{0}-{1}-{2}".format(self.seed, self._next_id, step))
+
+            for uid in rng.sample(self.follower_ids, min(changed, len(self.follower_ids))):
+                self.profile_versions[uid] = self.profile_versions.get(uid, 0) + 1
+
+            lost_ids = set(rng.sample(self.follower_ids, min(lost, len(self.follower_ids))))
+            self.follower_ids = [uid for uid in self.follower_ids if uid not in lost_ids]
+
+            new_ids = [FAKE_ID_BASE + (self._next_id + i) * FAKE_ID_STEP for i in range(new)]
+            self._next_id += new
+            self.follower_ids[:0] = reversed(new_ids)
+
+            self.follower_id_set.difference_update(lost_ids)
+            self.follower_id_set.update(new_ids)
+
+    def user_json(self, user_id):
+        """ returns a deterministic api user json dictionary for a user id """
+        if user_id == self.owner_id:
+            return {"id": user_id, "id_str": str(user_id), "name": "Minions Owner",
+                    "screen_name": "minions_owner", "description": "", "protected": False,
+                    "followers_count": len(self.follower_ids), "friends_count": 100,
+                    "statuses_count": 1000, "verified": False, "lang": None,
+                    "created_at": "Mon Jan 01 00:00:00 +0000 2010"}
+
+        rng = random.Random(user_id)
+        version = self.profile_versions.get(user_id, 0)
+        return {"id": user_id, "id_str": str(user_id),
+                "name": "Follower {0}".format(user_id),
+                "screen_name": "follower{0}".format(user_id),
+                "location": rng.choice(["", "London", "Sydney, Australia", "New York, NY"]),
+                "description": rng.choice(["", "coffee, cats and code", "opinions my own",
+                                           "photographer | traveller"]) + \
+                               (" v{0}".format(version) if version else ""),
+                "url": None, "entities": {"description": {"urls": []}},
+                "protected": rng.random() < 0.05,
+                "followers_count": int(rng.paretovariate(1.2) * 20),
+                "friends_count": rng.randint(0, 2000), "listed_count": rng.randint(0, 20),
+                "created_at": "Mon Jan {0:02d} 10:00:00 +0000 {1}".format( \
+                    rng.randint(1, 28), rng.randint(2007, 2019)),
+                "favourites_count": rng.randint(0, 9999), "utc_offset": None,
+                "time_zone": None, "geo_enabled": rng.random() < 0.3,
+                "verified": rng.random() < 0.01, "statuses_count": rng.randint(0, 30000),
+                "lang": rng.choice([None, "en", "es", "ja"]),
+                "contributors_enabled": False, "is_translator": False,
+                "profile_background_color": "F5F8FA",
+                "profile_image_url_https": "https://pbs.twimg.com/profile_images/" \
+                                           "{0}/photo_normal.jpg".format(user_id * 3),
+                "profile_link_color": "1DA1F2", "profile_text_color": "333333",
+                "profile_use_background_image": True, "default_profile": True,
+                "default_profile_image": False, "following": False,
+                "follow_request_sent": False, "notifications": False,
+                "translator_type": "none"}
+
+class FakeTwitterAPI(object):
+    """ in-process stand-in for the tweepy.API methods used by APIMinions. it serves
+        /followers/ids, /followers/list, /users/show and /users/lookup from a
+        FakeFollowerGraph, returns tweepy model objects, sets last_response with
+        x-rate-limit-* headers and raises tweepy.RateLimitError once a window is used up. """
+
+    def __init__(self, graph, clock=None):
+        self.graph = graph
+        self.clock = clock or FakeClock()
+        self.parser = tweepy.parsers.ModelParser()
+
+        self.last_response = None
+
+        # requests made per endpoint, including rate limited ones
+        self.requests = {}
+
+        self._windows = {}
+        self._lock = threading.Lock()
+
+    def _request(self, endpoint):
+        """ counts a request and sets last_response, raising if the window is used up """
+        with self._lock:
+            self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+
+            now = self.clock.time()
+            limit = FAKE_RATE_LIMITS[endpoint]
+            reset, used = self._windows.get(endpoint, (0, 0))
+            if now >= reset:
+                reset, used = int(now) + rate_minions.RATE_LIMIT_WINDOW, 0
+
+            rate_limited = used >= limit
+            if not rate_limited:
+                used += 1
+            self._windows[endpoint] = (reset, used)
+
+            response = FakeResponse(429 if rate_limited else 200, \
+                                    {'x-rate-limit-limit': str(limit), \
+                                     'x-rate-limit-remaining': str(limit - used), \
+                                     'x-rate-limit-reset': str(reset)})
+            self.last_response = response
+
+        if rate_limited:
+            raise tweepy.RateLimitError("Rate limit exceeded", response)
+
+    def _user(self, user_id):
+        """ returns a tweepy user model for a user id """
+        return tweepy.models.User.parse(self, self.graph.user_json(user_id))
+
+    def _page(self, cursor, count):
+        """ returns the slice of follower ids for a cursor and the previous and next cursors,
+            cursors are the offset into the list plus one """
+        start = 0 if cursor in (None, -1) else int(cursor) - 1
+        end = start + count
+        next_cursor = end + 1 if end < len(self.graph.follower_ids) else 0
+
+        return self.graph.follower_ids[start:end], (start + 1 if start else 0, next_cursor)
+
+    def followers_ids(self, user_id=None, cursor=-1, count=5000, **kwargs):
+        """ /followers/ids, pages of up to 5000 ids newest first """
+        self._request(rate_minions.FOLLOWERS_IDS)
+        return self._page(cursor, min(count, 5000))
+
+    followers_ids.pagination_mode = 'cursor'
+
+    def followers(self, user_id=None, cursor=-1, count=200, **kwargs):
+        """ /followers/list, pages of up to 200 user objects newest first """
+        self._request(rate_minions.FOLLOWERS_LIST)
+        page_ids, cursors = self._page(cursor, min(count, 200))
+        return [self._user(uid) for uid in page_ids], cursors
+
+    followers.pagination_mode = 'cursor'
+
+    def get_user(self, id=None, user_id=None, screen_name=None, **kwargs):
+        """ /users/show, the owner for any @name or a follower by id """
+        self._request(rate_minions.USERS_SHOW)
+        uid = user_id or id
+        if screen_name or not str(uid).isdigit():
+            uid = self.graph.owner_id
+
+        return self._user(int(uid))
+
+    def lookup_users(self, user_ids=None, screen_names=None, **kwargs):
+        """ /users/lookup, up to 100 users that still follow, in any order """
+        self._request(rate_minions.USERS_LOOKUP)
+        if isinstance(user_ids, str):
+            user_ids = user_ids.split(",")
+
+        users = [self._user(int(uid)) for uid in (user_ids or [])[:100]
+                 if int(uid) in self.graph.follower_id_set or int(uid) == self.graph.owner_id]
+        if not users:
+            raise tweepy.TweepError([{"code": 17, "message": "No user matches for " \
+                                      "specified terms."}])
+
+        return users
+
+    def rate_limit_status(self, **kwargs):
+        """ /application/rate_limit_status for the fake endpoints """
+        self._request("/application/rate_limit_status")
+
+        resources = {}
+        for endpoint, limit in FAKE_RATE_LIMITS.items():
+            reset, used = self._windows.get(endpoint, (0, 0))
+            if self.clock.time() >= reset:
+                reset, used = int(self.clock.time()) + rate_minions.RATE_LIMIT_WINDOW, 0
+            family = endpoint.split("/")[1]
+            resources.setdefault(family, {})[endpoint] = {"limit": limit, \
+                                                          "remaining": limit - used, \
+                                                          "reset": reset}
+
+        return {"resources": resources}
@@ -0,0 +1,132 @@
+""" compact collections of twitter ids """
+
+from array import array
+from bisect import bisect_left
+from itertools import islice
+from operator import eq, lt
+
+class FollowerIds(object):
+    """ ids kept in the order they were added in an int64 array, 8 bytes per id rather than
+        the 36 or so of a python list of ints. a sorted copy without duplicates is built on
+        first use for membership tests with bisect and for set operations by merging. ids
+        added in ascending order, such as those read from the followers table by user id,
+        are their own sorted copy. """
+
+    def __init__(self, ids=None):
+        self._ids = array('q')
+        self._sorted_ids = None
+
+        # true while every id is greater than the one before, so there are no duplicates
+        self._ascending = True
+
+        if ids is not None:
+            self.extend(ids)
+
+    def extend(self, ids):
+        """ appends ids from an iterable, array or FollowerIds """
+        if isinstance(ids, FollowerIds):
+            ids = ids._ids
+        start = len(self._ids)
+        self._ids.extend(ids)
+        if len(self._ids) == start:
+            return
+
+        self._sorted_ids = None
+        if self._ascending:
+            with memoryview(self._ids) as view:
+                tail = view[max(0, start - 1):]
+                self._ascending = all(map(lt, tail, tail[1:]))
+
+    def append(self, uid):
+        """ appends an id """
+        if self._ascending and self._ids:
+            self._ascending = self._ids[-1] < uid
+        self._ids.append(uid)
+        self._sorted_ids = None
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __getitem__(self, index):
+        return self._ids[index]
+
+    def __contains__(self, uid):
+        sorted_ids = self.sorted_ids()
+        index = bisect_left(sorted_ids, uid)
+        return index < len(sorted_ids) and sorted_ids[index] == uid
+
+    def sorted_ids(self):
+        """ returns a sorted int64 array of the ids without duplicates, which is the ids
+            themselves if they were added in ascending order """
+        if self._ascending:
+            return self._ids
+
+        if self._sorted_ids is None:
+            sorted_ids = sorted(self._ids)
+            if any(map(eq, sorted_ids, islice(sorted_ids, 1, None))):
+                sorted_ids = [uid for index, uid in enumerate(sorted_ids)
+                              if not index or uid != sorted_ids[index - 1]]
+            self._sorted_ids = array('q', sorted_ids)
+
+        return self._sorted_ids
+
+    @property
+    def is_sorted(self):
+        """ returns true if the ids are in ascending order without duplicates """
+        return self._ascending
+
+    @property
+    def unique_count(self):
+        """ returns the number of ids without duplicates """
+        return len(self.sorted_ids())
+
+    def difference(self, other):
+        """ returns a sorted int64 array of the ids not in other """
+        return _merge(self.sorted_ids(), as_follower_ids(other).sorted_ids(), True, False)
+
+    def intersection(self, other):
+        """ returns a sorted int64 array of the ids also in other """
+        return _merge(self.sorted_ids(), as_follower_ids(other).sorted_ids(), False, True)
+
+    def union(self, other):
+        """ returns a sorted int64 array of the ids in either collection """
+        return _merge(self.sorted_ids(), as_follower_ids(other).sorted_ids(), True, True, True)
+
+def _merge(a, b, keep_a_only, keep_both, keep_b_only=False):
+    """ merges two sorted unique int64 arrays in one pass, keeping the ids only in a, in
+        both or only in b as selected. returns a sorted int64 array. """
+    merged = array('q')
+    i, j = 0, 0
+    len_a, len_b = len(a), len(b)
+    while i < len_a and j < len_b:
+        uid_a, uid_b = a[i], b[j]
+        if uid_a < uid_b:
+            if keep_a_only:
+                merged.append(uid_a)
+            i += 1
+        elif uid_b < uid_a:
+            if keep_b_only:
+                merged.append(uid_b)
+            j += 1
+        else:
+            if keep_both:
+                merged.append(uid_a)
+            i += 1
+            j += 1
+
+    if keep_a_only:
+        merged.extend(a[i:])
+    if keep_b_only:
+        merged.extend(b[j:])
+
+    return merged
+
+def as_follower_ids(ids):
+    """ returns ids as a FollowerIds, without copying if it already is one """
+    if isinstance(ids, FollowerIds):
+        return ids
+
+    return FollowerIds(ids)
@@ -0,0 +1,273 @@
+""" a follower index shared by tracked accounts, holding each accounts current followers
+    as a compressed bitmap over dense ids so overlaps are counted without joining databases """
+
+import zlib
+import sqlite3
+
+import db_minions
+
+# name of the shared index file in the database directory
+FOLLOWER_INDEX_NAME = "followers_index.sqlite"
+
+# zlib compression level for stored bitmaps
+BITMAP_COMPRESSION_LEVEL = 6
+
+# ids per id_map lookup, within the sqlite limit of 999 parameters
+INDEX_LOOKUP_SIZE = 500
+
+# seconds to wait for another run updating the index, such as the accounts of a batch
+INDEX_LOCK_TIMEOUT = 60
+
+OVERLAP_OPERATIONS = ("intersection", "union", "difference")
+
+def bit_count(bitmap):
+    """ returns the number of set bits of an int bitmap """
+    if hasattr(bitmap, "bit_count"):
+        return bitmap.bit_count()
+
+    return bin(bitmap).count("1")
+
+def _set_bits(bits, dense_ids, value):
+    """ sets or clears the bits of the dense ids in a bytearray bitmap, growing it as needed """
+    for dense_id in dense_ids:
+        index = dense_id >> 3
+        if index >= len(bits):
+            if not value:
+                continue
+            bits.extend(bytes(index + 1 - len(bits)))
+        if value:
+            bits[index] |= 1 << (dense_id & 7)
+        else:
+            bits[index] &= ~(1 << (dense_id & 7)) & 0xff
+
+def _encode_bitmap(bits):
+    """ returns compressed bytes for a bytearray bitmap """
+    return zlib.compress(bytes(bits).rstrip(b"\0"), BITMAP_COMPRESSION_LEVEL)
+
+def _decode_bitmap(data):
+    """ returns a bytearray bitmap from bytes made by _encode_bitmap """
+    return bytearray(zlib.decompress(data)) if data else bytearray()
+
+def combine_bitmaps(bitmaps, operation="intersection"):
+    """ returns the bitmap of the ids set in all the bitmaps for an intersection, in any of
+        them for a union, or in the first and none of the others for a difference """
+    combined = bitmaps[0]
+    if operation == "intersection":
+        for bitmap in bitmaps[1:]:
+            combined &= bitmap
+    elif operation == "union":
+        for bitmap in bitmaps[1:]:
+            combined |= bitmap
+    elif operation == "difference":
+        for bitmap in bitmaps[1:]:
+            combined &= ~bitmap
+    else:
+        raise ValueError("unknown overlap operation: {0}".format(operation))
+
+    return combined
+
+def iter_dense_ids(bitmap):
+    """ yields the dense ids of the set bits of an int bitmap in ascending order """
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, "little")
+    for index, byte in enumerate(data):
+        if byte:
+            for bit in range(8):
+                if byte >> bit & 1:
+                    yield index << 3 | bit
+
+class FollowerIndex(object):
+    """ each twitter user id seen in any account is given a dense id, numbered from 1 in the
+        order first seen, and each accounts followers are stored as a bitmap with the bits
+        of their dense ids set. bitmaps are combined as python ints, so intersections,
+        unions and differences of dozens of accounts are a few big integer operations. """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+        self.cursor = None
+
+        sql_create_id_map_table = "CREATE TABLE IF NOT EXISTS 'id_map' (" \
+            "'dense_id' INTEGER PRIMARY KEY  NOT NULL," \
+            "'user_id' INTEGER NOT NULL UNIQUE);"
+
+        sql_create_bitmaps_table = "CREATE TABLE IF NOT EXISTS 'account_bitmaps' (" \
+            "'account_id' INTEGER PRIMARY KEY  NOT NULL," \
+            "'bitmap' BLOB," \
+            "'followers_count' INTEGER DEFAULT (0)," \
+            "'last_event_id' INTEGER DEFAULT (0)," \
+            "'time_updated' DATETIME DEFAULT (CURRENT_TIMESTAMP));"
+
+        try:
+            self.connection = sqlite3.connect(path, timeout=INDEX_LOCK_TIMEOUT)
+            self.connection.row_factory = sqlite3.Row
+            self.cursor = self.connection.cursor()
+            self.cursor.execute("PRAGMA journal_mode=WAL;")
+            self.cursor.execute("PRAGMA synchronous=NORMAL;")
+            self.cursor.execute(sql_create_id_map_table)
+            self.cursor.execute(sql_create_bitmaps_table)
+            self.connection.commit()
+
+        except sqlite3.Error as err:
+            print("follower_index error: {0}".format(err))
+            self.connection = None
+
+    def close_connection(self):
+        """ closes the index connection """
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+    def _get_dense_ids(self, user_ids):
+        """ returns a dictionary of the dense ids of user ids, giving ids without one the
+            next dense ids """
+        dense_ids = {}
+        for start in range(0, len(user_ids), INDEX_LOOKUP_SIZE):
+            lookup_ids = user_ids[start:start + INDEX_LOOKUP_SIZE]
+            self.cursor.executemany("INSERT OR IGNORE INTO id_map (user_id) VALUES (?);", \
+                                    ((uid,) for uid in lookup_ids))
+            self.cursor.execute("SELECT user_id, dense_id FROM id_map WHERE user_id IN " \
+                                "({0});".format(", ".join("?" * len(lookup_ids))), lookup_ids)
+            dense_ids.update((row['user_id'], row['dense_id']) for row in self.cursor)
+
+        return dense_ids
+
+    def _get_user_ids(self, dense_ids):
+        """ returns the user ids of a list of dense ids, in the same order """
+        user_ids = {}
+        for start in range(0, len(dense_ids), INDEX_LOOKUP_SIZE):
+            lookup_ids = dense_ids[start:start + INDEX_LOOKUP_SIZE]
+            self.cursor.execute("SELECT dense_id, user_id FROM id_map WHERE dense_id IN " \
+                                "({0});".format(", ".join("?" * len(lookup_ids))), lookup_ids)
+            user_ids.update((row['dense_id'], row['user_id']) for row in self.cursor)
+
+        return [user_ids[dense_id] for dense_id in dense_ids]
+
+    def update_account(self, account_id, dbm):
+        """ brings an accounts bitmap up to date with its database. the follows and unfollows
+            recorded in the events table since the last update are applied in order, and the
+            bitmap is built from the followers table instead if the account is new to the
+            index or the applied events do not add up to its follower count. returns the
+            number of followers in the bitmap or none on error. """
+
+        try:
+            # take the write lock first so concurrent runs wait rather than fail
+            self.cursor.execute("BEGIN IMMEDIATE;")
+            self.cursor.execute("SELECT bitmap, last_event_id FROM account_bitmaps " \
+                                "WHERE account_id=?;", (account_id,))
+            row = self.cursor.fetchone()
+
+            bits = None
+            if row:
+                bits = _decode_bitmap(row['bitmap'])
+                last_event_id = row['last_event_id']
+                for events in dbm.iter_event_batches(last_event_id):
+                    dense_ids = self._get_dense_ids(list({event['user_id'] for event in events}))
+                    for event in events:
+                        _set_bits(bits, (dense_ids[event['user_id']],), \
+                                  event['event_type'] == db_minions.EVENT_FOLLOW)
+                    last_event_id = events[-1]['event_id']
+
+                followers_count = bit_count(int.from_bytes(bits, "little"))
+                if followers_count != dbm.count_followers():
+                    bits = None
+
+            if bits is None:
+                # events after this id are applied by the next update
+                last_event_id = dbm.get_last_event_id()
+                bits = bytearray()
+                for user_ids in dbm.iter_follower_id_batches():
+                    _set_bits(bits, self._get_dense_ids(user_ids).values(), True)
+                followers_count = bit_count(int.from_bytes(bits, "little"))
+
+            self.cursor.execute("INSERT OR REPLACE INTO account_bitmaps (account_id, bitmap, " \
+                                "followers_count, last_event_id, time_updated) " \
+                                "VALUES (?, ?, ?, ?, datetime('now'));", \
+                                (account_id, _encode_bitmap(bits), followers_count, \
+                                 last_event_id))
+            self.connection.commit()
+
+            return followers_count
+
+        except sqlite3.Error as err:
+            self.connection.rollback()
+            print("update_account error: {0}".format(err))
+
+        return None
+
+    def get_accounts(self):
+        """ returns dictionaries of the indexed accounts with their follower counts """
+        try:
+            self.cursor.execute("SELECT account_id, followers_count, time_updated " \
+                                "FROM account_bitmaps ORDER BY account_id;")
+            return [dict(row) for row in self.cursor.fetchall()]
+
+        except sqlite3.Error as err:
+            print("get_accounts error: {0}".format(err))
+
+        return []
+
+    def get_bitmap(self, account_id):
+        """ returns the follower bitmap of an account as an int or none if it is not indexed """
+        try:
+            self.cursor.execute("SELECT bitmap FROM account_bitmaps WHERE account_id=?;", \
+                                (account_id,))
+            row = self.cursor.fetchone()
+            if row:
+                return int.from_bytes(_decode_bitmap(row['bitmap']), "little")
+
+        except sqlite3.Error as err:
+            print("get_bitmap error: {0}".format(err))
+
+        return None
+
+    def combine(self, account_ids, operation="intersection"):
+        """ returns the bitmap of the followers of all the accounts for an intersection, of
+            any of them for a union, or of the first and none of the others for a difference.
+            returns none if an account is not indexed. """
+        bitmaps = [self.get_bitmap(account_id) for account_id in account_ids]
+        if not bitmaps or None in bitmaps:
+            return None
+
+        return combine_bitmaps(bitmaps, operation)
+
+    def count(self, account_ids, operation="intersection"):
+        """ returns the number of followers in the combined bitmap of the accounts or none
+            if an account is not indexed """
+        combined = self.combine(account_ids, operation)
+        return None if combined is None else bit_count(combined)
+
+    def get_user_ids(self, bitmap, limit=None):
+        """ returns the user ids of up to limit set bits of a bitmap, in the order the ids
+            were first indexed """
+        dense_ids = []
+        for dense_id in iter_dense_ids(bitmap):
+            if limit is not None and len(dense_ids) >= limit:
+                break
+            dense_ids.append(dense_id)
+
+        try:
+            return self._get_user_ids(dense_ids)
+
+        except sqlite3.Error as err:
+            print("get_user_ids error: {0}".format(err))
+
+        return []
+
+    def get_overlap(self, account_id, other_ids, limit=None):
+        """ returns a dictionary comparing the followers of an account with other accounts:
+            the counts of followers of all of them, of any of them and of the account alone,
+            the followers shared with each other account and up to limit of the user ids
+            followers of all of them. returns none if an account is not indexed. """
+        bitmaps = [self.get_bitmap(uid) for uid in [account_id] + list(other_ids)]
+        if None in bitmaps:
+            return None
+
+        combined = {operation: combine_bitmaps(bitmaps, operation)
+                    for operation in OVERLAP_OPERATIONS}
+        overlap = {operation: bit_count(bitmap) for operation, bitmap in combined.items()}
+        overlap['followers'] = bit_count(bitmaps[0])
+        overlap['shared'] = {uid: bit_count(bitmaps[0] & bitmap)
+                             for uid, bitmap in zip(other_ids, bitmaps[1:])}
+        overlap['shared_ids'] = self.get_user_ids(combined['intersection'], limit)
+
+        return overlap
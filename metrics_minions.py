@@ -0,0 +1,144 @@
+""" records run timings and counts and writes them as json and prometheus textfile reports """
+
+import os
+import time
+import json
+import threading
+from contextlib import contextmanager
+
+# prefix of the prometheus metric names
+METRICS_PREFIX = "twitter_minions"
+
+class RunMetrics(object):
+    """ span timings and labelled counters for a run. spans are named phases timed with
+        span(), the same name can be timed many times and nested in other spans. safe to
+        use from the pipeline and lookup threads. """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ clears recorded spans and counters and starts timing a new run """
+        with self._lock:
+            self.time_started = time.time()
+            self._spans = {}
+            self._counters = {}
+
+    def add_span(self, name, seconds):
+        """ adds a timing of seconds to the span name """
+        with self._lock:
+            span = self._spans.setdefault(name, [0, 0.0])
+            span[0] += 1
+            span[1] += seconds
+
+    @contextmanager
+    def span(self, name):
+        """ times the enclosed block as the span name """
+        start = self.clock()
+        try:
+            yield
+        finally:
+            self.add_span(name, self.clock() - start)
+
+    def count(self, name, value=1, **labels):
+        """ adds value to the counter name with labels """
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def get_span(self, name):
+        """ returns the total seconds of the span name """
+        with self._lock:
+            return self._spans.get(name, [0, 0.0])[1]
+
+    def get_count(self, name, **labels):
+        """ returns the counter name summed over counters that have the given labels """
+        with self._lock:
+            return sum(value for (counter, counter_labels), value in self._counters.items()
+                       if counter == name and set(labels.items()) <= set(counter_labels))
+
+    def report(self, **info):
+        """ returns a json serializable dictionary of the spans and counters, with info such
+            as the user and run ids added """
+        with self._lock:
+            spans = {name: {"count": span[0], "seconds": round(span[1], 6)}
+                     for name, span in sorted(self._spans.items())}
+            counters = [{"name": name, "labels": dict(labels), "value": value}
+                        for (name, labels), value in sorted(self._counters.items())]
+
+        report = dict(info)
+        report.update({"time_started": self.time_started, "time_reported": time.time(),
+                       "spans": spans, "counters": counters})
+
+        return report
+
+    def prometheus_lines(self, **labels):
+        """ returns the spans and counters as prometheus text format lines, every sample
+            has the given labels. the values are for a single run so all are gauges. """
+        report = self.report()
+        lines = []
+
+        def sample(name, value, sample_labels):
+            label_text = ",".join('{0}="{1}"'.format(key, _escape_label(val))
+                                  for key, val in sorted(sample_labels.items()))
+            return "{0}_{1}{{{2}}} {3}".format(METRICS_PREFIX, name, label_text, value)
+
+        def header(name, help_text):
+            lines.append("# HELP {0}_{1} {2}".format(METRICS_PREFIX, name, help_text))
+            lines.append("# TYPE {0}_{1} gauge".format(METRICS_PREFIX, name))
+
+        header("run_timestamp_seconds", "time the run started")
+        lines.append(sample("run_timestamp_seconds", report['time_started'], labels))
+
+        header("span_seconds", "seconds spent in each phase of the run")
+        for name, span in report['spans'].items():
+            lines.append(sample("span_seconds", span['seconds'], dict(labels, span=name)))
+
+        header("span_count", "number of times each phase of the run was timed")
+        for name, span in report['spans'].items():
+            lines.append(sample("span_count", span['count'], dict(labels, span=name)))
+
+        counter_names = sorted(set(counter['name'] for counter in report['counters']))
+        for name in counter_names:
+            header(name, "run total of {0}".format(name.replace("_", " ")))
+            for counter in report['counters']:
+                if counter['name'] == name:
+                    lines.append(sample(name, counter['value'], dict(labels, **counter['labels'])))
+
+        return lines
+
+    def write_json(self, path, **info):
+        """ writes the report as a json file """
+        _write_atomic(path, json.dumps(self.report(**info), indent=2) + "\n")
+
+    def write_prometheus(self, path, **labels):
+        """ writes a prometheus textfile for the node exporter textfile collector. the file
+            is replaced atomically so a partial file is never scraped. """
+        _write_atomic(path, "\n".join(self.prometheus_lines(**labels)) + "\n")
+
+def _escape_label(value):
+    """ returns a prometheus label value with backslashes, quotes and newlines escaped """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _write_atomic(path, text):
+    """ writes text to a temporary file next to path and renames it over path """
+    temp_path = "{0}.{1}.tmp".format(path, os.getpid())
+    with open(temp_path, "w") as temp_file:
+        temp_file.write(text)
+
+    os.replace(temp_path, path)
+
+def get_metrics_path(path, user_id, per_user=False):
+    """ returns a metrics file path for a user, replacing {user} in path with the user id.
+        if per_user is set and path has no {user}, the user id is added before the file
+        extension so users processed together do not share a file. """
+    if "{user}" in path:
+        return path.replace("{user}", str(user_id))
+
+    if per_user:
+        root, extension = os.path.splitext(path)
+        return "{0}-{1}{2}".format(root, user_id, extension)
+
+    return path
@@ -0,0 +1,136 @@
+""" runs fetch, transform and write stages concurrently joined by bounded queues """
+
+import queue
+import threading
+import time
+
+# default number of items each queue holds before the stage feeding it blocks
+PIPELINE_QUEUE_SIZE = 4
+
+# marks the end of the items from a stage
+_END = object()
+
+class PipelineStage(object):
+    """ throughput counters for a pipeline stage. """
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+
+        # seconds spent doing work and seconds spent blocked on a queue
+        self.busy_time = 0.0
+        self.wait_time = 0.0
+
+    @property
+    def items_per_second(self):
+        """ returns items processed per second of busy time """
+        if self.busy_time <= 0:
+            return 0.0
+        return self.items / self.busy_time
+
+class _StageError(object):
+    """ carries an exception raised in a stage thread to the writer stage. """
+
+    def __init__(self, err):
+        self.err = err
+
+def _timed_put(stage, out_queue, item):
+    """ puts item on the queue, counting time blocked by a full queue as wait time """
+    start = time.perf_counter()
+    out_queue.put(item)
+    stage.wait_time += time.perf_counter() - start
+
+def _timed_get(stage, in_queue):
+    """ gets an item from the queue, counting time blocked by an empty queue as wait time """
+    start = time.perf_counter()
+    item = in_queue.get()
+    stage.wait_time += time.perf_counter() - start
+    return item
+
+def _run_source(source, stage, out_queue, stop):
+    """ pulls items from the source iterable onto the out queue until stop is set """
+    try:
+        iterator = iter(source)
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            stage.busy_time += time.perf_counter() - start
+            stage.items += 1
+
+            _timed_put(stage, out_queue, item)
+
+    except BaseException as err:
+        out_queue.put(_StageError(err))
+        return
+
+    out_queue.put(_END)
+
+def _run_transform(transform, stage, in_queue, out_queue):
+    """ applies transform to each item from the in queue and puts the result on the out queue """
+    while True:
+        item = _timed_get(stage, in_queue)
+        if item is _END or isinstance(item, _StageError):
+            out_queue.put(item)
+            return
+
+        try:
+            start = time.perf_counter()
+            result = transform(item)
+            stage.busy_time += time.perf_counter() - start
+            stage.items += 1
+        except BaseException as err:
+            out_queue.put(_StageError(err))
+            return
+
+        _timed_put(stage, out_queue, result)
+
+def run_pipeline(source, transform, sink, queue_size=PIPELINE_QUEUE_SIZE):
+    """ runs source iteration and transform in their own threads and sink in the calling
+        thread, so that api paging, row building and database writes overlap. bounded queues
+        between the stages block a stage that gets ahead of the next one. exceptions raised
+        in the source or transform are re-raised here. if sink returns false no more items
+        are fetched and those already fetched are discarded. returns the list of
+        PipelineStage counters for the fetch, transform and write stages. """
+
+    fetch_stage = PipelineStage("fetch")
+    transform_stage = PipelineStage("transform")
+    write_stage = PipelineStage("write")
+
+    fetched_queue = queue.Queue(maxsize=queue_size)
+    transformed_queue = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    threads = [threading.Thread(target=_run_source, args=(source, fetch_stage, fetched_queue, \
+                                                          stop)),
+               threading.Thread(target=_run_transform, args=(transform, transform_stage, \
+                                                             fetched_queue, transformed_queue))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    while True:
+        item = _timed_get(write_stage, transformed_queue)
+        if item is _END:
+            break
+        if isinstance(item, _StageError):
+            raise item.err
+        if stop.is_set():
+            continue
+
+        start = time.perf_counter()
+        if sink(item) is False:
+            stop.set()
+        write_stage.busy_time += time.perf_counter() - start
+        write_stage.items += 1
+
+    for thread in threads:
+        thread.join()
+
+    return [fetch_stage, transform_stage, write_stage]
+
+def get_bottleneck(stages):
+    """ returns the stage with the most busy time """
+    return max(stages, key=lambda stage: stage.busy_time)
@@ -0,0 +1,194 @@
+""" plans the api requests of a run and simulates the rate limit windows to predict when
+    it finishes """
+
+import math
+
+import rate_minions
+
+# items returned per page or request by the paged endpoints
+FOLLOWER_IDS_PAGE_SIZE = 5000
+FOLLOWERS_LIST_PAGE_SIZE = 200
+USERS_LOOKUP_SIZE = 100
+
+# standard requests per window, used for endpoints whose budget is not known
+DEFAULT_RATE_LIMITS = {rate_minions.FOLLOWERS_IDS: 15,
+                       rate_minions.FOLLOWERS_LIST: 15,
+                       rate_minions.USERS_SHOW: 900,
+                       rate_minions.USERS_LOOKUP: 900}
+
+# seconds a request takes, /users/lookup requests are made lookup_workers at a time
+PLAN_REQUEST_SECONDS = 1.0
+
+def page_count(items, page_size):
+    """ returns the number of pages or requests needed for items """
+    return int(math.ceil(max(0, items) / float(page_size)))
+
+def get_endpoint_limits(rate_limits, token):
+    """ returns a dictionary of endpoint to [limit, remaining, reset] for the planned
+        endpoints from the known budgets of the token. endpoints that are not known have the
+        standard limit and a window that starts with their first request. """
+    limits = {}
+    for endpoint, default_limit in DEFAULT_RATE_LIMITS.items():
+        remaining = rate_limits.remaining(token, endpoint)
+        state = rate_limits.get_limit(token, endpoint)
+        if remaining is not None and state.limit is not None:
+            limits[endpoint] = [state.limit, remaining, state.reset]
+        else:
+            limits[endpoint] = [default_limit, default_limit, None]
+
+    return limits
+
+def format_duration(seconds):
+    """ returns seconds as a short duration such as '1h 05m', '14m 03s' or '12s' """
+    seconds = int(round(max(0, seconds)))
+    hours, minutes = seconds // 3600, seconds % 3600 // 60
+    if hours:
+        return "{0}h {1:02d}m".format(hours, minutes)
+    if minutes:
+        return "{0}m {1:02d}s".format(minutes, seconds % 60)
+
+    return "{0}s".format(seconds)
+
+def simulate_phases(phases, limits, now, request_seconds=PLAN_REQUEST_SECONDS, \
+                    lookup_workers=1):
+    """ simulates making the requests of each (endpoint, requests) phase in order, waiting
+        for window resets when an endpoint has no budget left. limits is a dictionary from
+        get_endpoint_limits and is not changed. returns the finish time and a timeline of
+        dictionaries of the time, endpoint and requests made or seconds waited. """
+    limits = {endpoint: list(limit) for endpoint, limit in limits.items()}
+    timeline = []
+    clock = now
+
+    for endpoint, requests in phases:
+        limit, remaining, reset = limits.get(endpoint, [None, None, None])
+        seconds = request_seconds
+        if endpoint == rate_minions.USERS_LOOKUP:
+            seconds /= max(1, lookup_workers)
+
+        while requests > 0:
+            if reset is not None and clock >= reset:
+                remaining, reset = limit, None
+
+            if remaining is not None and remaining <= 0:
+                # a used up budget without a known reset waits a window from now
+                if reset is None:
+                    reset = clock + rate_minions.RATE_LIMIT_WINDOW + rate_minions.RESET_MARGIN
+                timeline.append({"time": clock, "endpoint": endpoint, "requests": 0, \
+                                 "wait": reset - clock})
+                clock = reset
+                continue
+
+            # a window starts with its first request
+            if limit is not None and reset is None:
+                reset = clock + rate_minions.RATE_LIMIT_WINDOW + rate_minions.RESET_MARGIN
+
+            made = requests if remaining is None else min(requests, remaining)
+            timeline.append({"time": clock, "endpoint": endpoint, "requests": made, "wait": 0})
+            clock += made * seconds
+            requests -= made
+            if remaining is not None:
+                remaining -= made
+
+        limits[endpoint] = [limit, remaining, reset]
+
+    return clock, timeline
+
+def plan_strategies(followers_count, db_followers_count, update=False, fast=False, \
+                    refresh=0, fast_possible=False, ids_resume_items=0, list_resume_items=0):
+    """ returns the strategies that do the work of the requested run as dictionaries with
+        a name, the run options and the (endpoint, requests) phases in the order they are
+        made. new followers are the followers count less the database count, which is
+        exact if nobody unfollowed since the last run.
+
+        an update can page /followers/list, or list the ids and refresh every follower
+        with /users/lookup, which returns 100 users a request from a much larger budget.
+        an id run can list every id, or with a previous head only the newest pages. """
+
+    new_followers = max(0, followers_count - db_followers_count)
+    ids_pages = max(1, page_count(followers_count - ids_resume_items, FOLLOWER_IDS_PAGE_SIZE))
+    fast_pages = new_followers // FOLLOWER_IDS_PAGE_SIZE + 1
+    lookups = page_count(new_followers, USERS_LOOKUP_SIZE)
+    user_show = (rate_minions.USERS_SHOW, 1)
+
+    def ids_strategy(name, refresh_requests, fast_ids=False):
+        return {"name": name, "update": False, "fast": fast_ids, "refresh": refresh_requests,
+                "phases": [user_show,
+                           (rate_minions.FOLLOWERS_IDS, fast_pages if fast_ids else ids_pages),
+                           (rate_minions.USERS_LOOKUP, lookups + refresh_requests)]}
+
+    if update:
+        list_pages = page_count(followers_count - list_resume_items, FOLLOWERS_LIST_PAGE_SIZE)
+        strategies = [{"name": "update", "update": True, "fast": False, "refresh": 0,
+                       "phases": [user_show, (rate_minions.FOLLOWERS_IDS, ids_pages),
+                                  (rate_minions.FOLLOWERS_LIST, list_pages)]}]
+        # an empty database is always filled by an update
+        if db_followers_count:
+            refresh_all = page_count(db_followers_count, USERS_LOOKUP_SIZE)
+            strategies.append(ids_strategy("ids+refresh", refresh_all))
+            if fast_possible:
+                strategies.append(ids_strategy("fast+refresh", refresh_all, True))
+        return strategies
+
+    strategies = []
+    if fast_possible:
+        strategies.append(ids_strategy("fast", refresh, True))
+    if not fast or not fast_possible:
+        strategies.append(ids_strategy("ids", refresh))
+
+    return strategies
+
+def plan_run(strategies, limits, now, lookup_workers=1):
+    """ adds the requests per endpoint, the total requests, the finish time and the
+        simulated timeline to each strategy. returns the strategies. """
+    for strategy in strategies:
+        requests = {}
+        for endpoint, count in strategy['phases']:
+            if count:
+                requests[endpoint] = requests.get(endpoint, 0) + count
+        finish, timeline = simulate_phases([phase for phase in strategy['phases'] if phase[1]], \
+                                           limits, now, lookup_workers=lookup_workers)
+        strategy.update(requests=requests, total_requests=sum(requests.values()), \
+                        finish=finish, seconds=finish - now, timeline=timeline)
+
+    return strategies
+
+def choose_strategy(strategies, deadline=None, budget=None):
+    """ returns the strategy with the fewest requests, then the earliest finish, of those
+        that finish within deadline seconds and make at most budget requests, or none """
+    fitting = [strategy for strategy in strategies
+               if (deadline is None or strategy['seconds'] <= deadline) and
+               (budget is None or strategy['total_requests'] <= budget)]
+    if not fitting:
+        return None
+
+    return min(fitting, key=lambda strategy: (strategy['total_requests'], strategy['seconds']))
+
+def fit_partial_refresh(strategy, limits, now, deadline=None, budget=None, lookup_workers=1):
+    """ returns a copy of an id strategy with its refresh cut to the most /users/lookup
+        requests that fit the deadline and budget, or none if it does not fit without
+        refreshing. an update that does not fit then refreshes the stalest followers. """
+
+    def with_refresh(refresh_requests):
+        phases = [(endpoint, count - strategy['refresh'] + refresh_requests
+                   if endpoint == rate_minions.USERS_LOOKUP else count)
+                  for endpoint, count in strategy['phases']]
+        partial = dict(strategy, name=strategy['name'] + " (partial)", \
+                       refresh=refresh_requests, phases=phases)
+        return plan_run([partial], limits, now, lookup_workers)[0]
+
+    def fits(candidate):
+        return choose_strategy([candidate], deadline, budget) is not None
+
+    low, high = 0, strategy['refresh']
+    if not fits(with_refresh(low)):
+        return None
+
+    # the largest refresh that fits, finish time and requests grow with the refresh
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(with_refresh(middle)):
+            low = middle
+        else:
+            high = middle - 1
+
+    return with_refresh(low)
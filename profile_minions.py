@@ -0,0 +1,106 @@
+""" hashes and compresses follower profile json for content-addressed storage """
+
+import re
+import json
+import zlib
+import hashlib
+from datetime import datetime, timezone
+from collections import Counter
+
+# zlib compression level for profile json
+PROFILE_COMPRESSION_LEVEL = 6
+
+# zlib only uses the last 32KiB of a preset dictionary
+PROFILE_DICT_SIZE = 32768
+
+# typed followers table columns projected from profile json, with their sql type and the
+# profile json key they are read from
+PROFILE_COLUMNS = (("user_followers_count", "INTEGER", "followers_count"),
+                   ("user_friends_count", "INTEGER", "friends_count"),
+                   ("user_statuses_count", "INTEGER", "statuses_count"),
+                   ("user_favourites_count", "INTEGER", "favourites_count"),
+                   ("user_listed_count", "INTEGER", "listed_count"),
+                   ("user_verified", "INTEGER", "verified"),
+                   ("user_created_at", "DATETIME", "created_at"),
+                   ("user_lang", "VARCHAR", "lang"),
+                   ("user_protected", "INTEGER", "protected"))
+
+# profile json keys that change with the users activity rather than their profile. they
+# are left out of the stored and hashed profile json, so a new profile version is only
+# stored when the profile changes, and the counts are kept in the PROFILE_COLUMNS instead
+VOLATILE_KEYS = ("status", "followers_count", "friends_count", "statuses_count",
+                 "favourites_count", "listed_count")
+
+# twitter api created_at format
+TWITTER_TIME_FORMAT = "%a %b %d %H:%M:%S %z %Y"
+
+# splits json text into key and value fragments for dictionary training
+_FRAGMENT_SPLIT = re.compile(r'(?<=[,{\[])')
+
+def profile_json(user_json):
+    """ returns canonical json text for a user json dictionary without the VOLATILE_KEYS,
+        keys are sorted so the same profile always produces the same text and hash """
+    return json.dumps({key: value for key, value in user_json.items()
+                       if key not in VOLATILE_KEYS}, sort_keys=True, separators=(',', ':'))
+
+def profile_hash(json_text):
+    """ returns the content hash of profile json text """
+    return hashlib.blake2b(json_text.encode('utf-8'), digest_size=16).hexdigest()
+
+def profile_columns(user_json):
+    """ returns the values of the PROFILE_COLUMNS for a user json dictionary. flags are 0 or
+        1 and created_at is a 'YYYY-MM-DD HH:MM:SS' utc time so they compare in sql """
+    values = []
+    for column, column_type, key in PROFILE_COLUMNS:
+        value = user_json.get(key)
+        if value is not None:
+            if key == "created_at":
+                try:
+                    value = datetime.strptime(value, TWITTER_TIME_FORMAT) \
+                        .astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+                except ValueError:
+                    value = None
+            elif column_type == "INTEGER":
+                value = int(value)
+        values.append(value)
+
+    return tuple(values)
+
+def compress_profile(json_text, zdict=None):
+    """ returns zlib compressed profile json text, using the preset dictionary if given """
+    if zdict:
+        compressor = zlib.compressobj(PROFILE_COMPRESSION_LEVEL, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(PROFILE_COMPRESSION_LEVEL)
+
+    return compressor.compress(json_text.encode('utf-8')) + compressor.flush()
+
+def decompress_profile(data, zdict=None):
+    """ returns profile json text from data made by compress_profile """
+    if zdict:
+        decompressor = zlib.decompressobj(zdict=zdict)
+    else:
+        decompressor = zlib.decompressobj()
+
+    return (decompressor.decompress(data) + decompressor.flush()).decode('utf-8')
+
+def train_dictionary(json_texts, size=PROFILE_DICT_SIZE, min_share=0.05):
+    """ returns a zlib preset dictionary trained from sample profile json texts. fragments
+        such as '"default_profile":false,' that occur in at least min_share of the samples
+        are kept, ordered so the most common are at the end of the dictionary where zlib
+        finds them with the shortest distances. """
+
+    fragment_counts = Counter()
+    samples = 0
+    for json_text in json_texts:
+        samples += 1
+        fragment_counts.update(set(_FRAGMENT_SPLIT.split(json_text)))
+
+    min_count = max(2, int(samples * min_share))
+    fragments = [fragment for fragment, count in sorted(fragment_counts.items(), \
+                                                        key=lambda item: (item[1], item[0]))
+                 if count >= min_count]
+
+    zdict = "".join(fragments).encode('utf-8')
+
+    return zdict[-size:]
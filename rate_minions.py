@@ -0,0 +1,191 @@
+""" tracks twitter api rate limits per endpoint and app token """
+
+import time
+import threading
+
+# rate_limit_status resource names of the endpoints used
+FOLLOWERS_IDS = "/followers/ids"
+FOLLOWERS_LIST = "/followers/list"
+USERS_SHOW = "/users/show/:id"
+USERS_LOOKUP = "/users/lookup"
+
+# length of a rate limit window in seconds, used when a reset time is not known
+RATE_LIMIT_WINDOW = 15 * 60
+
+# seconds added to reset times to allow for clock differences with the api
+RESET_MARGIN = 2
+
+class EndpointLimit(object):
+    """ remaining calls and reset time for an endpoint and token. """
+
+    def __init__(self, limit=None, remaining=None, reset=None):
+        self.limit = limit
+        self.remaining = remaining
+
+        # epoch time that the current window ends
+        self.reset = reset
+
+class RateLimits(object):
+    """ rate limit budgets for endpoints and tokens, updated from x-rate-limit-* response
+        headers and rate_limit_status results. a call to an endpoint is reserved before it
+        is made so threads sharing a token do not overspend its budget, and only callers of
+        an exhausted endpoint wait for its reset. """
+
+    def __init__(self, clock=time.time, sleep=time.sleep, notify=True):
+        self.clock = clock
+        self.sleep = sleep
+        self.notify = notify
+
+        # total seconds spent waiting on rate limits
+        self.wait_time = 0.0
+
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def get_limit(self, token, endpoint):
+        """ returns the EndpointLimit for a token and endpoint or none if not known """
+        return self._limits.get((token, endpoint))
+
+    def _refresh(self, state, now):
+        """ restores the budget of an endpoint limit whose window has ended. a budget that is
+            used up without a known reset gets a window ending one window from now. """
+        if state.reset is not None and now >= state.reset:
+            state.remaining = state.limit
+            state.reset = None
+
+        if state.reset is None and state.remaining is not None and state.remaining <= 0:
+            state.reset = now + RATE_LIMIT_WINDOW
+
+    def remaining(self, token, endpoint):
+        """ returns the calls remaining for an endpoint or none if not known """
+        with self._lock:
+            state = self.get_limit(token, endpoint)
+            if not state:
+                return None
+            self._refresh(state, self.clock())
+            return state.remaining
+
+    def next_call_time(self, token, endpoint):
+        """ returns the epoch time that the endpoint can next be called with the token """
+        with self._lock:
+            now = self.clock()
+            state = self.get_limit(token, endpoint)
+            if not state:
+                return now
+
+            self._refresh(state, now)
+            if state.remaining is None or state.remaining > 0:
+                return now
+
+            return state.reset
+
+    def best_token(self, tokens, endpoint):
+        """ returns the token from tokens that can call the endpoint soonest, preferring the
+            one with the most remaining calls """
+        def token_order(token):
+            remaining = self.remaining(token, endpoint)
+            return (self.next_call_time(token, endpoint), \
+                    -(remaining if remaining is not None else float("inf")))
+
+        return min(tokens, key=token_order)
+
+    def spread_interval(self, token, endpoint, min_interval, calls=1):
+        """ returns the seconds to wait before making calls to the endpoint again so the
+            remaining budget is spread evenly until the window resets, and at least
+            min_interval. """
+        with self._lock:
+            now = self.clock()
+            state = self.get_limit(token, endpoint)
+            if not state:
+                return min_interval
+
+            self._refresh(state, now)
+            if state.remaining is None or state.reset is None:
+                return min_interval
+
+            # whole cycles of calls left in this window, waiting for the reset if none
+            cycles = state.remaining // max(1, calls)
+            if cycles < 1:
+                return max(min_interval, state.reset - now)
+
+            return max(min_interval, (state.reset - now) / cycles)
+
+    def _reserve(self, token, endpoint):
+        """ reserves a call, returning 0 or the seconds to wait if there is no budget """
+        with self._lock:
+            now = self.clock()
+            state = self.get_limit(token, endpoint)
+            if not state:
+                return 0
+
+            self._refresh(state, now)
+            if state.remaining is None:
+                return 0
+
+            if state.remaining > 0:
+                # a restored budget has no reset until a response gives one, its window
+                # starts with its first call
+                if state.reset is None:
+                    state.reset = now + RATE_LIMIT_WINDOW
+                state.remaining -= 1
+                return 0
+
+            return max(0, state.reset - now)
+
+    def acquire(self, token, endpoint):
+        """ waits until the endpoint has budget for the token and reserves a call. returns
+            the seconds waited. """
+        waited = 0
+        while True:
+            wait = self._reserve(token, endpoint)
+            if wait <= 0:
+                return waited
+
+            if self.notify:
+                print("* rate limit reached for {0}, sleeping {1:.0f} seconds.".format( \
+                    endpoint, wait))
+
+            self.sleep(wait)
+            self.wait_time += wait
+            waited += wait
+
+    def update(self, token, endpoint, limit, remaining, reset):
+        """ sets the budget for an endpoint, keeping the lower remaining count if the window
+            is the one already known so calls reserved by other threads are not lost """
+        reset = reset + RESET_MARGIN if reset is not None else None
+
+        with self._lock:
+            state = self._limits.setdefault((token, endpoint), EndpointLimit())
+            if state.reset == reset and state.remaining is not None and remaining is not None:
+                remaining = min(state.remaining, remaining)
+
+            state.limit = limit
+            state.remaining = remaining
+            state.reset = reset
+
+    def update_from_headers(self, token, endpoint, headers):
+        """ sets the budget for an endpoint from x-rate-limit-* response headers """
+        try:
+            limit = int(headers['x-rate-limit-limit'])
+            remaining = int(headers['x-rate-limit-remaining'])
+            reset = int(headers['x-rate-limit-reset'])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        self.update(token, endpoint, limit, remaining, reset)
+
+    def update_from_status(self, token, status):
+        """ sets the budget for every endpoint in a rate_limit_status result """
+        for resources in status.get('resources', {}).values():
+            for endpoint, endpoint_status in resources.items():
+                self.update(token, endpoint, endpoint_status['limit'], \
+                            endpoint_status['remaining'], endpoint_status['reset'])
+
+    def exhaust(self, token, endpoint):
+        """ marks an endpoint as having no budget after a rate limited response """
+        with self._lock:
+            now = self.clock()
+            state = self._limits.setdefault((token, endpoint), EndpointLimit())
+            state.remaining = 0
+            if state.reset is None or state.reset <= now:
+                state.reset = now + RATE_LIMIT_WINDOW
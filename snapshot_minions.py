@@ -0,0 +1,93 @@
+""" encodes follower id sets as compact delta-encoded and compressed snapshots """
+
+import sys
+import zlib
+from array import array
+from itertools import accumulate, chain
+
+# number of delta snapshots stored between full keyframe snapshots
+SNAPSHOT_KEYFRAME_INTERVAL = 10
+
+# zlib compression level for snapshot data
+SNAPSHOT_COMPRESSION_LEVEL = 6
+
+# number of ids encoded or decoded at a time by the streaming functions
+SNAPSHOT_CHUNK_SIZE = 65536
+
+def encode_ids(ids):
+    """ returns compressed bytes for a collection of ids. ids are sorted into an int64 array
+        and stored as the differences between neighbours, which are small numbers that
+        compress well, in little endian byte order. """
+
+    sorted_ids = sorted(set(ids))
+    deltas = array('q', (uid - prev for uid, prev in zip(sorted_ids, [0] + sorted_ids)))
+
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+
+    return zlib.compress(deltas.tobytes(), SNAPSHOT_COMPRESSION_LEVEL)
+
+def encode_sorted_id_chunks(id_chunks):
+    """ returns the same compressed bytes as encode_ids from chunks of ids that are already
+        sorted and unique across all chunks, such as batches of rows from an ordered query,
+        so the ids never need to be held at once. """
+
+    compressor = zlib.compressobj(SNAPSHOT_COMPRESSION_LEVEL)
+    parts = []
+    prev = 0
+    for chunk in id_chunks:
+        deltas = array('q')
+        for uid in chunk:
+            deltas.append(uid - prev)
+            prev = uid
+
+        if sys.byteorder == 'big':
+            deltas.byteswap()
+        parts.append(compressor.compress(deltas.tobytes()))
+
+    parts.append(compressor.flush())
+
+    return b"".join(parts)
+
+def iter_decoded_id_chunks(data, chunk_size=SNAPSHOT_CHUNK_SIZE):
+    """ yields sorted int64 arrays of the ids in bytes made by encode_ids, decompressing
+        chunk_size ids at a time """
+    if not data:
+        return
+
+    decompressor = zlib.decompressobj()
+    prev = 0
+    pending = data
+    while pending or decompressor.unconsumed_tail:
+        raw = decompressor.decompress(pending or decompressor.unconsumed_tail, chunk_size * 8)
+        pending = b""
+        if not raw:
+            break
+
+        deltas = array('q')
+        deltas.frombytes(raw)
+        if sys.byteorder == 'big':
+            deltas.byteswap()
+
+        ids = array('q', accumulate(chain([prev], deltas)))[1:]
+        prev = ids[-1]
+        yield ids
+
+def decode_ids(data):
+    """ returns a sorted int64 array of the ids in bytes made by encode_ids """
+    deltas = array('q')
+    if data:
+        deltas.frombytes(zlib.decompress(data))
+
+    if sys.byteorder == 'big':
+        deltas.byteswap()
+
+    return array('q', accumulate(deltas))
+
+def apply_delta(ids, added_data, removed_data):
+    """ returns the id set with encoded added ids included and removed ids excluded """
+    ids = set(ids)
+    ids.difference_update(decode_ids(removed_data))
+    ids.update(decode_ids(added_data))
+
+    return ids
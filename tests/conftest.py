@@ -0,0 +1,6 @@
+""" puts the modules of the repository on the import path of the tests """
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,147 @@
+""" drives process_user against the offline fake api and checks the database it leaves
+    matches the fake follower graph """
+
+import pytest
+
+import bench_minions
+import db_minions
+import fake_minions
+import index_minions
+import rate_minions
+import twitter_minions
+
+# followers of the fake graph, enough for several /followers/list pages of 200
+GRAPH_SIZE = 1000
+
+def run_user(graph, database_dir, scenario):
+    """ runs process_user for a scenario against the graph with a fresh fake api. returns
+        the run success and the fake api. """
+    apim = bench_minions.make_fake_api_minions(graph, fake_minions.FakeClock())
+    apim.refresh_rate_limits()
+    apim.api.requests.clear()
+
+    success = twitter_minions.process_user(apim, graph.owner_id, update=scenario['update'], \
+                                           interactive=False, \
+                                           refresh=scenario.get('refresh', 0), \
+                                           fast=scenario['fast'], database_dir=database_dir, \
+                                           stream=scenario.get('stream', False))
+
+    return success, apim.api
+
+def open_database(graph, database_dir):
+    """ returns a DBMinions object for the owners database """
+    return db_minions.DBMinions(twitter_minions.get_user_database_path(graph.owner_id, \
+                                                                       database_dir), \
+                                create=False)
+
+def check_database(graph, database_dir):
+    """ checks the followers table, latest snapshot, stats, search index and bitmap index
+        against the followers of the graph """
+    follower_ids = graph.follower_id_set
+
+    dbm = open_database(graph, database_dir)
+    try:
+        rows = dbm.connection.execute("SELECT user_id FROM followers;").fetchall()
+        assert {row['user_id'] for row in rows} == follower_ids
+
+        assert dbm.get_follower_snapshot() == follower_ids
+
+        stats = dbm.get_stats_report()
+        assert stats['followers'] == len(follower_ids)
+        assert stats['reach'] == sum(graph.user_json(uid)['followers_count']
+                                     for uid in follower_ids)
+
+        rows = dbm.connection.execute("SELECT rowid FROM profile_search;").fetchall()
+        search_ids = [row['rowid'] for row in rows]
+        assert {rowid for rowid in search_ids if rowid > 0} == follower_ids
+        unfollowers = dbm.connection.execute("SELECT COUNT(*) FROM unfollowers;").fetchone()[0]
+        assert len([rowid for rowid in search_ids if rowid < 0]) == unfollowers
+    finally:
+        dbm.close_connection()
+
+    index = index_minions.FollowerIndex(twitter_minions.get_follower_index_path(database_dir))
+    try:
+        bitmap = index.get_bitmap(graph.owner_id)
+        assert index_minions.bit_count(bitmap) == len(follower_ids)
+        assert set(index.get_user_ids(bitmap)) == follower_ids
+    finally:
+        index.close_connection()
+
+@pytest.mark.parametrize("scenario_count", range(1, len(bench_minions.BENCH_SCENARIOS) + 1), \
+                         ids=[scenario['name'] for scenario in bench_minions.BENCH_SCENARIOS])
+def test_runs_match_graph(tmp_path, scenario_count):
+    """ each run of the benchmark scenarios, after the churn of the runs before it, leaves
+        the database matching the graph """
+    graph = fake_minions.FakeFollowerGraph(GRAPH_SIZE)
+    database_dir = str(tmp_path)
+
+    for scenario in bench_minions.BENCH_SCENARIOS[:scenario_count]:
+        graph.advance(new=scenario['new'], lost=scenario['lost'], changed=scenario['changed'])
+        success, api = run_user(graph, database_dir, scenario)
+        assert success
+
+    check_database(graph, database_dir)
+
+def test_refresh_updates_changed_profiles(tmp_path):
+    """ a refresh run stores the changed profiles of the followers it looks up """
+    graph = fake_minions.FakeFollowerGraph(GRAPH_SIZE)
+    database_dir = str(tmp_path)
+    update, refresh = bench_minions.BENCH_SCENARIOS[0], bench_minions.BENCH_SCENARIOS[3]
+
+    assert run_user(graph, database_dir, update)[0]
+    graph.advance(new=0, lost=0, changed=GRAPH_SIZE)
+    success, api = run_user(graph, database_dir, dict(refresh, refresh=GRAPH_SIZE // 100))
+    assert success
+    assert api.requests[rate_minions.USERS_LOOKUP] == GRAPH_SIZE // 100
+
+    dbm = open_database(graph, database_dir)
+    try:
+        for uid in graph.follower_ids[:10]:
+            profile = dbm.get_profile(uid)
+            assert profile['description'] == graph.user_json(uid)['description']
+            assert profile['followers_count'] == graph.user_json(uid)['followers_count']
+    finally:
+        dbm.close_connection()
+
+def test_interrupted_listing_resumes(tmp_path, monkeypatch):
+    """ an update whose /followers/list sweep stops after some pages resumes from the last
+        saved page and finishes with the same database as an uninterrupted one """
+    graph = fake_minions.FakeFollowerGraph(GRAPH_SIZE)
+    database_dir = str(tmp_path)
+    update = bench_minions.BENCH_SCENARIOS[0]
+    pages = GRAPH_SIZE // 200
+
+    checkpoint_sync_state = db_minions.DBMinions.checkpoint_sync_state
+    list_checkpoints = []
+
+    def failing_checkpoint(self, sync_name, next_cursor, items):
+        """ fails the third checkpoint of the followers list sweep """
+        if sync_name == db_minions.SYNC_FOLLOWERS_LIST:
+            list_checkpoints.append(items)
+            if len(list_checkpoints) == 3:
+                return False
+        return checkpoint_sync_state(self, sync_name, next_cursor, items)
+
+    monkeypatch.setattr(db_minions.DBMinions, "checkpoint_sync_state", failing_checkpoint)
+    success, api = run_user(graph, database_dir, update)
+    assert not success
+
+    dbm = open_database(graph, database_dir)
+    try:
+        sync_state = dbm.get_sync_state(db_minions.SYNC_FOLLOWERS_LIST)
+        assert sync_state['items'] == 2 * 200
+    finally:
+        dbm.close_connection()
+
+    monkeypatch.undo()
+    success, api = run_user(graph, database_dir, update)
+    assert success
+    assert api.requests[rate_minions.FOLLOWERS_LIST] == pages - 2
+
+    dbm = open_database(graph, database_dir)
+    try:
+        assert dbm.get_sync_state(db_minions.SYNC_FOLLOWERS_LIST) is None
+    finally:
+        dbm.close_connection()
+
+    check_database(graph, database_dir)
@@ -3,18 +3,54 @@
 import os
 import sys
 import re
-import textwrap
+import json
+import time
 import argparse
 import tweepy
-import prettytable
-import colorama
-from colorama import Fore, Back, Style
 
 import api_minions
+import batch_minions
+import cache_minions
 import db_minions
+import diff_minions
+import export_minions
+import ids_minions
+import index_minions
+import metrics_minions
+import pipeline_minions
+import plan_minions
+import rate_minions
 
 VERSION = "0.2"
 
+# most new followers and unfollowers listed in a structured run result
+RUN_RESULT_LIST_SIZE = 1000
+
+# most steps of a planned timeline printed
+PLAN_TIMELINE_SIZE = 20
+
+class NoColor(object):
+    """ stands in for the colorama Fore, Back and Style codes when output is not text. """
+    def __getattr__(self, name):
+        return ""
+
+# terminal rendering modules, imported by init_text_output only when text output is used
+colorama = None
+prettytable = None
+Fore = Back = Style = NoColor()
+TEXT_OUTPUT = False
+
+def init_text_output():
+    """ imports the terminal rendering modules and enables colored text output. """
+    global colorama, prettytable, Fore, Back, Style, TEXT_OUTPUT
+
+    import colorama
+    import prettytable
+    from colorama import Fore, Back, Style
+
+    colorama.init(autoreset=True)
+    TEXT_OUTPUT = True
+
 class MinionSummaryList(object):
     """ limited list of followers summary data captured during processing. """
     def __init__(self, summary_list_size=10):
@@ -62,14 +98,121 @@ def get_arguments():
     """ script arguments, user id is a required parameter. """
     parser = argparse.ArgumentParser(description='maintains a database of a twitter users ' \
                                      'followers and unfollowers.')
-    parser.add_argument('-u', '--user', help="twitter user @name or numeric id", \
-                        type=valid_user_id, required=True)
+    user_group = parser.add_mutually_exclusive_group(required=True)
+    user_group.add_argument('-u', '--user', help="twitter user @name or numeric id", \
+                            type=valid_user_id)
+    user_group.add_argument('-b', '--batch', help="file of users to process concurrently, " \
+                            "one @name or id per line or a json file with users and " \
+                            "credentials. each request is made with the credentials that " \
+                            "can make it soonest unless a user has a credentials index",
+                            metavar="FILE")
     parser.add_argument('-upd', '--update', help="make a tweepy_api.followers " \
                         "request that updates user data for all database follower records",
                         required=False, action='store_true')
+    parser.add_argument('-f', '--fast', help="request follower ids only until the newest ids " \
+                        "from the previous run are reached, listing all ids only if the " \
+                        "followers count shows unfollows", required=False, action='store_true')
+    parser.add_argument('-ref', '--refresh', help="after id processing refresh the records " \
+                        "of the least recently updated followers using at most this many " \
+                        "/users/lookup requests of 100 users", required=False, \
+                        type=non_negative_int, default=0, metavar="REQUESTS")
+    parser.add_argument('--refresh-order', help="pick followers to refresh by oldest update " \
+                        "or by a priority of staleness and how often their profile changes", \
+                        required=False, choices=["stale", "priority"], default="stale")
+    parser.add_argument('-c', '--compact', help="move follower json stored by older " \
+                        "versions into compressed profiles, training a compression dictionary",
+                        required=False, action='store_true')
+    parser.add_argument('-r', '--restart', help="discard saved paging progress from an " \
+                        "interrupted run and start the follower requests again",
+                        required=False, action='store_true')
+    parser.add_argument('-s', '--stream', help="reconcile follower ids in the database " \
+                        "rather than in memory, for very large accounts. lists all ids", \
+                        required=False, action='store_true')
+    parser.add_argument('-w', '--watch', help="keep running and check for follower changes " \
+                        "at least this many seconds apart, slowing down to stay within the " \
+                        "/followers/ids rate limit", required=False, type=non_negative_int, \
+                        default=0, metavar="SECONDS")
+    parser.add_argument('--metrics-json', help="write a json report of run phase timings, " \
+                        "api requests, rate limit waits and rows written, {user} is replaced " \
+                        "by the user id", required=False, metavar="FILE")
+    parser.add_argument('--metrics-prom', help="write the run metrics as a prometheus " \
+                        "textfile for the node exporter, {user} is replaced by the user id", \
+                        required=False, metavar="FILE")
+    parser.add_argument('--report', help="print the follower aggregates kept in the users " \
+                        "database, such as reach, churn and unfollower tenure, and exit. a " \
+                        "numeric user id makes no api requests", required=False, \
+                        action='store_true')
+    parser.add_argument('--search', help="print the followers and unfollowers in the users " \
+                        "database whose name, screen name, description or location match " \
+                        "the words of the query, best matches first, and exit", \
+                        required=False, metavar="QUERY")
+    parser.add_argument('--format', help="print progress as colored text, or print a json " \
+                        "document or a line of ndjson per run result for unattended runs. " \
+                        "json and ndjson do not ask questions and write other output to " \
+                        "stderr", required=False, choices=["text", "json", "ndjson"], \
+                        default="text")
+    parser.add_argument('--export', help="write the followers, unfollowers and history " \
+                        "tables of the users database to files in this directory and exit. " \
+                        "a numeric user id makes no api requests", required=False, \
+                        metavar="DIR")
+    parser.add_argument('--export-format', help="file format of the exported tables, " \
+                        "parquet needs pyarrow", required=False, \
+                        choices=export_minions.EXPORT_FORMATS, default="csv")
+    parser.add_argument('--incremental', help="export only the rows added or changed since " \
+                        "the last export, to files named by time", required=False, \
+                        action='store_true')
+    parser.add_argument('--export-profiles', help="add the stored profile json of each " \
+                        "follower to the followers export", required=False, \
+                        action='store_true')
+    parser.add_argument('--overlap', help="print how many followers the user shares with " \
+                        "these other tracked accounts, from the shared follower index, and " \
+                        "exit", required=False, nargs="+", metavar="USER", type=valid_user_id)
+    parser.add_argument('--cache', help="keep the api responses in this file and serve " \
+                        "reruns from it while they are fresh, so they spend no rate limit", \
+                        required=False, metavar="FILE")
+    parser.add_argument('--cache-ttl', help="seconds a cached api response is served for", \
+                        required=False, type=non_negative_int, \
+                        default=cache_minions.CACHE_TTL, metavar="SECONDS")
+    parser.add_argument('--cache-size', help="size of the cached api responses before the " \
+                        "least recently used are evicted", required=False, \
+                        type=non_negative_int, default=cache_minions.CACHE_MAX_MIB, metavar="MIB")
+    parser.add_argument('--replay', help="serve every api request from the --cache file " \
+                        "whatever its age, without network requests or rate limits. the " \
+                        "run stops at the first request that is not cached", \
+                        required=False, action='store_true')
+    parser.add_argument('--plan', help="print the api requests per endpoint of the run and " \
+                        "of the other ways to do it, with a timeline of the rate limit " \
+                        "windows and the predicted finish time, and exit", required=False, \
+                        action='store_true')
+    parser.add_argument('--deadline', help="run the way that makes the fewest requests and " \
+                        "finishes within this many minutes, refreshing fewer followers if " \
+                        "nothing else fits", required=False, type=non_negative_float, \
+                        metavar="MINUTES")
+    parser.add_argument('--budget', help="run the way that makes the fewest requests, at " \
+                        "most this many", required=False, type=non_negative_int, \
+                        metavar="REQUESTS")
 
     args = parser.parse_args()
 
+    if args.watch and args.batch:
+        parser.error("--watch processes a single --user")
+    if (args.report or args.search) and args.batch:
+        parser.error("--report and --search read a single --user database")
+    if args.export and args.batch:
+        parser.error("--export reads a single --user database")
+    if args.overlap and args.batch:
+        parser.error("--overlap compares a single --user with other accounts")
+    if args.replay and not args.cache:
+        parser.error("--replay serves the responses of a --cache file")
+    if args.watch and args.cache:
+        parser.error("--watch checks for changes and does not use a --cache")
+    if (args.plan or args.deadline is not None or args.budget is not None) and \
+       (args.batch or args.watch):
+        parser.error("--plan, --deadline and --budget plan a single --user run")
+    if args.export and args.export_format == "parquet" and \
+       not export_minions.parquet_available():
+        parser.error("--export-format parquet needs pyarrow, pip install pyarrow")
+
     return args
 
 # accepts numeric id or twitter screen name (@name)
@@ -84,30 +227,128 @@ def valid_user_id(user_id):
         msg = "must start with @, be alphanumeric and < 16 characters or be a numeric id."
         raise argparse.ArgumentTypeError(msg)
 
-def get_user_database_path(user_id):
+def non_negative_int(value):
+    try:
+        number = int(value)
+    except ValueError:
+        number = -1
+
+    if number < 0:
+        raise argparse.ArgumentTypeError("must be a whole number of 0 or more.")
+
+    return number
+
+def non_negative_float(value):
+    try:
+        number = float(value)
+    except ValueError:
+        number = -1.0
+
+    if not 0 <= number < float("inf"):
+        raise argparse.ArgumentTypeError("must be a number of 0 or more.")
+
+    return number
+
+def get_user_database_path(user_id, database_dir=None):
     """ returns expected database path. uses numeric user id as database name
-        and current directory as directory path. """
+        and current directory as directory path unless a database directory is given. """
 
     user_database_name = "{0}.sqlite".format(user_id)
 
-    current_directory = os.path.dirname(os.path.realpath(sys.argv[0]))
+    current_directory = database_dir or os.path.dirname(os.path.realpath(sys.argv[0]))
     user_database_path = os.path.join(current_directory, user_database_name)
 
     return user_database_path
 
+def get_follower_index_path(database_dir=None):
+    """ returns the path of the follower index shared by the user databases in the same
+        directory. """
+
+    current_directory = database_dir or os.path.dirname(os.path.realpath(sys.argv[0]))
+
+    return os.path.join(current_directory, index_minions.FOLLOWER_INDEX_NAME)
+
+def update_follower_index(dbm, user_id, database_dir=None):
+    """ applies the follower changes in a users database to their bitmap in the shared
+        follower index. returns the number of followers indexed or none. """
+
+    index = index_minions.FollowerIndex(get_follower_index_path(database_dir))
+    if not index.connection:
+        return None
+
+    followers_count = index.update_account(user_id, dbm)
+    index.close_connection()
+
+    return followers_count
+
+def get_api_follower_ids(dbm, apim, keep_ids=True):
+    """ gets the follower ids from api /followers/ids requests, saving each page to the
+        database so that an interrupted listing is resumed from its last page. if keep_ids
+        is false the ids are only saved to the database. """
+
+    cursor = -1
+    follower_ids = []
+
+    sync_state = dbm.get_sync_state(db_minions.SYNC_FOLLOWER_IDS)
+    if sync_state:
+        cursor = sync_state['next_cursor']
+        if keep_ids:
+            follower_ids = dbm.get_sync_follower_ids()
+        print("* resuming follower ids after {0} ids (use '--restart' to start " \
+              "again).".format(sync_state['items']))
+
+    apim.get_follower_ids(cursor=cursor, follower_ids=follower_ids, \
+                          on_page=dbm.append_sync_follower_ids, keep_ids=keep_ids)
+
+def get_api_follower_ids_fast(dbm, apim):
+    """ gets only the newest follower ids, paging /followers/ids until a page reaches the head
+        of the previous runs listing. if the users followers_count equals the database count
+        plus the new ids then nobody further down the list unfollowed, and the follower ids
+        are the new ids and the database ids. otherwise paging continues for a full listing.
+        returns true if the listing ended early. """
+
+    previous_head_ids = set(dbm.get_previous_head_ids())
+    if not previous_head_ids or not dbm.follower_ids_count or \
+       dbm.get_sync_state(db_minions.SYNC_FOLLOWER_IDS):
+        get_api_follower_ids(dbm, apim)
+        return False
+
+    def head_reached(follower_ids):
+        """ stops paging once a page contains an id from the previous head. """
+        return diff_minions.find_head_index(follower_ids, previous_head_ids) is not None
+
+    apim.get_follower_ids(on_page=dbm.append_sync_follower_ids, stop=head_reached)
+
+    head_index = diff_minions.find_head_index(apim.follower_ids, previous_head_ids)
+    new_follower_ids = [uid for uid in apim.follower_ids[:head_index or 0]
+                        if uid not in dbm.follower_ids]
+
+    if head_index is not None and \
+       apim.user.followers_count == dbm.follower_ids_count + len(new_follower_ids):
+        # the listed ids plus the unlisted database ids are the current followers
+        listed_follower_ids = set(apim.follower_ids)
+        apim.follower_ids = [uid for uid in dbm.follower_ids if uid not in listed_follower_ids]
+
+        print("* fast follower ids, {0} new ids found at the head of the list.".format( \
+            len(new_follower_ids)))
+        return True
+
+    # counts show unfollows further down the list, continue for a full listing
+    print("* fast follower ids not possible, followers count differs by {0}. listing all " \
+          "ids.".format(apim.user.followers_count - dbm.follower_ids_count - \
+                        len(new_follower_ids)))
+    apim.get_follower_ids(cursor=apim.follower_ids_next_cursor, \
+                          follower_ids=apim.follower_ids, on_page=dbm.append_sync_follower_ids)
+
+    return False
+
 def process_unfollowers(dbm, apim):
     """ performs insertion of unfollowers into unfollowers table and
         the removal of unfollowers from followers table. """
-    dbm.unfollower_ids = []
-
     # ids in database but not returned from api requests are unfollowers
-    for follower_id in dbm.follower_ids:
-        if follower_id not in apim.follower_ids:
-            dbm.unfollower_ids.append(follower_id)
-
-    #dbm.unfollower_ids = [follower_id
-    #                      for follower_id in dbm.follower_ids
-    #                      if follower_id not in apim.follower_ids]
+    with apim.metrics.span("diff"):
+        follower_diff = diff_minions.diff_follower_ids(apim.follower_ids, dbm.follower_ids)
+    dbm.unfollower_ids = follower_diff.removed
 
     if dbm.unfollower_ids:
         dbm.insert_unfollowers(dbm.unfollower_ids)
@@ -122,14 +363,9 @@ def process_follower_ids(dbm, apim):
     new_follower_summary = MinionSummaryList()
 
     # new followers, id in list returned from api request but not in database
-    dbm.new_follower_ids = []
-    for follower_id in apim.follower_ids:
-        if follower_id not in dbm.follower_ids:
-            dbm.new_follower_ids.append(follower_id)
-
-    #dbm.new_follower_ids = [follower_id
-    #                        for follower_id in apim.follower_ids
-    #                        if follower_id not in dbm.follower_ids]
+    with apim.metrics.span("diff"):
+        follower_diff = diff_minions.diff_follower_ids(apim.follower_ids, dbm.follower_ids)
+    dbm.new_follower_ids = follower_diff.added
 
     # insert new followers in database
     if dbm.new_follower_ids:
@@ -137,12 +373,14 @@ def process_follower_ids(dbm, apim):
         #summary_faux_counter = copy.copy(apim.follower_ids_count)
         summary_faux_counter = apim.follower_ids_count
 
-        # gets the user objects for new followers using api /users/show/:id request
-        new_followers = apim.get_users(dbm.new_follower_ids)
+        # gets the user objects for new followers using api /users/lookup requests
+        with apim.metrics.span("hydrate"):
+            new_followers = apim.lookup_users(dbm.new_follower_ids)
+        print_missing_users(apim, "new follower")
         for follower in new_followers:
             #print("+ inserting new follower: {0} - @{1}".format(follower.id, \
             #    follower.screen_name), end='\r')
-            dbm.insert_followers([follower])
+            dbm.buffer_insert_followers([follower])
 
             # dbm.inserted_followers
             minion = MinionSummary(summary_faux_counter, follower.id, \
@@ -151,85 +389,178 @@ def process_follower_ids(dbm, apim):
 
             summary_faux_counter -= 1
 
+        dbm.flush_followers()
+
         # print summary of followers inserted into database
         if dbm.inserted_followers:
             print_follower_summary(new_follower_summary, Fore.GREEN + "+ new followers:", dbm.inserted_followers, Fore.GREEN)
 
-def process_followers(dbm, apim):
-    """ performs insertion of new followers and updating of existing followers database
-        records. user objects from api /followers/list results are used to insert new and
-        update existing followers records. user ids found in /followers/ids api results but
-        not /followers/list results are called spares and added to the spares list. prints a
-        summary of new followers.
+def process_follower_ids_streamed(dbm, apim, followers_count):
+    """ performs database insertion of new followers and moves unfollowers to the
+        unfollowers table like process_follower_ids and process_unfollowers, but the ids
+        are compared in the database and read back a batch at a time so memory use does
+        not grow with the number of followers. prints a summary of new followers. """
 
-        * updates followers records in the database. """
+    added_count, removed_count = dbm.reconcile_sync_follower_ids()
 
-    new_follower_summary = MinionSummaryList()
+    if added_count:
+        new_follower_summary = MinionSummaryList()
+        summary_faux_counter = followers_count
 
-    # decrementing list
-    spare_follower_ids = list(apim.follower_ids)
-
-    if apim.follower_ids_count:
-        # max 200 followers per request
-        calc_reqs_value = int(apim.follower_ids_count) / 200
-        calc_reqs_string = "* est. {0}{1} requests{2}. (limit of 15 requests " \
-            "per 15 minutes)".format(Fore.MAGENTA, int(round(calc_reqs_value)) if calc_reqs_value > 1 \
-            else "< 1", colorama.Fore.WHITE)
-        print(calc_reqs_string)
-
-        # if will take more than the request limit for 15 mins
-        if calc_reqs_value >= 15:
-            #calc_reqs_value = int(math.ceil(calc_reqs_value / 15.0)) * 15 # rounds up nearest 15
-            calc_reqs_value = calc_reqs_value - (calc_reqs_value%15) # rounds down nearest 15
-            print("* operation is likely to take {0}~{1} minutes.".format(Fore.MAGENTA, calc_reqs_value))
-            calc_reqs = input("  do you wish to continue? (y/n): ")
+        for new_follower_ids in dbm.iter_new_follower_ids():
+            with apim.metrics.span("hydrate"):
+                new_followers = apim.lookup_users(new_follower_ids)
+            print_missing_users(apim, "new follower")
+            dbm.buffer_insert_followers(new_followers)
 
-            if calc_reqs.lower().strip() != "y":
-                print("* exiting.")
-                dbm.close_connection()
-                sys.exit();
+            for follower in new_followers:
+                new_follower_summary.minions = MinionSummary(summary_faux_counter, follower.id, \
+                    follower.screen_name, follower.name, follower.description)
+                summary_faux_counter -= 1
 
-    api_followers = tweepy.Cursor(apim.api.followers, user_id=apim.user.id, count=200).items()
+        dbm.flush_followers()
 
-    #summary_faux_counter = copy.copy(apim.follower_ids_count)
-    summary_faux_counter = apim.follower_ids_count
+        if dbm.inserted_followers:
+            print_follower_summary(new_follower_summary, Fore.GREEN + "+ new followers:", \
+                                   dbm.inserted_followers, Fore.GREEN)
 
-    iteration_counter = 0
+    if removed_count:
+        for unfollower_ids in dbm.iter_unfollower_ids():
+            dbm.insert_unfollowers(unfollower_ids)
+            dbm.remove_followers(unfollower_ids)
 
+def iter_follower_pages(apim, cursor=-1):
+    """ yields pages of user objects from api /followers/list requests with the cursor for
+        the page that follows each one. """
+
+    api_follower_pages = apim.get_follower_pages(cursor)
     while True:
         try:
-            follower = next(api_followers)
+            followers_page = next(api_follower_pages)
         except tweepy.TweepError as err:
             print("tweepy_api.followers cursor error: {0} (continue)".format(err))
             continue
         except StopIteration:
             break
 
-        iteration_counter += 1
+        yield followers_page, api_follower_pages.next_cursor
 
-        # if follower in database then update their database record
-        if follower.id in dbm.follower_ids:
-            dbm.update_followers([follower])
+def process_followers(dbm, apim, interactive=True):
+    """ performs insertion of new followers and updating of existing followers database
+        records. user objects from api /followers/list results are used to insert new and
+        update existing followers records. user ids found in /followers/ids api results but
+        not /followers/list results are called spares and added to the spares list. prints a
+        summary of new followers. returns false if followers could not be written.
 
-        # if follower not in database then insert new follower
-        else:
-            #print("+ new follower: {0} - @{1}".format(follower.id, \
-            #    follower.screen_name), end='\r') # end='\r'
-            dbm.insert_followers([follower])
+        * updates followers records in the database. """
 
-            # dbm.inserted_followers
-            minion = MinionSummary(summary_faux_counter, follower.id, \
-                                   follower.screen_name, follower.name, follower.description)
-            new_follower_summary.minions = minion
+    new_follower_summary = MinionSummaryList()
 
-            summary_faux_counter -= 1
+    # ids seen in /followers/list results, the remainder of /followers/ids are spares
+    seen_follower_ids = ids_minions.FollowerIds()
+    api_follower_ids = apim.follower_ids
+    db_follower_ids = dbm.follower_ids
 
-        # eliminate follower from spare followers list
-        if follower.id in spare_follower_ids:
-            spare_follower_ids.remove(follower.id)
-        else:
-            # so id in /followers but not /follower_ids - unusual but happens sometimes
-            print("* trying remove follower {0} - not in spare_follower_ids".format(follower.id))
+    #summary_faux_counter = copy.copy(apim.follower_ids_count)
+    summary_faux_counter = apim.follower_ids_count
+
+    iteration_counter = 0
+
+    # resume a previously interrupted sweep from its last committed page
+    cursor = -1
+    sync_state = dbm.get_sync_state(db_minions.SYNC_FOLLOWERS_LIST)
+    if sync_state:
+        cursor = sync_state['next_cursor']
+        iteration_counter = sync_state['items']
+        seen_follower_ids.extend(dbm.get_follower_ids_since(sync_state['time_started']))
+        print("* resuming followers update after {0} followers (use '--restart' to start " \
+              "again).".format(iteration_counter))
+
+    if apim.follower_ids_count and cursor != 0:
+        # pages of 200 followers left, timed against the /followers/list budget and resets
+        list_requests = plan_minions.page_count(apim.follower_ids_count - iteration_counter, \
+                                                plan_minions.FOLLOWERS_LIST_PAGE_SIZE)
+        now = apim.rate_limits.clock()
+        finish, timeline = plan_minions.simulate_phases( \
+            [(rate_minions.FOLLOWERS_LIST, list_requests)], \
+            plan_minions.get_endpoint_limits(apim.rate_limits, apim.token), now)
+        print("* est. {0}{1}{2} /followers/list requests, finishing in {0}{3}{2}.".format( \
+            Fore.MAGENTA, list_requests, Fore.WHITE, plan_minions.format_duration(finish - now)))
+
+        # ask before a sweep that waits for rate limit windows to reset
+        if interactive and any(event['wait'] for event in timeline):
+            calc_reqs = input("  do you wish to continue? (y/n): ")
+
+            if calc_reqs.lower().strip() != "y":
+                print("* exiting.")
+                dbm.close_connection()
+                sys.exit()
+
+    def build_follower_rows(page_item):
+        """ transform stage, builds insert and update rows for a page of followers. """
+        followers_page, next_cursor = page_item
+
+        insert_rows, update_rows = [], []
+        for follower in followers_page:
+            if follower.id in db_follower_ids:
+                update_rows.append(dbm.follower_update_row(follower))
+            else:
+                insert_rows.append(dbm.follower_insert_row(follower))
+
+        return followers_page, insert_rows, update_rows, next_cursor
+
+    def write_follower_rows(row_item):
+        """ write stage, buffers rows and commits them with the page cursor. """
+        nonlocal iteration_counter, summary_faux_counter, write_failed
+        followers_page, insert_rows, update_rows, next_cursor = row_item
+
+        for follower in followers_page:
+            iteration_counter += 1
+
+            # if follower not in database then it is a new follower
+            if follower.id not in db_follower_ids:
+                #print("+ new follower: {0} - @{1}".format(follower.id, \
+                #    follower.screen_name), end='\r') # end='\r'
+
+                # dbm.inserted_followers
+                minion = MinionSummary(summary_faux_counter, follower.id, \
+                                       follower.screen_name, follower.name, follower.description)
+                new_follower_summary.minions = minion
+
+                summary_faux_counter -= 1
+
+            # eliminate follower from spare followers list
+            seen_follower_ids.append(follower.id)
+            if follower.id not in api_follower_ids:
+                # so id in /followers but not /follower_ids - unusual but happens sometimes
+                print("* trying remove follower {0} - not in spare_follower_ids".format( \
+                    follower.id))
+
+        # commit the page of followers with the cursor for the next page, stopping the sweep
+        # if it could not be written so the page is requested again by a resumed run
+        if not dbm.buffer_follower_rows(insert_rows, update_rows) or \
+           not dbm.checkpoint_sync_state(db_minions.SYNC_FOLLOWERS_LIST, next_cursor, \
+                                         iteration_counter):
+            write_failed = True
+            return False
+        return True
+
+    # a saved next cursor of 0 means the sweep finished but was not cleared
+    write_failed = False
+    if cursor != 0:
+        # api paging, row building and database writes run as overlapping stages
+        stages = pipeline_minions.run_pipeline(iter_follower_pages(apim, cursor), \
+                                               build_follower_rows, write_follower_rows)
+        print_pipeline_stats(stages)
+        for stage in stages:
+            apim.metrics.add_span("pipeline_" + stage.name, stage.busy_time)
+            apim.metrics.add_span("pipeline_" + stage.name + "_wait", stage.wait_time)
+
+    if write_failed or not dbm.flush_followers():
+        print("* unable to write followers, the update resumes from the last saved page.")
+        return False
+
+    dbm.clear_sync_state(db_minions.SYNC_FOLLOWERS_LIST)
 
     pad_to = 22
     print("{0:<{1}s}{2}{3}".format("followers (api list):", pad_to, Fore.GREEN, iteration_counter))
@@ -239,38 +570,72 @@ def process_followers(dbm, apim):
         print_follower_summary(new_follower_summary, Fore.GREEN + "+ new followers:", dbm.inserted_followers, Fore.GREEN)
 
     # remainder user ids in spare_follower_ids are spare followers
+    spare_follower_ids = diff_minions.diff_follower_ids(apim.follower_ids, \
+                                                        seen_follower_ids).added
     if spare_follower_ids:
         process_spare_followers(dbm, apim, spare_follower_ids)
 
+    return True
+
+def process_refresh(dbm, apim, refresh_requests, refresh_order="stale"):
+    """ refreshes the records of the followers most in need of it using at most
+        refresh_requests api /users/lookup requests of 100 users each. over many runs this
+        updates the whole followers table without a full '--update'. """
+
+    refresh_ids = dbm.get_stale_follower_ids(refresh_requests * api_minions.LOOKUP_USERS_CHUNK_SIZE, \
+                                             refresh_order)
+    if not refresh_ids:
+        return
+
+    with apim.metrics.span("hydrate"):
+        refreshed_followers = apim.lookup_users(refresh_ids)
+    dbm.buffer_update_followers(refreshed_followers)
+    dbm.flush_followers()
+
+    # suspended users are moved to the back of the queue
+    print_missing_users(apim, "refresh")
+    if apim.missing_user_ids:
+        dbm.touch_followers(apim.missing_user_ids)
+
+    pad_to = 22
+    print("{0:<{1}s}{2}{3} of {4}".format("refreshed followers:", pad_to, Fore.YELLOW, \
+                                          len(refreshed_followers), len(refresh_ids)))
+
 def process_spare_followers(dbm, apim, spare_follower_ids):
     """ retrieves user objects for each spare follower and inserts a new follower or updates
         the follower record depending on if their id is in the database. prints a summary
         of new and updated followers. """
 
     spare_follower_summary = MinionSummaryList()
+    db_follower_ids = dbm.follower_ids
 
-    # get user objects for spare followers using api /users/show/:id request
-    spare_followers = apim.get_users(spare_follower_ids)
+    # get user objects for spare followers using api /users/lookup requests
+    with apim.metrics.span("hydrate"):
+        spare_followers = apim.lookup_users(spare_follower_ids)
+    print_missing_users(apim, "spare follower")
 
     for follower in spare_followers:
         prefix = ""
 
-        if follower.id in dbm.follower_ids:
-            dbm.update_followers([follower])
+        if follower.id in db_follower_ids:
+            dbm.buffer_update_followers([follower])
             prefix = "^"
         else:
-            dbm.insert_followers([follower])
+            dbm.buffer_insert_followers([follower])
             prefix = "+"
 
         minion = MinionSummary(prefix, follower.id, follower.screen_name, follower.name, follower.description)
         spare_follower_summary.minions = minion
 
+    dbm.flush_followers()
+
     # print summary of spare followers updated or inserted into database
     #title = "^ spare ids in '/followers/ids' not in '/followers/list':"
     title = Fore.GREEN + "* spare ids in '/followers/ids' not in '/followers/list':"
     print_follower_summary(spare_follower_summary, title, len(spare_follower_ids), Fore.GREEN)
 
 def format_summary_table_row(index, row, table_color):
+    import textwrap
     #minion_description = textwrap.fill(minion.description, 60)
 
     minion_prefix, minion_screen_name, minion_name, minion_description = row
@@ -297,6 +662,8 @@ def format_summary_table_row(index, row, table_color):
 # accepts MinionSummaryList.minions dictionary
 def print_follower_summary(minions_summary, title, num_followers, table_color):
     """ print a table of summary data about followers. """
+    if not TEXT_OUTPUT:
+        return
 
     last_followers_txt = ""
     if num_followers > minions_summary.list_size:
@@ -317,9 +684,19 @@ def print_follower_summary(minions_summary, title, num_followers, table_color):
 
     print(minion_table)
 
+def print_missing_users(apim, label):
+    """ prints the ids that the last users lookup did not return a user object for. """
+
+    if apim.missing_user_ids:
+        print("* {0} {1} ids not found (suspended, deactivated or failed): {2}".format( \
+            len(apim.missing_user_ids), label, \
+            ", ".join(str(uid) for uid in apim.missing_user_ids[:10])))
+
 def print_unfollowers(dbm):
     """ formats captured data about unfollowers into a standard minions summary format.
         prints a summary of unfollowers. """
+    if not TEXT_OUTPUT:
+        return
 
     if dbm.unfollowers:
         unfollower_summary = MinionSummaryList()
@@ -335,6 +712,8 @@ def print_unfollowers(dbm):
 
 def print_user_summary(user):
     """ prints a table with some data about the twitter user. accepts a user object. """
+    if not TEXT_OUTPUT:
+        return
 
     ratio = 0
     if user.friends_count > 0:
@@ -349,96 +728,866 @@ def print_user_summary(user):
     print("{0:<{1}s}{2}{3:.2f}".format("ratio:", pad_to, Fore.WHITE if ratio < 1 else Fore.GREEN, ratio))
     print()
 
+def print_pipeline_stats(stages):
+    """ prints throughput counters for the followers update pipeline stages. """
+    if not TEXT_OUTPUT:
+        return
+
+    bottleneck = pipeline_minions.get_bottleneck(stages)
+
+    pad_to = 22
+    for stage in stages:
+        print("{0:<{1}s}{2}{3} items {4:.1f}/s (busy {5:.1f}s, waiting {6:.1f}s){7}".format( \
+            "pipeline " + stage.name + ":", pad_to, Fore.WHITE, stage.items, \
+            stage.items_per_second, stage.busy_time, stage.wait_time, \
+            " *" if stage is bottleneck else ""))
+
 def print_stats(dbm):
     """ prints a summary about processing from DBMinions processing counters. """
+    if not TEXT_OUTPUT:
+        return
 
     pad_to = 19
     print()
     print("{0:<{1}s}{2}{3}".format("new followers:", pad_to, Fore.GREEN, dbm.inserted_followers))
-    print("{0:<{1}s}{2}{3}".format("updated followers:", pad_to, Fore.YELLOW, dbm.updated_followers))
+    print("{0:<{1}s}{2}{3} ({4} unchanged)".format("updated followers:", pad_to, Fore.YELLOW, \
+                                                   dbm.updated_followers, dbm.unchanged_followers))
     print("{0:<{1}s}{2}{3} ({4})".format("unfollowers:", pad_to, Fore.CYAN, dbm.removed_followers, \
                                          dbm.inserted_unfollowers))
 
-def print_art():
-    print("{0}twitter-_  _  ___  _  __   .___   ___\n" \
-             "/  _ ` _ `(_)/ _ `(_)/ _`\/' _ `/',__)\n" \
-             "| ( | | ) | | ( ) | ( (_) | ( ) \\__, \\\n" \
-             "|_| |_| |_(_(_| (_(_`\___/(_| (_(____/ {1}v{2}\n".format(Fore.CYAN, Fore.YELLOW, VERSION))
+def print_report(report):
+    """ prints the follower aggregates of a stats report. """
+    if not TEXT_OUTPUT:
+        return
 
-def main():
-    """ retrieves, processes and databases a users followers. """
+    pad_to = 22
+    print("{0:<{1}s}{2}{3}".format("followers:", pad_to, Fore.GREEN, report['followers']))
+    print("{0:<{1}s}{2}{3}".format("reach:", pad_to, Fore.GREEN, report['reach']))
+    print("{0:<{1}s}{2}{3} ({4})".format("follows (unfollows):", pad_to, Fore.GREEN, \
+                                         report['follows'], report['unfollows']))
+    print("{0:<{1}s}{2}+{3} -{4} ({5:.2%} churn)".format( \
+        "last {0} days:".format(report['days']), pad_to, Fore.YELLOW, report['recent_follows'], \
+        report['recent_unfollows'], report['churn_rate']))
+    if report['mean_tenure_days'] is not None:
+        print("{0:<{1}s}{2}{3} days".format("mean tenure:", pad_to, Fore.CYAN, \
+                                            report['mean_tenure_days']))
 
-    colorama.init(autoreset=True)
+    print()
+    for day in report['daily']:
+        print("{0:<{1}s}{2}+{3} {4}-{5}".format(day['day'], pad_to, Fore.GREEN, day['follows'], \
+                                                Fore.CYAN, day['unfollows']))
 
-    print_art()
+    print()
+    for bucket in report['tenure']:
+        print("{0:<{1}s}{2}{3}".format("tenure {0}+ days:".format(bucket['min_days']), pad_to, \
+                                       Fore.CYAN, bucket['unfollows']))
 
-    app_consumer_key = os.environ.get('TWITTER_CONSUMER_KEY', 'None')
-    app_consumer_secret = os.environ.get('TWITTER_CONSUMER_SECRET', 'None')
-    app_access_key = os.environ.get('TWITTER_ACCESS_KEY', 'None')
-    app_access_secret = os.environ.get('TWITTER_ACCESS_SECRET', 'None')
+def print_overlap(overlap):
+    """ prints the follower counts of an overlap between accounts. """
+    if not TEXT_OUTPUT:
+        return
 
-    user_args = get_arguments()
+    pad_to = 22
+    print("{0:<{1}s}{2}{3}".format("followers:", pad_to, Fore.GREEN, overlap['followers']))
+    for account_id, shared in overlap['shared'].items():
+        print("{0:<{1}s}{2}{3}".format("shared with {0}:".format(account_id), pad_to, \
+                                       Fore.GREEN, shared))
+    print("{0:<{1}s}{2}{3}".format("shared by all:", pad_to, Fore.YELLOW, \
+                                   overlap['intersection']))
+    print("{0:<{1}s}{2}{3}".format("any account:", pad_to, Fore.YELLOW, overlap['union']))
+    print("{0:<{1}s}{2}{3}".format("user only:", pad_to, Fore.CYAN, overlap['difference']))
+
+def print_plan(strategies, chosen):
+    """ prints the requests and finish time of each planned strategy and the timeline of
+        the chosen one. """
+    if not TEXT_OUTPUT:
+        return
+
+    pad_to = max([22] + [len(strategy['name']) + 7 for strategy in strategies])
+    for strategy in strategies:
+        color = Fore.GREEN if strategy is chosen else Fore.WHITE
+        print("{0:<{1}s}{2}{3} requests, finishes in {4}{5}".format( \
+            "plan {0}:".format(strategy['name']), pad_to, color, strategy['total_requests'], \
+            plan_minions.format_duration(strategy['seconds']), \
+            " (chosen)" if strategy is chosen else ""))
+        for endpoint, requests in strategy['requests'].items():
+            print("{0:<{1}s}{2}".format("  " + endpoint, pad_to, requests))
+
+    if not chosen:
+        return
 
-    apim = api_minions.APIMinions(app_consumer_key, app_consumer_secret, \
-                                  app_access_key, app_access_secret)
+    print()
+    start = chosen['timeline'][0]['time'] if chosen['timeline'] else 0
+    for event in chosen['timeline'][:PLAN_TIMELINE_SIZE]:
+        offset = "+" + plan_minions.format_duration(event['time'] - start)
+        if event['wait']:
+            print("{0:<{1}s}{2}wait {3} for {4}".format(offset, pad_to, Fore.YELLOW, \
+                                                        plan_minions.format_duration( \
+                                                            event['wait']), event['endpoint']))
+        else:
+            print("{0:<{1}s}{2}{3} {4}".format(offset, pad_to, Fore.CYAN, event['requests'], \
+                                               event['endpoint']))
+    if len(chosen['timeline']) > PLAN_TIMELINE_SIZE:
+        print("{0:<{1}s}{2} more steps".format("...", pad_to, \
+                                               len(chosen['timeline']) - PLAN_TIMELINE_SIZE))
+    print("{0:<{1}s}{2}{3}".format("finish:", pad_to, Fore.GREEN, \
+                                   time.strftime("%Y-%m-%d %H:%M:%S", \
+                                                 time.localtime(chosen['finish']))))
 
-    if not apim.api:
-        print("* unable to initialize the tweepy api.")
-        sys.exit()
+def print_art():
+    print("{0}twitter-_  _  ___  _  __   .___   ___\n" \
+             "/  _ ` _ `(_)/ _ `(_)/ _`\/' _ `/',__)\n" \
+             "| ( | | ) | | ( ) | ( (_) | ( ) \\__, \\\n" \
+             "|_| |_| |_(_(_| (_(_`\___/(_| (_(____/ {1}v{2}\n".format(Fore.CYAN, Fore.YELLOW, VERSION))
+
+def write_run_metrics(apim, dbm, user_id, success, metrics_json=None, metrics_prom=None, \
+                      per_user=False, followers_count=None):
+    """ adds the run outcome to the api minions metrics and writes them to the json report
+        and prometheus textfile paths given. the followers count defaults to the number of
+        api follower ids. """
+
+    if not metrics_json and not metrics_prom:
+        return
+
+    metrics = apim.metrics
+    metrics.count("run_success", 1 if success else 0)
+    metrics.count("followers", apim.follower_ids_count if followers_count is None \
+                  else followers_count)
+    if dbm:
+        metrics.count("new_followers", dbm.inserted_followers)
+        metrics.count("updated_followers", dbm.updated_followers)
+        metrics.count("unfollowers", dbm.inserted_unfollowers)
+
+    if apim.user:
+        user_id = apim.user.id
+
+    try:
+        if metrics_json:
+            metrics.write_json(metrics_minions.get_metrics_path(metrics_json, user_id, per_user), \
+                               user_id=user_id, success=success, \
+                               run_id=dbm.run_id if dbm else None)
+        if metrics_prom:
+            metrics.write_prometheus(metrics_minions.get_metrics_path(metrics_prom, user_id, \
+                                                                      per_user), \
+                                     user=user_id)
+    except OSError as err:
+        print("* unable to write metrics: {0}".format(err))
+
+def get_run_result(apim, dbm, user_id, success, run_mode=None, db_followers_count=None, \
+                   api_followers_count=None):
+    """ returns a json serializable dictionary of a runs outcome: the user, counts of
+        followers and changes, up to RUN_RESULT_LIST_SIZE new followers and unfollowers and
+        the run phase timings. """
+
+    user = {"id": user_id}
+    if apim.user:
+        user = {"id": apim.user.id, "screen_name": apim.user.screen_name, \
+                "name": apim.user.name, "followers_count": apim.user.followers_count}
+
+    result = {"user": user, "success": success, "run_id": dbm.run_id if dbm else None, \
+              "mode": run_mode, "version": VERSION}
+
+    if dbm:
+        result["counts"] = {"followers_db": db_followers_count, \
+                            "followers_api": api_followers_count, \
+                            "new_followers": dbm.inserted_followers, \
+                            "updated_followers": dbm.updated_followers, \
+                            "unchanged_followers": dbm.unchanged_followers, \
+                            "unfollowers": dbm.inserted_unfollowers}
+        result["new_followers"] = dbm.get_run_new_followers(RUN_RESULT_LIST_SIZE) \
+            if dbm.run_id and dbm.connection else []
+        result["unfollowers"] = [{key: unfollower[key] for key in ("user_id", \
+                                  "user_screen_name", "user_name", "user_time_found")}
+                                 for unfollower in dbm.unfollowers[:RUN_RESULT_LIST_SIZE]]
+
+    report = apim.metrics.report()
+    result["time_started"] = report['time_started']
+    result["timings"] = {name: span['seconds'] for name, span in report['spans'].items()}
+
+    return result
+
+def write_run_result(result, output_format, stream):
+    """ writes a run result to stream as an indented json document or a line of ndjson """
+    if output_format == "ndjson":
+        stream.write(json.dumps(result, separators=(",", ":")) + "\n")
+    else:
+        stream.write(json.dumps(result, indent=2) + "\n")
+    stream.flush()
+
+def process_user(apim, user_id, update=False, restart=False, interactive=True, compact=False, \
+                 refresh=0, refresh_order="stale", fast=False, database_dir=None, \
+                 metrics_json=None, metrics_prom=None, metrics_per_user=False, stream=False, \
+                 on_result=None):
+    """ retrieves, processes and databases a users followers. when not interactive a missing
+        database is created and an empty one is filled with a full update without asking.
+        if stream is set id runs compare ids in the database rather than in memory. run
+        metrics are written to the metrics_json and metrics_prom paths if given and the run
+        result is passed to on_result if given. returns true if processing completed. """
+
+    apim.metrics.reset()
+    run_start = apim.metrics.clock()
+
+    # run details known so far, for the run result
+    run_info = {}
+
+    def finish(dbm, success, followers_count=None):
+        """ records the run span, writes the run metrics and passes on the run result. """
+        apim.metrics.add_span("run", apim.metrics.clock() - run_start)
+        write_run_metrics(apim, dbm, user_id, success, metrics_json, metrics_prom, \
+                          metrics_per_user, followers_count)
+        if on_result:
+            on_result(get_run_result(apim, dbm, user_id, success, **run_info))
+        if dbm:
+            dbm.close_connection()
+        return success
 
-    user_obj = apim.get_users([user_args.user])
+    with apim.metrics.span("user_lookup"):
+        user_obj = apim.get_users([user_id])
     if user_obj:
         apim.user = user_obj[0]
     else:
-        print("* unable to retrieve user: {0}".format(user_args.user))
-        sys.exit()
+        print("* unable to retrieve user: {0}".format(user_id))
+        return finish(None, False)
 
     print_user_summary(apim.user)
 
-    dbm = db_minions.DBMinions(get_user_database_path(apim.user.id))
+    dbm = db_minions.DBMinions(get_user_database_path(apim.user.id, database_dir), \
+                               create=None if interactive else True, metrics=apim.metrics, \
+                               stream=stream)
 
     if not dbm.connection:
         print("* unable to make a database connection: {0}".format(dbm.path))
-        sys.exit()
+        return finish(None, False)
 
     pad_to = 22
-    # db follower ids
-    dbm.get_follower_ids()
-    print("{0:<{1}s}{2}{3}".format("followers (db):", pad_to, Fore.GREEN, dbm.follower_ids_count))
+    if compact:
+        print("{0:<{1}s}{2}{3}".format("compacted profiles:", pad_to, Fore.GREEN, \
+                                       dbm.compact_profiles()))
+
+    # db follower ids, only counted if they are compared in the database. an empty database
+    # needs a full update that is not streamed
+    db_followers_count = dbm.count_followers() if stream and not update else 0
+    stream = db_followers_count > 0
+    if not stream:
+        dbm.get_follower_ids()
+        db_followers_count = dbm.follower_ids_count
+    print("{0:<{1}s}{2}{3}".format("followers (db):", pad_to, Fore.GREEN, db_followers_count))
+    run_info["db_followers_count"] = db_followers_count
+
+    # a listing that finished but was not reconciled, such as by declining a prompt or an
+    # error, is only reused within the rate limit window it was made in
+    dbm.clear_finished_sync_state(rate_minions.RATE_LIMIT_WINDOW)
+
+    # discard saved paging progress from interrupted runs
+    if restart:
+        dbm.clear_sync_state(db_minions.SYNC_FOLLOWER_IDS)
+        dbm.clear_sync_state(db_minions.SYNC_FOLLOWERS_LIST)
 
     # api follower ids
-    apim.get_follower_ids()
-    print("{0:<{1}s}{2}{3}".format("followers (api ids):", pad_to, Fore.GREEN, apim.follower_ids_count))
+    with apim.metrics.span("api_follower_ids"):
+        if stream:
+            get_api_follower_ids(dbm, apim, keep_ids=False)
+        elif fast and not update:
+            get_api_follower_ids_fast(dbm, apim)
+        else:
+            get_api_follower_ids(dbm, apim)
+    api_followers_count = dbm.count_sync_follower_ids() if stream else apim.follower_ids_count
+    print("{0:<{1}s}{2}{3}".format("followers (api ids):", pad_to, Fore.GREEN, api_followers_count))
+    run_info["api_followers_count"] = api_followers_count
 
     # if no db followers ask to do a full update
-    if not user_args.update and dbm.follower_ids_count < 1:
+    if not update and not stream and dbm.follower_ids_count < 1:
 
         print("* no records in the database. please collect some followers by using the " \
             "'-upd' updates option or select 'y'.")
-        collect_followers = input("  do you wish to collect followers now? (y/n): ")
+        collect_followers = "y"
+        if interactive:
+            collect_followers = input("  do you wish to collect followers now? (y/n): ")
 
         if collect_followers.lower().strip() == "y":
-            user_args.update = True
+            update = True
         else:
             print("* no database followers. exiting.")
-            dbm.close_connection()
-            sys.exit()
+            return finish(dbm, False)
+
+    # record the run, the head of its listing and a compact snapshot of its follower ids
+    run_info["run_mode"] = "update" if update else "stream" if stream else "ids"
+    dbm.start_run(run_info["run_mode"])
+    with apim.metrics.span("snapshot"):
+        if stream:
+            dbm.save_head_ids(dbm.get_sync_head_ids())
+            dbm.save_follower_snapshot_from_sync()
+        else:
+            dbm.save_head_ids(apim.follower_ids)
+            dbm.save_follower_snapshot(apim.follower_ids)
 
     # process followers
-    if not user_args.update:
-        process_follower_ids(dbm, apim)
+    if not update:
+        with apim.metrics.span("process_follower_ids"):
+            if stream:
+                process_follower_ids_streamed(dbm, apim, api_followers_count)
+            else:
+                process_follower_ids(dbm, apim)
     else:
-        process_followers(dbm, apim)
-
-    # process unfollowers
-    process_unfollowers(dbm, apim)
+        with apim.metrics.span("process_followers"):
+            if not process_followers(dbm, apim, interactive):
+                return finish(dbm, False)
+
+    # process unfollowers, streamed runs moved them with the new followers
+    if not stream:
+        with apim.metrics.span("process_unfollowers"):
+            process_unfollowers(dbm, apim)
+
+    # refresh once unfollowers are removed so no lookups are spent on them
+    if refresh and not update:
+        with apim.metrics.span("refresh"):
+            process_refresh(dbm, apim, refresh, refresh_order)
     print_unfollowers(dbm)
 
+    # follower ids are reconciled, the next run starts a new /followers/ids listing
+    dbm.clear_sync_state(db_minions.SYNC_FOLLOWER_IDS)
+    dbm.finish_run(api_followers_count)
+
+    # keep the accounts bitmap in the shared follower index current
+    with apim.metrics.span("follower_index"):
+        update_follower_index(dbm, apim.user.id, database_dir)
+
     # summary of processing
     print_stats(dbm)
 
+    return finish(dbm, True, api_followers_count)
+
+def open_user_database(apim, user_id, database_dir=None):
+    """ returns the numeric user id and a DBMinions object for an existing user database,
+        or none in place of the object. an @name is looked up with the api, a numeric id
+        needs no api object. """
+
+    if not str(user_id).isdigit():
+        user_obj = apim.get_users([user_id])
+        if not user_obj:
+            print("* unable to retrieve user: {0}".format(user_id))
+            return user_id, None
+        user_id = user_obj[0].id
+
+    dbm = db_minions.DBMinions(get_user_database_path(user_id, database_dir), create=False)
+    if not dbm.connection:
+        print("* unable to make a database connection: {0}".format(dbm.path))
+        return int(user_id), None
+
+    return int(user_id), dbm
+
+def plan_user(apim, user_id, update=False, fast=False, refresh=0, deadline=None, budget=None, \
+              database_dir=None, on_result=None):
+    """ plans the requests of a run from the users followers count, their database and the
+        rate limit budgets, and prints the requests and simulated finish time of each way to
+        do it. with a deadline in seconds or a budget of requests the strategy with the
+        fewest requests that fits is chosen, refreshing fewer followers if none fits,
+        otherwise the requested run. the plan is passed to on_result if given. returns the
+        chosen strategy dictionary with its update, fast and refresh options or none. """
+
+    with apim.metrics.span("user_lookup"):
+        user_obj = apim.get_users([user_id])
+    if not user_obj:
+        print("* unable to retrieve user: {0}".format(user_id))
+        return None
+    apim.user = user_obj[0]
+
+    db_followers_count = 0
+    fast_possible = False
+    resume_items = {db_minions.SYNC_FOLLOWER_IDS: 0, db_minions.SYNC_FOLLOWERS_LIST: 0}
+    database_path = get_user_database_path(apim.user.id, database_dir)
+    if os.path.isfile(database_path):
+        dbm = db_minions.DBMinions(database_path, create=False)
+        if dbm.connection:
+            db_followers_count = dbm.count_followers()
+            dbm.clear_finished_sync_state(rate_minions.RATE_LIMIT_WINDOW)
+            for sync_name in resume_items:
+                sync_state = dbm.get_sync_state(sync_name)
+                if sync_state:
+                    resume_items[sync_name] = sync_state['items']
+            fast_possible = bool(db_followers_count and dbm.get_previous_head_ids() and \
+                                 not dbm.get_sync_state(db_minions.SYNC_FOLLOWER_IDS))
+            dbm.close_connection()
+
+    # an empty database is filled with an update and refreshes only apply to id runs
+    update = update or not db_followers_count
+    strategies = plan_minions.plan_strategies(apim.user.followers_count, db_followers_count, \
+                                              update, fast, 0 if update else refresh, \
+                                              fast_possible, \
+                                              resume_items[db_minions.SYNC_FOLLOWER_IDS], \
+                                              resume_items[db_minions.SYNC_FOLLOWERS_LIST])
+
+    limits = plan_minions.get_endpoint_limits(apim.rate_limits, apim.token)
+    now = apim.rate_limits.clock()
+    plan_minions.plan_run(strategies, limits, now, apim.lookup_workers)
+
+    if deadline is None and budget is None:
+        requested = "update" if update else "fast" if fast and fast_possible else "ids"
+        chosen = next(strategy for strategy in strategies if strategy['name'] == requested)
+    else:
+        chosen = plan_minions.choose_strategy(strategies, deadline, budget)
+        if not chosen:
+            partials = [plan_minions.fit_partial_refresh(strategy, limits, now, deadline, \
+                                                         budget, apim.lookup_workers)
+                        for strategy in strategies if strategy['refresh']]
+            partials = [partial for partial in partials if partial]
+            if partials:
+                chosen = max(partials, key=lambda partial: (partial['refresh'], \
+                                                            -partial['total_requests']))
+                strategies.append(chosen)
+
+    print("{0:<{1}s}{2}{3} ({4} in the database)".format("followers (api):", 22, Fore.GREEN, \
+                                                        apim.user.followers_count, \
+                                                        db_followers_count))
+    print_plan(strategies, chosen)
+    if not chosen:
+        print("* no way to run fits the deadline and budget.")
+    print("* new followers are counted from the followers count, fast runs list all ids if " \
+          "anyone unfollowed.")
+
+    if on_result:
+        on_result({"user": {"id": apim.user.id}, "followers_count": apim.user.followers_count, \
+                   "db_followers_count": db_followers_count, \
+                   "chosen": chosen['name'] if chosen else None, \
+                   "strategies": [{key: value for key, value in strategy.items() \
+                                   if key != "phases"} for strategy in strategies]})
+
+    return chosen
+
+def report_user(apim, user_id, database_dir=None, on_result=None):
+    """ prints the follower aggregates kept in a users database. the report is passed to
+        on_result if given. returns true if the database was read. """
+
+    user_id, dbm = open_user_database(apim, user_id, database_dir)
+    if not dbm:
+        return False
+
+    report = dbm.get_stats_report()
+    dbm.close_connection()
+    if report is None:
+        return False
+
+    print_report(report)
+    if on_result:
+        on_result(dict(report, user={"id": user_id}))
+
+    return True
+
+def search_user(apim, user_id, query, database_dir=None, on_result=None):
+    """ prints the ranked profile search results for a query in a users database. the
+        results are passed to on_result if given. returns true if the database was read. """
+
+    user_id, dbm = open_user_database(apim, user_id, database_dir)
+    if not dbm:
+        return False
+
+    results = dbm.search_profiles(query)
+    dbm.close_connection()
+
+    search_summary = MinionSummaryList(db_minions.SEARCH_LIMIT)
+    for index, result in enumerate(results, 1):
+        prefix = "{0}{1}".format(index, " (unfollower)" if result['status'] == "unfollower" \
+                                 else "")
+        search_summary.minions = MinionSummary(prefix, result['user_id'], \
+                                               result['screen_name'], result['name'], \
+                                               " - ".join(text for text in \
+                                                          (result['description'], \
+                                                           result['location']) if text))
+    print_follower_summary(search_summary, Fore.GREEN + "search '{0}':".format(query), \
+                           len(results), Fore.GREEN)
+
+    if on_result:
+        on_result({"user": {"id": user_id}, "query": query, "results": results})
+
+    return True
+
+def export_user(apim, user_id, directory, export_format="csv", incremental=False, \
+                profiles=False, database_dir=None, on_result=None):
+    """ exports the tables of a users database to files in the directory. the export
+        results are passed to on_result if given. returns true if the tables were written. """
+
+    user_id, dbm = open_user_database(apim, user_id, database_dir)
+    if not dbm:
+        return False
+
+    results = export_minions.export_tables(dbm, directory, export_format, incremental, \
+                                           profiles)
+    dbm.close_connection()
+    if results is None:
+        return False
+
+    for result in results:
+        if result['path']:
+            print("* exported {0} {1} rows: {2}".format(result['rows'], result['table'], \
+                                                        result['path']))
+        else:
+            print("* no new {0} rows to export".format(result['table']))
+
+    if on_result:
+        on_result({"user": {"id": user_id}, "format": export_format, \
+                   "incremental": incremental, "tables": results})
+
+    return True
+
+def overlap_user(apim, user_id, other_users, database_dir=None, on_result=None):
+    """ prints how many followers a user shares with other tracked accounts using the
+        shared follower index. the bitmap of each account with a database is brought up to
+        date first. the overlap is passed to on_result if given. returns true if all the
+        accounts are indexed. """
+
+    account_ids = []
+    for user in [user_id] + list(other_users):
+        if not str(user).isdigit():
+            user_obj = apim.get_users([user])
+            if not user_obj:
+                print("* unable to retrieve user: {0}".format(user))
+                return False
+            user = user_obj[0].id
+        account_ids.append(int(user))
+
+    index = index_minions.FollowerIndex(get_follower_index_path(database_dir))
+    if not index.connection:
+        return False
+
+    for account_id in account_ids:
+        database_path = get_user_database_path(account_id, database_dir)
+        if os.path.isfile(database_path):
+            dbm = db_minions.DBMinions(database_path, create=False)
+            if dbm.connection:
+                index.update_account(account_id, dbm)
+                dbm.close_connection()
+
+    overlap = index.get_overlap(account_ids[0], account_ids[1:], RUN_RESULT_LIST_SIZE)
+    index.close_connection()
+    if overlap is None:
+        print("* accounts are not all in the follower index: {0}".format( \
+            ", ".join(str(account_id) for account_id in account_ids)))
+        return False
+
+    print_overlap(overlap)
+    if on_result:
+        on_result(dict(overlap, user={"id": account_ids[0]}, accounts=account_ids[1:]))
+
+    return True
+
+def process_watch_cycle(dbm, apim, follower_ids, head_ids):
+    """ applies the follower changes since the last cycle to the database and to the set of
+        follower ids, using the newest page of /followers/ids and the users followers count.
+        all ids are listed only if the count shows unfollows. returns the newest-first head
+        ids of this cycles listing. """
+
+    with apim.metrics.span("user_lookup"):
+        user_obj = apim.get_users([apim.user.id])
+    if not user_obj:
+        return head_ids
+    apim.user = user_obj[0]
+
+    previous_head_ids = set(head_ids)
+    def head_reached(listed_ids):
+        """ stops paging once a page contains an id from the previous head. """
+        return diff_minions.find_head_index(listed_ids, previous_head_ids) is not None
+
+    with apim.metrics.span("api_follower_ids"):
+        apim.get_follower_ids(stop=head_reached)
+
+        head_index = diff_minions.find_head_index(apim.follower_ids, previous_head_ids)
+        new_follower_ids = [uid for uid in apim.follower_ids[:head_index or 0]
+                            if uid not in follower_ids]
+        lost_follower_ids = []
+
+        if head_index is None or \
+           apim.user.followers_count != len(follower_ids) + len(new_follower_ids):
+            apim.get_follower_ids(cursor=apim.follower_ids_next_cursor, \
+                                  follower_ids=apim.follower_ids)
+            with apim.metrics.span("diff"):
+                follower_diff = diff_minions.diff_follower_ids(apim.follower_ids, follower_ids)
+            new_follower_ids, lost_follower_ids = follower_diff.added, follower_diff.removed
+
+    head_ids = apim.follower_ids[:db_minions.HEAD_IDS_SIZE]
+    if not new_follower_ids and not lost_follower_ids:
+        return head_ids
+
+    dbm.start_run("watch")
+    dbm.save_head_ids(head_ids)
+
+    # only the followers written to the database change the set, users that could not be
+    # looked up or written are found again by a later cycles count check
+    inserted_ids, removed_ids = [], []
+    if new_follower_ids:
+        with apim.metrics.span("hydrate"):
+            new_followers = apim.lookup_users(new_follower_ids)
+        print_missing_users(apim, "new follower")
+        if dbm.insert_followers(new_followers):
+            inserted_ids = [follower.id for follower in new_followers]
+
+    if lost_follower_ids:
+        dbm.unfollower_ids = lost_follower_ids
+        dbm.insert_unfollowers(lost_follower_ids)
+        if dbm.remove_followers(lost_follower_ids):
+            removed_ids = lost_follower_ids
+
+    follower_ids.update(inserted_ids)
+    follower_ids.difference_update(removed_ids)
+
+    with apim.metrics.span("snapshot"):
+        dbm.save_follower_snapshot_delta(inserted_ids, removed_ids, follower_ids)
+    dbm.finish_run(len(follower_ids))
+
+    return head_ids
+
+def watch_user(apim, user_id, interval, database_dir=None, metrics_json=None, \
+               metrics_prom=None, cycles=None, on_result=None):
+    """ processes a user once and then keeps checking for follower changes, holding the api
+        session, database connection and follower ids between cycles so that a cycle costs
+        the changes rather than the follower count. cycles are spread out so the
+        /followers/ids budget is not used up before its window resets. runs until
+        interrupted or for the given number of cycles. the result of the first run and of
+        each cycle is passed to on_result if given. returns true if watching started. """
+
+    if not process_user(apim, user_id, interactive=False, fast=True, database_dir=database_dir, \
+                        metrics_json=metrics_json, metrics_prom=metrics_prom, \
+                        on_result=on_result):
+        return False
+
+    dbm = db_minions.DBMinions(get_user_database_path(apim.user.id, database_dir), \
+                               create=False, metrics=apim.metrics)
+    if not dbm.connection:
+        print("* unable to make a database connection: {0}".format(dbm.path))
+        return False
+
+    # a set rather than the loaded ids array so each cycle can add and remove ids in place
+    dbm.get_follower_ids()
+    follower_ids = set(dbm.follower_ids)
+    head_ids = dbm.get_previous_head_ids()
+
+    pad_to = 22
+    cycle = 0
+    try:
+        while cycles is None or cycle < cycles:
+            wait = apim.rate_limits.spread_interval(apim.token, rate_minions.FOLLOWERS_IDS, \
+                                                    interval)
+            print("* next check in {0:.0f} seconds.".format(wait))
+            apim.rate_limits.sleep(wait)
+            cycle += 1
+
+            apim.metrics.reset()
+            dbm.reset_counters()
+            with apim.metrics.span("run"):
+                head_ids = process_watch_cycle(dbm, apim, follower_ids, head_ids)
+                if dbm.inserted_followers or dbm.inserted_unfollowers:
+                    with apim.metrics.span("follower_index"):
+                        update_follower_index(dbm, apim.user.id, database_dir)
+
+            print("{0:<{1}s}{2}{3} (+{4} -{5})".format("followers (watch):", pad_to, Fore.GREEN, \
+                                                      len(follower_ids), dbm.inserted_followers, \
+                                                      dbm.inserted_unfollowers))
+            print_unfollowers(dbm)
+            write_run_metrics(apim, dbm, apim.user.id, True, metrics_json, metrics_prom, \
+                              followers_count=len(follower_ids))
+            if on_result:
+                on_result(get_run_result(apim, dbm, apim.user.id, True, "watch", \
+                                         len(follower_ids), len(follower_ids)))
+
+    except KeyboardInterrupt:
+        print("* watch stopped.")
+
     dbm.close_connection()
-    print("end.")
+
+    return True
+
+def init_api_minions(credentials, rate_limits=None, cache=None, shared_credentials=None):
+    """ returns an APIMinions object for a dictionary of app credentials, that also makes
+        requests with any shared credentials when they can be made sooner. """
+    apim = api_minions.APIMinions(credentials['consumer_key'], credentials['consumer_secret'], \
+                                  credentials['access_key'], credentials['access_secret'], \
+                                  rate_limits=rate_limits, cache=cache)
+    for shared in shared_credentials or []:
+        apim.add_credentials(shared['consumer_key'], shared['consumer_secret'], \
+                             shared['access_key'], shared['access_secret'])
+
+    return apim
+
+def process_batch(batch_path, update=False, restart=False, compact=False, refresh=0, \
+                  refresh_order="stale", fast=False, metrics_json=None, metrics_prom=None, \
+                  stream=False, on_result=None, cache=None):
+    """ processes the users in a batch file concurrently, spreading them across the batch
+        credentials. each request of a user without a credentials index is made with the
+        batch credentials that can make it soonest. users that are not valid or have no credentials are reported and not
+        processed. prints a line per user once all have finished. each run result is
+        passed to on_result if given, in batch file order once all have finished. the api
+        responses of all users are kept in the cache if given. """
+
+    accounts = batch_minions.load_batch_config(batch_path)
+    if accounts is None:
+        return False
+    if not accounts:
+        print("* no users in batch file: {0}".format(batch_path))
+        return False
+
+    for account in accounts:
+        try:
+            valid_user_id(account.user)
+        except argparse.ArgumentTypeError as err:
+            account.error = "user {0}".format(err)
+        if account.error:
+            print("* skipping '{0}': {1}".format(account.user, account.error))
+
+    valid_accounts = [account for account in accounts if not account.error]
+    print("* processing {0} users.".format(len(valid_accounts)))
+
+    # rate limit budgets are shared so accounts using the same token do not overspend it,
+    # and so the token with the most budget can be picked for each request
+    rate_limits = rate_minions.RateLimits()
+    refreshed_tokens = set()
+    for account in valid_accounts:
+        for credentials in [account.credentials] + account.shared_credentials:
+            if credentials['access_key'] not in refreshed_tokens:
+                refreshed_tokens.add(credentials['access_key'])
+                apim = init_api_minions(credentials, rate_limits, cache)
+                if apim.api:
+                    apim.refresh_rate_limits()
+
+    def run_account(account):
+        """ processes a batch account with its own api and database objects. """
+        apim = init_api_minions(account.credentials, rate_limits, cache, \
+                                account.shared_credentials)
+        if not apim.api:
+            print("* unable to initialize the tweepy api.")
+            return False
+
+        def set_result(result):
+            account.result = result
+
+        return process_user(apim, account.user, update, restart, interactive=False, \
+                            compact=compact, refresh=refresh, refresh_order=refresh_order, \
+                            fast=fast, metrics_json=metrics_json, metrics_prom=metrics_prom, \
+                            metrics_per_user=True, stream=stream, on_result=set_result)
+
+    batch_minions.run_accounts(valid_accounts, run_account)
+
+    pad_to = 22
+    print()
+    for account in accounts:
+        print("{0:<{1}s}{2}{3}".format(account.user, pad_to, Fore.GREEN if account.success \
+                                       else Fore.RED, "done" if account.success else \
+                                       "failed: " + account.error if account.error else \
+                                       "failed"))
+        if on_result:
+            failed_result = {"user": {"id": account.user}, "success": False}
+            if account.error:
+                failed_result["error"] = account.error
+            on_result(account.result or failed_result)
+
+    return all(account.success for account in accounts)
+
+def main():
+    """ retrieves, processes and databases a users followers. """
+
+    user_args = get_arguments()
+
+    # json and ndjson runs are unattended, their run results are the only output on stdout
+    on_result = None
+    interactive = True
+    if user_args.format == "text":
+        init_text_output()
+        print_art()
+    else:
+        result_stream = sys.stdout
+        sys.stdout = sys.stderr
+        interactive = False
+
+        def on_result(result):
+            write_run_result(result, user_args.format, result_stream)
+
+    # api responses are kept for reruns, or served from a recorded run when replaying
+    cache = None
+    if user_args.cache:
+        cache = cache_minions.PageCache(user_args.cache, user_args.cache_ttl, \
+                                        user_args.cache_size, user_args.replay)
+
+    try:
+        if user_args.batch:
+            # a json batch is written as one list of the run results
+            results = []
+            process_batch(user_args.batch, user_args.update, user_args.restart, \
+                          user_args.compact, user_args.refresh, user_args.refresh_order, \
+                          user_args.fast, user_args.metrics_json, user_args.metrics_prom, \
+                          user_args.stream, on_result=results.append, cache=cache)
+            if user_args.format == "json":
+                write_run_result(results, "json", result_stream)
+            elif user_args.format == "ndjson":
+                for result in results:
+                    on_result(result)
+            print("end.")
+            return
+
+        # reports, searches, exports and overlaps read the databases, numeric user ids need no
+        # api requests
+        database_only = user_args.report or user_args.search or user_args.export or \
+            user_args.overlap
+        apim = None
+        if not database_only or \
+           not all(user.isdigit() for user in [user_args.user] + (user_args.overlap or [])):
+            apim = init_api_minions(batch_minions.get_env_credentials(), cache=cache)
+
+            if not apim.api:
+                print("* unable to initialize the tweepy api.")
+                sys.exit()
+
+            apim.refresh_rate_limits()
+
+        if database_only:
+            if user_args.report and not report_user(apim, user_args.user, on_result=on_result):
+                sys.exit()
+            if user_args.search and not search_user(apim, user_args.user, user_args.search, \
+                                                    on_result=on_result):
+                sys.exit()
+            if user_args.export and not export_user(apim, user_args.user, user_args.export, \
+                                                    user_args.export_format, \
+                                                    user_args.incremental, \
+                                                    user_args.export_profiles, \
+                                                    on_result=on_result):
+                sys.exit()
+            if user_args.overlap and not overlap_user(apim, user_args.user, user_args.overlap, \
+                                                      on_result=on_result):
+                sys.exit()
+            print("end.")
+            return
+
+        # a plan is printed, or with a deadline or budget picks the run options
+        if user_args.plan or user_args.deadline is not None or user_args.budget is not None:
+            strategy = plan_user(apim, user_args.user, user_args.update, user_args.fast, \
+                                 user_args.refresh, None if user_args.deadline is None \
+                                 else user_args.deadline * 60, user_args.budget, \
+                                 on_result=on_result if user_args.plan else None)
+            if not strategy:
+                sys.exit()
+            if user_args.plan:
+                print("end.")
+                return
+            user_args.update = strategy['update']
+            user_args.fast = strategy['fast']
+            user_args.refresh = strategy['refresh']
+
+        if user_args.watch:
+            watch_user(apim, user_args.user, user_args.watch, metrics_json=user_args.metrics_json, \
+                       metrics_prom=user_args.metrics_prom, on_result=on_result)
+            print("end.")
+            return
+
+        if not process_user(apim, user_args.user, user_args.update, user_args.restart, \
+                            interactive=interactive, compact=user_args.compact, \
+                            refresh=user_args.refresh, refresh_order=user_args.refresh_order, \
+                            fast=user_args.fast, metrics_json=user_args.metrics_json, \
+                            metrics_prom=user_args.metrics_prom, stream=user_args.stream, \
+                            on_result=on_result):
+            sys.exit()
+
+        print("end.")
+
+    except cache_minions.CacheMissError as err:
+        print("* replay stopped, {0}".format(err))
+        sys.exit()
 
 if __name__ == '__main__':
     main()